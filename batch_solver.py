@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Newton solver for a batch of independent cases of the same model.
+All the cases advance in lockstep: the residuals of the whole batch are
+evaluated in one vectorized call (a CompiledModel or process_eqns_batch),
+the Jacobians are found by finite differences on groups of columns that
+do not share a row, and the Newton steps of all the cases are solved with
+one sparse LU factorization of the block diagonal batch Jacobian.
+Specify values may be arrays with one value per case.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from scipy.optimize import OptimizeResult
+from compiled import CompiledModel
+from sim_utils import get_eqn_offsets
+from sparse_solver import get_sparsity, color_columns
+from specify import Specify
+
+
+class BatchJacobian():
+    '''
+    Finite difference Jacobians of a batch of cases, returned as one block diagonal sparse matrix.
+    '''
+
+    def __init__(self, unit_dict, fun, fd_step=1e-7):
+        self.fun = fun
+        self.fd_step = fd_step
+        self.pattern = get_sparsity(unit_dict)
+        self.colors = color_columns(self.pattern)
+        self.n_colors = self.colors.max() + 1
+        coo = self.pattern.tocoo()
+        self.rows = coo.row
+        self.cols = coo.col
+
+    def __call__(self, X, F, fun=None):
+        # fun overrides the residual function, e.g. for a subset of the cases
+        if fun is None:
+            fun = self.fun
+        n_batch, n_vars = X.shape
+        n_eqns = F.shape[1]
+        h = self.fd_step * np.maximum(1, np.abs(X))
+        data = np.zeros((n_batch, len(self.rows)), dtype=np.float64)
+        for color in range(self.n_colors):
+            in_color = self.colors == color
+            X_pert = X.copy()
+            X_pert[:, in_color] += h[:, in_color]
+            F_pert = fun(X_pert)
+            entries = in_color[self.cols]
+            r = self.rows[entries]
+            c = self.cols[entries]
+            data[:, entries] = (F_pert[:, r] - F[:, r]) / h[:, c]
+        offsets = np.arange(n_batch)[:, np.newaxis]
+        rows = (self.rows + offsets * n_eqns).ravel()
+        cols = (self.cols + offsets * n_vars).ravel()
+        return sp.csc_matrix((data.ravel(), (rows, cols)), shape=(n_batch * n_eqns, n_batch * n_vars))
+
+
+def newton_batch(xvar, unit_dict, fun=None, tol=1e-10, max_iter=100):
+    """
+    Solve a batch of cases of the model equations with a damped Newton
+    method, all cases in lockstep. Cases whose Newton step does not reduce
+    their residuals take Levenberg-Marquardt steps instead.
+    Parameters
+    ----------
+    xvar : array
+        initial guesses, shape (n_batch, n_vars).
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model. Specify
+        values may be arrays of shape (n_batch,).
+    fun : callable, optional
+        function of the batch of variable arrays returning the batch of
+        equations, shape (n_batch, n_eqns). The default is
+        CompiledModel(unit_dict).
+    tol : float, optional
+        convergence tolerance on the 2-norm of the residuals of each case.
+    max_iter : int, optional
+        maximum number of iterations.
+
+    Returns
+    -------
+    OptimizeResult
+        x (n_batch, n_vars), fun (n_batch, n_eqns), success (n_batch,),
+        nit (number of iterations of each case), nfev (number of batch
+        residual evaluations).
+
+    """
+    if fun is None:
+        fun = CompiledModel(unit_dict)
+    jac = BatchJacobian(unit_dict, fun)
+    X = np.array(xvar, dtype=np.float64)
+    n_batch, n_vars = X.shape
+    # specified values with one value per case, sliced to the cases still being solved
+    batch_specs = [(u, u.value) for u, _ in get_eqn_offsets(unit_dict)
+                   if isinstance(u, Specify) and np.ndim(u.value) > 0]
+
+    def fun_cases(X_cases, cases):
+        for u, value in batch_specs:
+            u.value = value[cases]
+        return np.array(fun(X_cases))
+
+    try:
+        F = fun_cases(X, np.arange(n_batch))
+        nfev = 1
+        norm_F = np.linalg.norm(F, axis=1)
+        lam = np.full(n_batch, 1e-3)
+        nit = np.zeros(n_batch, dtype=np.int64)
+        stalled = np.zeros(n_batch, dtype=bool)
+        for it in range(max_iter):
+            cases = np.where((norm_F >= tol) & ~stalled)[0]
+            if len(cases) == 0:
+                break
+            nit[cases] += 1
+            # only the cases still being solved are evaluated, differentiated and factorized
+            step = newton_batch_step(X[cases], F[cases], norm_F[cases], lam[cases], jac,
+                                     lambda X_sub, sub=slice(None), cases=cases: fun_cases(X_sub, cases[sub]))
+            X[cases], F[cases], norm_F[cases], lam[cases], accepted, n_fun = step
+            nfev += n_fun
+            stalled[cases] = ~accepted
+    finally:
+        for u, value in batch_specs:
+            u.value = value
+
+    success = norm_F < tol
+    return OptimizeResult(x=X, fun=F, success=success, nit=nit, nfev=nfev)
+
+
+def newton_batch_step(X, F, norm_F, lam, jac, fun):
+    """
+    Take one damped Newton step for each case of a batch; cases whose Newton
+    step is rejected take a Levenberg-Marquardt step instead. fun(X_sub, sub)
+    evaluates the residuals of the cases selected by sub (all by default).
+
+    Returns
+    -------
+    tuple
+        X, F, norm_F and lam after the step, a boolean array of the cases
+        whose step was accepted and the number of batch residual evaluations.
+
+    """
+    n_batch, n_vars = X.shape
+    n_eqns = F.shape[1]
+    J = jac(X, F, fun)
+    n_fun = jac.n_colors
+    accepted = np.zeros(n_batch, dtype=bool)
+
+    # Newton step with backtracking, all cases factorized together
+    try:
+        dx = splu(J).solve(-F.ravel()).reshape(n_batch, n_vars)
+        alpha = np.ones(n_batch)
+        trying = np.all(np.isfinite(dx), axis=1)
+        while np.any(trying):
+            X_try = X[trying] + alpha[trying, np.newaxis] * dx[trying]
+            F_try = fun(X_try, trying)
+            n_fun += 1
+            norm_try = np.linalg.norm(F_try, axis=1)
+            ok = norm_try <= (1 - 1e-4 * alpha[trying]) * norm_F[trying]
+            done = np.where(trying)[0][ok]
+            X[done], F[done], norm_F[done] = X_try[ok], F_try[ok], norm_try[ok]
+            accepted[done] = True
+            trying[done] = False
+            alpha[trying] /= 4
+            trying &= alpha >= 1e-3
+    except RuntimeError:
+        # singular Jacobian in at least one case
+        pass
+
+    # Levenberg-Marquardt steps for the rest
+    rejected = ~accepted
+    if np.any(rejected):
+        JtJ = (J.T @ J).tocsc()
+        g = (J.T @ F.ravel()).reshape(n_batch, n_vars)
+        d = np.maximum(JtJ.diagonal(), 1e-12)
+        while np.any(rejected):
+            lam_diag = sp.diags(np.repeat(lam, n_vars) * d)
+            try:
+                dx = splu((JtJ + lam_diag).tocsc()).solve(-g.ravel()).reshape(n_batch, n_vars)
+            except RuntimeError:
+                lam[rejected] *= 10
+                rejected &= lam <= 1e10
+                continue
+            X_try = X[rejected] + dx[rejected]
+            F_try = fun(X_try, rejected)
+            n_fun += 1
+            norm_try = np.linalg.norm(F_try, axis=1)
+            ok = norm_try < norm_F[rejected]
+            done = np.where(rejected)[0][ok]
+            X[done], F[done], norm_F[done] = X_try[ok], F_try[ok], norm_try[ok]
+            lam[done] = np.maximum(lam[done] / 10, 1e-12)
+            accepted[done] = True
+            rejected[done] = False
+            lam[rejected] *= 10
+            rejected &= lam <= 1e10
+        lam[~accepted] = 1e-3
+    return X, F, norm_F, lam, accepted, n_fun
+
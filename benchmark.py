@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of model construction, residual and Jacobian evaluation and
+full solves, for SimpleColumn models of increasing size (number of trays
+and number of components).
+Every benchmark records the best time per call over a few repeats, the
+peak memory allocated by one call (tracemalloc) and, for the solves, the
+convergence status and iteration counts. The results are written as JSON
+and can be compared with a stored baseline (a previous output) to flag
+regressions.
+
+Run from the command line, e.g.
+    python benchmark.py --n-trays 10 50 200 --n-comps 3 5 --output results.json --baseline benchmark_baseline.json
+"""
+
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+import scipy
+from scipy.optimize import root, brentq
+from stream import Stream
+from mixer import Mixer
+from specify import Specify
+from simplecolumn import SimpleColumn
+from phy_props import ComponentSet
+from sim_utils import map_var_to_unit1, map_eqn_to_unit1, get_unit_vars, process_eqns, process_jac
+from compiled import CompiledModel
+from layout import FlowsheetLayout
+from sparse_solver import SparseJacobian, newton_sparse
+from column_solver import solve_column
+
+# components of the benchmark models, the first n_comps are used
+# (the first five are the components of Example 8.11 in Foust, et. al.)
+BENCHMARK_COMPONENTS = ['i-butane', 'n-butane', 'i-pentane', 'n-pentane', 'n-hexane',
+                        'n-heptane', 'n-octane', 'propane', 'benzene', 'toluene']
+
+SOLVERS = ('root-hybr', 'root-lm', 'newton_sparse', 'solve_column')
+
+
+def build_column_model(n_trays, n_comps=5, pressure=45, reflux=120, vapor_reboil=160):
+    """
+    Build a model like Example 8.11 of Foust et al's textbook with any
+    number of trays and components: an equimolar saturated liquid feed of
+    100 to the middle tray, specified reflux and vapor reboil flows. The
+    variables are initialized with constant molar overflow flows and the
+    bubble point of the feed on every tray.
+    Parameters
+    ----------
+    n_trays : int
+        number of trays (at least 3).
+    n_comps : int, optional
+        number of components, from BENCHMARK_COMPONENTS.
+    pressure : float, optional
+        column pressure (psia).
+    reflux, vapor_reboil : float, optional
+        specified reflux and vapor reboil flows.
+
+    Returns
+    -------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model. The column
+        is unit_dict['column'].
+
+    """
+    assert n_comps <= len(BENCHMARK_COMPONENTS), 'At most {} components'.format(len(BENCHMARK_COMPONENTS))
+    components = ComponentSet(BENCHMARK_COMPONENTS[:n_comps])
+    feed_flow = 100
+    top_product_flow = vapor_reboil - reflux
+    unit_dict = dict()
+    for name in ['condensate', 'reflux', 'top_product', 'bottoms', 'vapor_reboil', 'bottom_product', 'feed']:
+        unit_dict[name] = Stream(n_comps=n_comps, name=name)
+    unit_dict['condenser'] = Mixer(streams_in=[unit_dict['condensate']],
+                                   streams_out=[unit_dict['reflux'], unit_dict['top_product']],
+                                   name='condenser')
+    unit_dict['reboiler'] = Mixer(streams_in=[unit_dict['bottoms']],
+                                  streams_out=[unit_dict['vapor_reboil'], unit_dict['bottom_product']],
+                                  name='reboiler')
+    unit_dict['feed_flow_spec'] = Specify(flow=True, stream=unit_dict['feed'], value=feed_flow)
+    unit_dict['feed_temp_spec'] = Specify(temperature=True, stream=unit_dict['feed'], value=100)
+    for i in range(n_comps):
+        unit_dict['feed_spec{}'.format(i)] = Specify(fraction=True, stream=unit_dict['feed'], comp_num=i,
+                                                     value=1 / n_comps)
+    unit_dict['reflux_flow_spec'] = Specify(flow=True, stream=unit_dict['reflux'], value=reflux)
+    unit_dict['vapor_reboil_flow_spec'] = Specify(flow=True, stream=unit_dict['vapor_reboil'],
+                                                  value=vapor_reboil)
+    column = SimpleColumn(n_trays=n_trays, feed_tray=n_trays // 2,
+                          feed_stream_liq=unit_dict['feed'],
+                          reflux=unit_dict['reflux'],
+                          vapor_reboil=unit_dict['vapor_reboil'],
+                          condensate=unit_dict['condensate'],
+                          bottoms=unit_dict['bottoms'],
+                          pressure=pressure,
+                          components=components,
+                          name='column')
+    unit_dict['column'] = column
+
+    # initial guess: constant molar overflow and the bubble point of the feed
+    z = np.full(n_comps, 1 / n_comps)
+    t_bubble = brentq(lambda t: np.sum(components.k_values(t, pressure)[0] * z) - 1, -300, 1000)
+    y = components.k_values(t_bubble, pressure)[0] * z
+    for i, tray in enumerate(column.trays):
+        tray.liq_stream_out.xvar[0] = reflux + (feed_flow if i <= column.feed_tray else 0)
+        tray.vap_stream_out.xvar[0] = vapor_reboil
+        tray.liq_stream_out.xvar[1] = t_bubble
+        tray.vap_stream_out.xvar[1] = t_bubble
+        tray.vap_stream_out.xvar[2:] = y
+    column.mixed_liq_feed.xvar[0] = reflux + feed_flow
+    for name, flow in [('condensate', vapor_reboil), ('reflux', reflux), ('top_product', top_product_flow),
+                       ('bottoms', reflux + feed_flow), ('vapor_reboil', vapor_reboil),
+                       ('bottom_product', feed_flow - top_product_flow)]:
+        unit_dict[name].xvar[0] = flow
+    return unit_dict
+
+
+def time_call(fn, repeat=5, min_time=0.05):
+    '''
+    return the best time per call of fn() (seconds) over repeat runs of at least min_time each
+    '''
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= min_time or number >= 1000:
+            break
+        number = max(number * 2, int(number * 1.2 * min_time / max(t, 1e-9)))
+    return min([t] + timer.repeat(repeat=repeat - 1, number=number)) / number
+
+
+def peak_memory(fn):
+    '''
+    return the peak memory (bytes) allocated during one call of fn() and its return value
+    '''
+    tracemalloc.start()
+    try:
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def run_case(n_trays, n_comps, solvers=SOLVERS, max_dense_vars=1000, repeat=5, solve_repeat=3,
+             max_solve_time=5.0):
+    """
+    Run the benchmarks of one model size.
+    Parameters
+    ----------
+    n_trays, n_comps : int
+        size of the model (see build_column_model).
+    solvers : list of str, optional
+        solvers to benchmark: 'root-<method>' (scipy.optimize.root with the
+        compiled model and the dense analytic Jacobian), 'newton_sparse'
+        and 'solve_column'.
+    max_dense_vars : int, optional
+        the dense Jacobians and the root solvers are skipped for models
+        with more variables.
+    repeat : int, optional
+        number of timing repeats of the construction, residual and Jacobian
+        benchmarks.
+    solve_repeat : int, optional
+        number of timing repeats of the solves.
+    max_solve_time : float, optional
+        solves taking longer (seconds) are not repeated.
+
+    Returns
+    -------
+    records : list of dict
+        one record per benchmark: benchmark, n_trays, n_comps, n_vars,
+        time (seconds per call), peak_memory (bytes) and, for the solves,
+        success, nit (None for the solvers that do not report it), nfev and
+        residual (2-norm).
+
+    """
+    unit_dict = build_column_model(n_trays, n_comps)
+    x0 = get_unit_vars(unit_dict)
+    n_vars = len(x0)
+    eqns = np.zeros(n_vars, dtype=np.float64)
+    map_var_to_unit1(x0.copy(), unit_dict)
+    map_eqn_to_unit1(eqns, unit_dict)
+    compiled = CompiledModel(unit_dict)
+    sparse_jac = SparseJacobian(unit_dict)
+    # the layout binds the units to its own arrays, so it gets its own copy of the model
+    layout_dict = build_column_model(n_trays, n_comps)
+    layout = FlowsheetLayout(layout_dict)
+    layout_compiled = CompiledModel(layout_dict)
+    dense = n_vars <= max_dense_vars
+
+    benchmarks = [('build', lambda: build_column_model(n_trays, n_comps)),
+                  ('CompiledModel', lambda: compiled(x0, unit_dict, eqns)),
+                  ('FlowsheetLayout.residual', lambda: layout.residual(x0)),
+                  ('process_eqns', lambda: process_eqns(x0, unit_dict, eqns)),
+                  ('SparseJacobian', lambda: sparse_jac(x0, unit_dict, eqns))]
+    if dense:
+        benchmarks += [('FlowsheetLayout.jacobian', lambda: layout.jacobian(x0)),
+                       ('process_jac', lambda: process_jac(x0.copy(), unit_dict, eqns))]
+
+    records = []
+    for name, fn in benchmarks:
+        peak, _ = peak_memory(fn)
+        records.append(dict(benchmark=name, n_trays=n_trays, n_comps=n_comps, n_vars=n_vars,
+                            time=time_call(fn, repeat), peak_memory=peak))
+
+    for solver in solvers:
+        if solver.startswith('root-'):
+            if not dense:
+                continue
+            method = solver[len('root-'):]
+            options = {'maxiter': 250} if method == 'lm' else {}
+
+            def solve():
+                return root(layout_compiled, x0.copy(), args=(layout_dict, layout.eqns), jac=layout.jacobian,
+                            method=method, options=options)
+        elif solver == 'newton_sparse':
+            def solve():
+                return newton_sparse(x0.copy(), unit_dict, eqns, fun=compiled, jac=sparse_jac)
+        elif solver == 'solve_column':
+            def solve():
+                return solve_column(x0.copy(), unit_dict, unit_dict['column'], eqns)
+        else:
+            raise ValueError('Unknown solver {}'.format(solver))
+        peak, res = peak_memory(solve)
+        times = []
+        for _ in range(solve_repeat):
+            start = time.perf_counter()
+            solve()
+            times.append(time.perf_counter() - start)
+            if times[-1] > max_solve_time:
+                break
+        records.append(dict(benchmark=solver, n_trays=n_trays, n_comps=n_comps, n_vars=n_vars,
+                            time=min(times), peak_memory=peak, success=bool(res.success),
+                            nit=res.get('nit'), nfev=res.get('nfev'),
+                            residual=float(np.linalg.norm(res.fun))))
+    return records
+
+
+def run(n_trays=(10, 20, 50, 100, 200, 500), n_comps=(3, 5), solvers=SOLVERS, max_dense_vars=1000, repeat=5,
+        solve_repeat=3, max_solve_time=5.0, verbose=False):
+    '''
+    run the benchmarks of all the model sizes, return a dict with the environment (meta) and the records
+    (results, see run_case)
+    '''
+    results = []
+    for nt in n_trays:
+        for nc in n_comps:
+            records = run_case(nt, nc, solvers, max_dense_vars, repeat, solve_repeat, max_solve_time)
+            if verbose:
+                print(format_records(records), end='', flush=True)
+            results += records
+    meta = dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'), python=platform.python_version(),
+                numpy=np.__version__, scipy=scipy.__version__, platform=platform.platform(),
+                processor=platform.processor())
+    return dict(meta=meta, results=results)
+
+
+def format_records(records):
+    '''
+    return the records as a text table
+    '''
+    s = ''
+    for r in records:
+        s += '{:>5} {:>3} {:>7} {:<26} {:>12.6f} s {:>10.1f} kB'.format(
+            r['n_trays'], r['n_comps'], r['n_vars'], r['benchmark'], r['time'], r['peak_memory'] / 1024)
+        if 'success' in r:
+            s += '  success={} nit={} nfev={}'.format(r['success'], r['nit'], r['nfev'])
+        s += '\n'
+    return s
+
+
+def compare(results, baseline, time_tol=0.25, memory_tol=0.25):
+    """
+    Compare benchmark results with a baseline.
+    Parameters
+    ----------
+    results, baseline : dict
+        outputs of run (or their JSON files, loaded).
+    time_tol, memory_tol : float, optional
+        relative increase of the time and of the peak memory flagged as a
+        regression.
+
+    Returns
+    -------
+    regressions : list of str
+        one line per regression: slower, more memory, more iterations or
+        no longer converged.
+
+    """
+    def key(r):
+        return (r['benchmark'], r['n_trays'], r['n_comps'])
+
+    base = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        name = '{} n_trays={} n_comps={}'.format(*key(r))
+        if r['time'] > b['time'] * (1 + time_tol):
+            regressions.append('{}: time {:.6g} s, baseline {:.6g} s'.format(name, r['time'], b['time']))
+        if r['peak_memory'] > b['peak_memory'] * (1 + memory_tol):
+            regressions.append('{}: peak memory {} B, baseline {} B'.format(name, r['peak_memory'],
+                                                                          b['peak_memory']))
+        if b.get('success') and not r.get('success'):
+            regressions.append('{}: did not converge'.format(name))
+        elif (r.get('nit') or 0) > (b.get('nit') or 0):
+            regressions.append('{}: {} iterations, baseline {}'.format(name, r['nit'], b['nit']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of SimpleColumn models of increasing size.')
+    parser.add_argument('--n-trays', type=int, nargs='+', default=[10, 20, 50, 100, 200, 500])
+    parser.add_argument('--n-comps', type=int, nargs='+', default=[3, 5])
+    parser.add_argument('--solvers', nargs='+', default=list(SOLVERS))
+    parser.add_argument('--max-dense-vars', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--solve-repeat', type=int, default=3)
+    parser.add_argument('--max-solve-time', type=float, default=5.0)
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare with')
+    parser.add_argument('--time-tol', type=float, default=0.25)
+    parser.add_argument('--memory-tol', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run(args.n_trays, args.n_comps, args.solvers, args.max_dense_vars, args.repeat,
+                  args.solve_repeat, args.max_solve_time, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_tol, args.memory_tol)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            return 1
+        print('no regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
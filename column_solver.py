@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Newton solver specialised for a SimpleColumn (Naphtali-Sandholm style).
+The variables and equations are ordered by stage: the streams leaving tray i
+and the equations of tray i form stage i. Tray i only couples to trays i-1
+and i+1, so the stage part of the Jacobian is block tridiagonal. Everything
+else (condenser, reboiler and feed Mixer objects, Connector and Specify
+objects, streams outside the column) forms a small border, which is
+eliminated with a Schur complement. The block tridiagonal part is factorized
+with the block Thomas algorithm.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.linalg import lu_factor, lu_solve
+from sim_utils import get_var_offsets, get_eqn_offsets
+from sparse_solver import SparseJacobian, newton_sparse
+
+
+class BlockTridiagonalSolver():
+    '''
+    Linear solver for the Newton steps of a model containing a SimpleColumn.
+    Calling the object with (J, f) returns the solution of J dx = f, in the original variable order.
+    '''
+
+    def __init__(self, unit_dict, column):
+        self.column = column
+        var_offsets = get_var_offsets(unit_dict)
+        eqn_offsets = dict(get_eqn_offsets(unit_dict))
+        self.n_vars = sum(u.n_vars for u in var_offsets)
+        self.n_eqns = sum(u.n_eqns for u in eqn_offsets)
+
+        def index(offsets, units, size):
+            return np.concatenate([np.arange(offsets[u], offsets[u]+getattr(u, size)) for u in units])
+
+        # stage i: equations of tray i, variables of the streams leaving tray i (and of the tray itself, if any)
+        self.stage_vars = []
+        self.stage_eqns = []
+        for i_tray, tray in enumerate(column.trays):
+            units = [u for u in (tray, column.tray_liq_stream[i_tray], column.tray_vap_stream[i_tray])
+                     if u.n_vars > 0]
+            self.stage_vars.append(index(var_offsets, units, 'n_vars'))
+            self.stage_eqns.append(index(eqn_offsets, [tray], 'n_eqns'))
+            assert len(self.stage_vars[-1]) == len(self.stage_eqns[-1]), \
+                '{}: stage {} has {} equations and {} variables'.format(column.name, i_tray,
+                len(self.stage_eqns[-1]), len(self.stage_vars[-1]))
+        stage_vars = np.concatenate(self.stage_vars)
+        stage_eqns = np.concatenate(self.stage_eqns)
+        self.border_vars = np.setdiff1d(np.arange(self.n_vars), stage_vars)
+        self.border_eqns = np.setdiff1d(np.arange(self.n_eqns), stage_eqns)
+
+        # stage ordered permutation, border last
+        self.col_perm = np.concatenate((stage_vars, self.border_vars))
+        self.row_perm = np.concatenate((stage_eqns, self.border_eqns))
+        self.col_start = np.cumsum([0] + [len(v) for v in self.stage_vars])
+        self.row_start = np.cumsum([0] + [len(e) for e in self.stage_eqns])
+        self.n_stage = self.col_start[-1]
+
+        self.block_size = len(self.stage_vars[0])
+        assert all(len(v) == self.block_size for v in self.stage_vars), \
+            '{}: all stages must have the same number of variables'.format(column.name)
+        self.stage_of_row = np.repeat(np.arange(column.n_trays), self.block_size)
+
+        # the stage part of the Jacobian has to be block tridiagonal
+        pattern = SparseJacobian(unit_dict).pattern[self.row_perm, :][:, self.col_perm]
+        stage_of_col = np.repeat(np.arange(column.n_trays), np.diff(self.col_start))
+        for i in range(column.n_trays):
+            block = pattern[self.row_start[i]:self.row_start[i+1], :self.n_stage]
+            coupled = np.unique(stage_of_col[block.indices])
+            assert np.all(np.abs(coupled - i) <= 1), \
+                '{}: tray {} is coupled to trays {}, which is not block tridiagonal'.format(column.name, i, coupled)
+
+    def __call__(self, J, f):
+        n_trays = self.column.n_trays
+        r = self.row_start
+        c = self.col_start
+        ns = self.n_stage
+        Jp = sp.csr_matrix(sp.csr_matrix(J)[self.row_perm, :][:, self.col_perm])
+        fp = np.asarray(f, dtype=np.float64)[self.row_perm]
+
+        # scatter the stage part into dense lower, diagonal and upper blocks in one pass
+        A = Jp[:ns, :ns].tocoo()
+        i_row = self.stage_of_row[A.row]
+        i_col = self.stage_of_row[A.col]
+        m = self.block_size
+        blocks = np.zeros((3, n_trays, m, m), dtype=np.float64)
+        blocks[i_col - i_row + 1, i_row, A.row - r[i_row], A.col - c[i_col]] = A.data
+        lower, diagonal, upper = blocks
+
+        # right hand sides of the stage rows: f and the border columns (B)
+        rhs = np.hstack((fp[:ns, np.newaxis], Jp[:ns, ns:].toarray()))
+        rhs = rhs.reshape(n_trays, m, -1)
+
+        # block Thomas algorithm, forward elimination
+        diag = []
+        for i in range(n_trays):
+            D = diagonal[i]
+            if i > 0:
+                W = lower[i] @ lu_solve(diag[i-1], np.hstack((upper[i-1], rhs[i-1])))
+                D = D - W[:, :m]
+                rhs[i] -= W[:, m:]
+            diag.append(lu_factor(D))
+
+        # back substitution, gives A^-1 [f, B]
+        sol = np.zeros_like(rhs)
+        for i in range(n_trays - 1, -1, -1):
+            b = rhs[i]
+            if i < n_trays - 1:
+                b = b - upper[i] @ sol[i+1]
+            sol[i] = lu_solve(diag[i], b)
+        sol = sol.reshape(ns, -1)
+        Ainv_f = sol[:, 0]
+        Ainv_B = sol[:, 1:]
+
+        # Schur complement for the border variables
+        C = Jp[ns:, :ns]
+        Db = Jp[ns:, ns:].toarray()
+        S = Db - C @ Ainv_B
+        dx_border = np.linalg.solve(S, fp[ns:] - C @ Ainv_f)
+        dx_stage = Ainv_f - Ainv_B @ dx_border
+
+        dx = np.zeros(self.n_vars, dtype=np.float64)
+        dx[self.col_perm] = np.concatenate((dx_stage, dx_border))
+        return dx
+
+
+def solve_column(xvar, unit_dict, column, eqns, tol=1e-10, max_iter=100, callback=None, scaling=None):
+    """
+    Solve a model containing a SimpleColumn with Newton's method, using the
+    block tridiagonal structure of the column for the Newton steps.
+    Parameters
+    ----------
+    xvar : array
+        initial guess for the variable array.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    column : SimpleColumn
+        the column in unit_dict whose trays form the stages.
+    eqns : array
+        equations for all the Unit objects in the model.
+    tol : float, optional
+        convergence tolerance on the 2-norm of the residuals.
+    max_iter : int, optional
+        maximum number of iterations.
+    callback : callable, optional
+        called as callback(nit, x, f) at every iteration, see
+        sparse_solver.newton_sparse.
+    scaling : Scaling or 'auto', optional
+        scaling of the variables and equations, see
+        sparse_solver.newton_sparse.
+
+    Returns
+    -------
+    OptimizeResult
+        same as sparse_solver.newton_sparse. x has the same layout as
+        xvar, so it can be passed to map_var_to_unit1.
+
+    """
+    return newton_sparse(xvar, unit_dict, eqns, linear_solver=BlockTridiagonalSolver(unit_dict, column),
+                         tol=tol, max_iter=max_iter, callback=callback, scaling=scaling)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Train of two columns with a recycle, for the sequential-modular solver.
+The fresh feed of Example 8.11 of Foust et al's textbook is mixed with a
+recycle stream and fed to the first column, which removes the butanes.
+Its bottoms are fed to the second column, which separates the pentanes
+from n-hexane. Part of the top product of the second column is recycled
+to the feed of the first column.
+"""
+
+import numpy as np
+from sim_utils import *
+from stream import Stream
+from mixer import Mixer
+from connector import Connector
+from specify import Specify
+from simplecolumn import SimpleColumn
+from sequential import SequentialModular
+
+N_COMPS = 5
+
+
+def build_model(recycle_flow=10):
+    """
+    Build the model of the train.
+    Parameters
+    ----------
+    recycle_flow : float, optional
+        specified flow of the recycle stream. The default is 10.
+
+    Returns
+    -------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model. The
+        columns are unit_dict['column1'] and unit_dict['column2'].
+
+    """
+    unit_dict = dict()
+
+    # fresh feed, mixed with the recycle
+    fresh_feed = Stream(n_comps=N_COMPS, name='Fresh feed')
+    recycle = Stream(n_comps=N_COMPS, name='Recycle')
+    feed1 = Stream(n_comps=N_COMPS, name='Feed 1')
+    unit_dict['fresh_feed'] = fresh_feed
+    unit_dict['recycle'] = recycle
+    unit_dict['feed1'] = feed1
+    unit_dict['feed_mixer'] = Mixer(streams_in=[fresh_feed, recycle], streams_out=[feed1], name='Feed mixer')
+    unit_dict['fresh_feed_flow_spec'] = Specify(flow=True, stream=fresh_feed, value=100)
+    unit_dict['fresh_feed_temp_spec'] = Specify(temperature=True, stream=fresh_feed, value=100)
+    for i, z in enumerate([0.1, 0.3, 0.2, 0.3, 0.1]):
+        unit_dict['fresh_feed_spec{}'.format(i)] = Specify(fraction=True, stream=fresh_feed, comp_num=i, value=z)
+
+    # the columns, with their condensers and reboilers
+    for n, (n_trays, feed_tray, reflux_flow, vapor_reboil_flow) in enumerate([(15, 7, 120, 160),
+                                                                            (15, 7, 150, 210)]):
+        prefix = 'column{}_'.format(n + 1)
+        streams = dict()
+        for name in ['condensate', 'reflux', 'top_product', 'bottoms', 'vapor_reboil', 'bottom_product']:
+            streams[name] = Stream(n_comps=N_COMPS, name='Column {} {}'.format(n + 1, name.replace('_', ' ')))
+            unit_dict[prefix + name] = streams[name]
+        unit_dict[prefix + 'condenser'] = Mixer(streams_in=[streams['condensate']],
+                                                streams_out=[streams['reflux'], streams['top_product']],
+                                                name='Column {} condenser'.format(n + 1))
+        unit_dict[prefix + 'reboiler'] = Mixer(streams_in=[streams['bottoms']],
+                                               streams_out=[streams['vapor_reboil'], streams['bottom_product']],
+                                               name='Column {} reboiler'.format(n + 1))
+        unit_dict[prefix + 'reflux_flow_spec'] = Specify(flow=True, stream=streams['reflux'], value=reflux_flow)
+        unit_dict[prefix + 'vapor_reboil_flow_spec'] = Specify(flow=True, stream=streams['vapor_reboil'],
+                                                               value=vapor_reboil_flow)
+        if n == 0:
+            feed = feed1
+        else:
+            # the bottom product of the first column is the feed of the second
+            feed = Stream(n_comps=N_COMPS, name='Feed 2')
+            unit_dict['feed2'] = feed
+            unit_dict['feed2_connector'] = Connector(unit_dict['column1_bottom_product'], feed,
+                                                     name='Feed 2 connector')
+        unit_dict['column{}'.format(n + 1)] = SimpleColumn(n_trays=n_trays, feed_tray=feed_tray,
+                                                           feed_stream_liq=feed,
+                                                           reflux=streams['reflux'],
+                                                           vapor_reboil=streams['vapor_reboil'],
+                                                           condensate=streams['condensate'],
+                                                           bottoms=streams['bottoms'],
+                                                           pressure=45,
+                                                           name='column{}'.format(n + 1))
+
+    # part of the top product of the second column is recycled
+    product2 = Stream(n_comps=N_COMPS, name='Pentanes product')
+    unit_dict['product2'] = product2
+    unit_dict['splitter'] = Mixer(streams_in=[unit_dict['column2_top_product']], streams_out=[product2, recycle],
+                                  name='Recycle splitter')
+    unit_dict['recycle_flow_spec'] = Specify(flow=True, stream=recycle, value=recycle_flow)
+
+    return unit_dict
+
+
+if __name__ == '__main__':
+    unit_dict = build_model()
+    sm = SequentialModular(unit_dict)
+    print(sm.summary())
+
+    # sequential-modular solve
+    result = sm.solve(method='wegstein')
+    print('sequential-modular: success {}, {} iterations, tear error {}'.format(
+        result.success, result.nit, result.error))
+
+    # equation-oriented solve of the whole model, from the sequential-modular solution
+    xvar = get_unit_vars(unit_dict)
+    eqns = np.zeros(len(xvar), dtype=np.float64)
+    result = sm.solve_equation_oriented(xvar, eqns)
+    print('equation-oriented: success {}, {} iterations'.format(result.success, result.nit))
+
+    for name in ['column1', 'column2']:
+        print(name)
+        print(unit_dict[name].profile()[['T', 'L', 'V']])
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled model: evaluates the equations of all the Unit objects in a model
+with a handful of NumPy array operations instead of one Python call per unit.
+The positions of the variables and equations of every Tray, Mixer, Connector
+and Specify object are worked out once, when the model is compiled. Units
+of any other type (and trays in dynamic mode) are evaluated with their own
+calculate method.
+"""
+
+import numpy as np
+from sim_utils import get_var_offsets, get_eqn_offsets
+from layout import FlowsheetLayout
+from phy_props import k_values
+from tray import Tray
+from mixer import Mixer
+from connector import Connector
+from specify import Specify
+
+
+class CompiledModel():
+    '''
+    Compiled version of sim_utils.process_eqns for the Unit objects in unit_dict.
+    Calling the object with (xvar, unit_dict, eqns) evaluates the equations, so it can be passed to
+    scipy.optimize.root in place of process_eqns. Parameters of the units (pressure, tray efficiency,
+    specified values, flow and temperature differences) are read on every call, so updates to the units
+    are picked up. The structure of the model must not change after it is compiled.
+    '''
+
+    def __init__(self, unit_dict):
+        self.unit_dict = unit_dict
+        self.var_offsets = get_var_offsets(unit_dict)
+        eqn_offsets = get_eqn_offsets(unit_dict)
+        self.n_vars = sum(u.n_vars for u in self.var_offsets)
+        self.n_eqns = sum(u.n_eqns for u, _ in eqn_offsets)
+        self.eqns = np.zeros(self.n_eqns, dtype=np.float64)
+        # variables of streams outside unit_dict are constants, appended after xvar
+        self.external = []
+
+        trays = []
+        mixers = dict()
+        connectors = []
+        specs = []
+        self.others = []
+        for unit, e_idx in eqn_offsets:
+            if type(unit) is Tray and not unit.dynamic:
+                trays.append((unit, e_idx))
+            elif type(unit) is Mixer:
+                mixers.setdefault((unit.n_in, unit.n_out), []).append((unit, e_idx))
+            elif type(unit) is Connector:
+                connectors.append((unit, e_idx))
+            elif type(unit) is Specify:
+                specs.append((unit, e_idx))
+            else:
+                self.others.append((unit, e_idx))
+
+        # units of other types are evaluated through a layout of the whole model
+        self.layout = FlowsheetLayout(unit_dict) if self.others else None
+
+        self.trays = [t for t, _ in trays]
+        if trays:
+            self.tray_liq_in = self.gather_index([t.liq_stream_in for t in self.trays])
+            self.tray_vap_in = self.gather_index([t.vap_stream_in for t in self.trays])
+            self.tray_liq_out = self.gather_index([t.liq_stream_out for t in self.trays])
+            self.tray_vap_out = self.gather_index([t.vap_stream_out for t in self.trays])
+            self.tray_eqns = self.scatter_index(trays)
+            # Antoine constants of the components of each tray (n_trays x n_comps)
+            self.tray_A = np.array([t.components.A for t in self.trays])
+            self.tray_B = np.array([t.components.B for t in self.trays])
+            self.tray_C = np.array([t.components.C for t in self.trays])
+            # last (temperatures, pressures, efficiencies) and K values of the trays
+            self.k_eq_key = None
+            self.k_eq_value = None
+
+        self.mixers = []
+        for (n_in, n_out), group in mixers.items():
+            units = [m for m, _ in group]
+            streams_in = self.gather_index([s for m in units for s in m.streams_in])
+            streams_out = self.gather_index([s for m in units for s in m.streams_out])
+            self.mixers.append((n_in, n_out,
+                                streams_in.reshape(len(units), n_in, -1),
+                                streams_out.reshape(len(units), n_out, -1),
+                                self.scatter_index(group)))
+
+        self.connectors = [c for c, _ in connectors]
+        if connectors:
+            self.connector_in = self.gather_index([c.stream_in for c in self.connectors])
+            self.connector_out = self.gather_index([c.stream_out for c in self.connectors])
+            self.connector_eqns = self.scatter_index(connectors)
+
+        self.specs = [s for s, _ in specs]
+        if specs:
+            spec_var = []
+            for s in self.specs:
+                if s.flow:
+                    spec_var.append(0)
+                elif s.temperature:
+                    spec_var.append(1)
+                else:
+                    spec_var.append(2 + s.comp_num)
+            self.spec_index = self.gather_index([s.stream for s in self.specs])[:, 0] + np.array(spec_var)
+            self.spec_eqns = np.array([e_idx for _, e_idx in specs])
+
+    def gather_index(self, streams):
+        '''
+        return an array (n_streams x n_vars) of the positions of the variables of each stream
+        '''
+        idx = []
+        for s in streams:
+            if s in self.var_offsets:
+                offset = self.var_offsets[s]
+            else:
+                if s not in self.external:
+                    self.external.append(s)
+                offset = self.n_vars + sum(u.n_vars for u in self.external[:self.external.index(s)])
+            idx.append(offset + np.arange(s.n_vars))
+        return np.array(idx)
+
+    def scatter_index(self, units):
+        '''
+        return an array (n_units x n_eqns) of the positions of the equations of each unit
+        '''
+        return np.array([e_idx + np.arange(u.n_eqns) for u, e_idx in units])
+
+    def __call__(self, xvar, unit_dict=None, eqns=None):
+        # xvar may have leading batch dimensions, shape (..., n_vars)
+        x = np.asarray(xvar, dtype=np.float64)
+        batch_shape = x.shape[:-1]
+        if eqns is None:
+            if batch_shape:
+                eqns = np.zeros(batch_shape + (self.n_eqns,), dtype=np.float64)
+            else:
+                eqns = self.eqns
+        if self.external:
+            x = np.concatenate([x] + [np.broadcast_to(s.xvar, batch_shape + (s.n_vars,)) for s in self.external],
+                               axis=-1)
+
+        if self.trays:
+            eqns[..., self.tray_eqns] = self.tray_eqns_values(x)
+        for n_in, n_out, idx_in, idx_out, idx_eqns in self.mixers:
+            eqns[..., idx_eqns] = self.mixer_eqns_values(x[..., idx_in], x[..., idx_out])
+        if self.connectors:
+            diff = np.zeros(self.connector_in.shape, dtype=np.float64)
+            diff[:, 0] = [c.flow_diff for c in self.connectors]
+            diff[:, 1] = [c.temp_diff for c in self.connectors]
+            eqns[..., self.connector_eqns] = x[..., self.connector_in] + diff - x[..., self.connector_out]
+        if self.specs:
+            # specified values may be arrays with the batch shape
+            values = np.stack([np.broadcast_to(np.asarray(s.value, dtype=np.float64), batch_shape)
+                               for s in self.specs], axis=-1)
+            eqns[..., self.spec_eqns] = values - x[..., self.spec_index]
+        if self.others:
+            if batch_shape:
+                raise NotImplementedError('batches are not supported for units of type {}'.format(
+                    ', '.join(sorted(set(type(u).__name__ for u, _ in self.others)))))
+            self.layout.set_x(xvar)
+            for unit, e_idx in self.others:
+                unit.calculate()
+                eqns[e_idx:e_idx+unit.n_eqns] = unit.eqns
+        return eqns
+
+    def tray_eqns_values(self, x):
+        '''
+        return the equations of all the trays (... x n_trays x n_eqns), same order as Tray.calculate
+        '''
+        liq_in = x[..., self.tray_liq_in]
+        vap_in = x[..., self.tray_vap_in]
+        liq_out = x[..., self.tray_liq_out]
+        vap_out = x[..., self.tray_vap_out]
+        n_comps = liq_in.shape[-1] - 2
+        e = np.empty(liq_in.shape[:-1] + (2 * n_comps + 4,), dtype=np.float64)
+        # total mass balance
+        e[..., 0] = liq_in[..., 0] + vap_in[..., 0] - liq_out[..., 0] - vap_out[..., 0]
+        # equimolal overflow
+        e[..., 1] = liq_in[..., 0] - liq_out[..., 0]
+        # liquid and vapor leaving at the same temperature
+        e[..., 2] = vap_out[..., 1] - liq_out[..., 1]
+        # fractions sum to one
+        e[..., 3] = liq_out[..., 2:].sum(axis=-1) - 1
+        e[..., 4] = vap_out[..., 2:].sum(axis=-1) - 1
+        # component balances (all components except the last one)
+        e[..., 5:4+n_comps] = liq_in[..., 0:1] * liq_in[..., 2:1+n_comps] + \
+            vap_in[..., 0:1] * vap_in[..., 2:1+n_comps] - \
+            liq_out[..., 0:1] * liq_out[..., 2:1+n_comps] - vap_out[..., 0:1] * vap_out[..., 2:1+n_comps]
+        # vapor-liquid equilibrium
+        K_eq = self.tray_k_eq(liq_out[..., 1:2])
+        e[..., 4+n_comps:] = vap_out[..., 2:] - K_eq * liq_out[..., 2:]
+        return e
+
+    def tray_k_eq(self, temperature):
+        '''
+        return the K values of all the trays (... x n_trays x n_comps) at the tray temperatures
+        (... x n_trays x 1)
+        the K values of the last call are reused for the trays whose temperature, pressure and
+        efficiency are unchanged (e.g. while the finite differences perturb flows or fractions)
+        the trays with a simplified K model (Tray.k_model) are evaluated with the model only
+        '''
+        n_trays = len(self.trays)
+        pressure = np.array([t.pressure for t in self.trays], dtype=np.float64)[:, np.newaxis]
+        efficiency = np.array([t.tray_efficiency for t in self.trays], dtype=np.float64)[:, np.newaxis]
+        modeled = np.array([t.k_model is not None for t in self.trays], dtype=bool)
+        shape = temperature.shape[:-1]
+        pressure = np.broadcast_to(pressure, shape + (1,))
+        efficiency = np.broadcast_to(efficiency, shape + (1,))
+        if self.k_eq_key is not None and self.k_eq_key[0].shape == temperature.shape:
+            T_last, P_last, eff_last, modeled_last = self.k_eq_key
+            # the K values of trays whose model has been removed since the last call are not stored
+            changed = ((temperature != T_last) | (pressure != P_last) | (efficiency != eff_last))[..., 0] | \
+                (modeled != modeled_last)
+            K_eq = self.k_eq_value.copy()
+        else:
+            changed = np.ones(shape, dtype=bool)
+            K_eq = np.empty(shape + (self.tray_A.shape[1],), dtype=np.float64)
+        changed &= ~modeled
+        if np.any(changed):
+            tray = np.broadcast_to(np.arange(n_trays), shape)[changed]
+            K_eq[changed], _ = k_values(temperature[changed], pressure[changed], efficiency[changed],
+                                        self.tray_A[tray], self.tray_B[tray], self.tray_C[tray])
+        # trays with a simplified K model
+        for i in np.flatnonzero(modeled):
+            K_eq[..., i, :] = self.trays[i].k_model(temperature[..., i, :])[0]
+        self.k_eq_key = (temperature.copy(), pressure.copy(), efficiency.copy(), modeled)
+        self.k_eq_value = K_eq
+        return K_eq
+
+    def mixer_eqns_values(self, streams_in, streams_out):
+        '''
+        return the equations of a group of mixers with the same number of streams in and out
+        (... x n_mixers x n_eqns), same order as Mixer.calculate
+        '''
+        total_in = streams_in[..., 0].sum(axis=-1)
+        # flow weighted average temperature and fractions in
+        # with no flow in, the attributes of the first stream in are used
+        no_flow = (total_in == 0)[..., np.newaxis]
+        avg_in = (streams_in[..., 0:1] * streams_in[..., 1:]).sum(axis=-2) / \
+            np.where(no_flow, 1, total_in[..., np.newaxis])
+        avg_in = np.where(no_flow, streams_in[..., 0, 1:], avg_in)
+        e = np.empty(total_in.shape + (1 + streams_out.shape[-2] * avg_in.shape[-1],), dtype=np.float64)
+        e[..., 0] = total_in - streams_out[..., 0].sum(axis=-1)
+        e[..., 1:] = (avg_in[..., np.newaxis] - np.swapaxes(streams_out[..., 1:], -1, -2)).reshape(e[..., 1:].shape)
+        return e
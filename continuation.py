@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Continuation (homotopy) along a path in specification space.
+Starting from a converged solution, the solution is followed as the inputs
+move along a piecewise linear path through a list of points, with
+pseudo-arclength steps: a tangent predictor, then Newton corrections of the
+model equations augmented with the arclength equation. The path parameter is
+one of the unknowns, so the steps can go round turning points, which are
+detected from the sign of the tangent. Wherever the path passes one of the
+requested points, the model is solved at that point from the secant
+between the two neighbouring steps.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from scipy.optimize import OptimizeResult
+from sim_utils import process_eqns, map_var_to_unit1, set_input
+from sparse_solver import SparseJacobian, newton_sparse
+
+
+class SpecificationPath():
+    '''
+    Piecewise linear path through the rows of values (one column per input).
+    The path parameter s runs from 0 at the first row to n_points-1 at the last row.
+    Outside that range the first or last segment is extrapolated.
+    '''
+
+    def __init__(self, unit_dict, inputs, values):
+        self.unit_dict = unit_dict
+        self.inputs = inputs
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+        assert self.values.shape[0] >= 2, 'a path needs at least two points'
+        assert self.values.shape[1] == len(inputs), \
+            '{} inputs and {} columns of values'.format(len(inputs), self.values.shape[1])
+        self.s_end = self.values.shape[0] - 1
+
+    def __call__(self, s):
+        '''
+        return the values of the inputs at s
+        '''
+        i = int(min(max(np.floor(s), 0), self.s_end - 1))
+        return self.values[i] + (s - i) * (self.values[i+1] - self.values[i])
+
+    def set(self, s):
+        '''
+        set the inputs of the model to their values at s
+        '''
+        for name, value in zip(self.inputs, self(s)):
+            set_input(self.unit_dict, name, value)
+        return
+
+
+def continuation(xvar, unit_dict, eqns, inputs, values, fun=None, jac=None, tol=1e-10,
+                 step=0.5, min_step=1e-4, max_step=4.0, max_corrections=8, max_steps=500):
+    """
+    Follow the solution of the model along a path in specification space.
+    Parameters
+    ----------
+    xvar : array
+        solution of the model at the first row of values.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    eqns : array
+        equations for all the Unit objects in the model.
+    inputs : list of str
+        names of the inputs, as used by sim_utils.set_input.
+    values : array
+        points of the path, one row per point, shape (n_points, n_inputs).
+    fun : callable, optional
+        function with the same arguments as process_eqns returning the
+        equations. The default is process_eqns.
+    jac : callable, optional
+        function with the same arguments as process_eqns returning the
+        sparse Jacobian. The default is SparseJacobian(unit_dict).
+    tol : float, optional
+        convergence tolerance on the 2-norm of the residuals.
+    step : float, optional
+        initial arclength step, in variables scaled by their magnitude at
+        xvar and the path parameter (1 between consecutive points).
+    min_step, max_step : float, optional
+        limits of the arclength step. The step is doubled after corrections
+        that converge in two iterations or less, and halved after
+        corrections that need more than half of max_corrections or fail.
+    max_corrections : int, optional
+        maximum number of Newton corrections of a step.
+    max_steps : int, optional
+        maximum number of arclength steps.
+
+    Returns
+    -------
+    OptimizeResult
+        x (n_points, n_vars, NaN at points not reached), success (n_points,),
+        nit (Newton iterations at each point), n_steps (number of arclength
+        steps), turning_points (list of (s, input values) where ds/darclength
+        changes sign), message. The model is left mapped to the last point
+        solved.
+
+    """
+    if fun is None:
+        fun = process_eqns
+    if jac is None:
+        jac = SparseJacobian(unit_dict)
+    path = SpecificationPath(unit_dict, inputs, values)
+    n_points = path.s_end + 1
+    x = np.array(xvar, dtype=np.float64)
+    n_vars = len(x)
+    # scale of the variables in the arclength
+    w2 = 1 / np.maximum(1, np.abs(x))**2
+
+    def residuals(x, s):
+        path.set(s)
+        return np.array(fun(x, unit_dict, eqns))
+
+    def jacobians(x, s):
+        # Jacobian of the equations with respect to x and to the path parameter s
+        f = residuals(x, s)
+        h = 1e-6
+        f_s = (residuals(x, s + h) - f) / h
+        path.set(s)
+        return f, sp.csc_matrix(jac(x, unit_dict, eqns)), f_s
+
+    def tangent(J, f_s, t_x, t_s):
+        # unit tangent, oriented along the previous tangent (t_x, t_s)
+        A = sp.bmat([[J, f_s[:, np.newaxis]], [(w2 * t_x)[np.newaxis, :], np.array([[t_s]])]], format='csc')
+        rhs = np.zeros(n_vars + 1)
+        rhs[-1] = 1
+        t = splu(A).solve(rhs)
+        t /= np.sqrt(np.sum(w2 * t[:-1]**2) + t[-1]**2)
+        return t[:-1], t[-1]
+
+    X = np.full((n_points, n_vars), np.nan)
+    success = np.zeros(n_points, dtype=bool)
+    nit = np.zeros(n_points, dtype=np.int64)
+    turning_points = []
+    message = 'Reached the end of the path.'
+
+    s = 0.0
+    f, J, f_s = jacobians(x, s)
+    assert np.linalg.norm(f) < max(tol, 1e-6), 'xvar is not a solution at the first point of the path'
+    X[0] = x
+    success[0] = True
+    last_point = 0
+    t_x, t_s = tangent(J, f_s, np.zeros(n_vars), 1.0)
+    ds = step
+    n_steps = 0
+    while s < path.s_end:
+        if n_steps == max_steps:
+            message = 'Maximum number of steps reached.'
+            break
+        n_steps += 1
+
+        # predictor along the tangent, then Newton corrections on the augmented system
+        x_pred = x + ds * t_x
+        s_pred = s + ds * t_s
+        x_new, s_new = x_pred.copy(), s_pred
+        converged = False
+        for i_corr in range(max_corrections + 1):
+            f_new = residuals(x_new, s_new)
+            if not np.all(np.isfinite(f_new)):
+                break
+            if np.linalg.norm(f_new) < tol:
+                converged = True
+                break
+            if i_corr == max_corrections:
+                break
+            g = np.sum(w2 * t_x * (x_new - x_pred)) + t_s * (s_new - s_pred)
+            f_new, J_new, f_s_new = jacobians(x_new, s_new)
+            A = sp.bmat([[J_new, f_s_new[:, np.newaxis]],
+                         [(w2 * t_x)[np.newaxis, :], np.array([[t_s]])]], format='csc')
+            try:
+                d = splu(A).solve(-np.append(f_new, g))
+            except RuntimeError:
+                # singular augmented Jacobian
+                break
+            x_new = x_new + d[:-1]
+            s_new = s_new + d[-1]
+
+        if not converged:
+            ds /= 2
+            if ds < min_step:
+                message = 'Step size below min_step at s = {}.'.format(s)
+                break
+            continue
+
+        f_new, J_new, f_s_new = jacobians(x_new, s_new)
+        t_x_new, t_s_new = tangent(J_new, f_s_new, t_x, t_s)
+
+        # solve at the points passed by the step, from the secant between the two steps
+        for k in range(last_point + 1, n_points):
+            if not (s < k <= s_new):
+                continue
+            path.set(k)
+            x_k = x + (k - s) / (s_new - s) * (x_new - x)
+            res = newton_sparse(x_k, unit_dict, eqns, fun=fun, jac=jac, tol=tol)
+            X[k] = res.x
+            success[k] = res.success
+            nit[k] = res.nit
+            last_point = k
+
+        if np.sign(t_s_new) != np.sign(t_s):
+            # the path parameter turns back: the points further on are not on this branch
+            turning_points.append((s_new, path(s_new)))
+            message = 'Turning point at s = {}.'.format(s_new)
+            x, s = x_new, s_new
+            break
+
+        if i_corr <= 2:
+            ds = min(2 * ds, max_step)
+        elif i_corr > max_corrections // 2:
+            ds = max(ds / 2, min_step)
+        x, s, t_x, t_s = x_new, s_new, t_x_new, t_s_new
+
+    # leave the model at the last point solved
+    x = X[last_point].copy()
+    path.set(last_point)
+    map_var_to_unit1(x, unit_dict)
+    fun(x, unit_dict, eqns)
+    return OptimizeResult(x=X, success=success, nit=nit, n_steps=n_steps, turning_points=turning_points,
+                          message=message)
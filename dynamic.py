@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Dynamic simulation of a model with trays in dynamic mode.
+The model equations form a DAE system: the mass and component balances of
+the dynamic trays contain the time derivatives of the tray holdups, all the
+other equations are algebraic. The system is integrated with the variable
+step BDF2 formula (BDF1 for the first step). At every step the derivatives of
+the holdups are replaced by the formula and the equations for the variables
+at the new time are solved with the sparse Newton solver, which uses the
+analytic Jacobians of the units. The step size is controlled with an
+estimate of the local error of the holdups.
+Time is in the units of the flows (e.g. hours for lbmol/h).
+"""
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+from sim_utils import get_eqn_offsets, set_input
+from layout import FlowsheetLayout
+from sparse_solver import SparseJacobian, newton_sparse
+from tray import Tray
+
+
+def get_dynamic_trays(unit_dict):
+    """
+    Get the trays in dynamic mode, in the order of the equations.
+    """
+    return [u for u, _ in get_eqn_offsets(unit_dict) if isinstance(u, Tray) and u.dynamic]
+
+
+def set_accumulation(trays, acc_coef, acc_hist):
+    '''
+    set the integration formula of the tray holdups: accumulation = acc_coef * holdups + acc_hist
+    acc_hist holds the values of all the trays, one after the other
+    '''
+    idx = 0
+    for tray in trays:
+        n = tray.liq_stream_out.n_comps
+        tray.acc_coef = acc_coef
+        tray.acc_hist = acc_hist[idx:idx+n]
+        idx += n
+    return
+
+
+def write_rows(sink, t_eval, i_eval, t_prev, x_prev, t, x):
+    '''
+    append to sink the rows (t, x) of the step from t_prev to t: the end of the step if t_eval is None,
+    otherwise the points of t_eval from i_eval up to t, interpolated (nan before t_prev)
+    return the index of the next point of t_eval
+    '''
+    if t_eval is None:
+        sink.append(t=np.float64(t), x=x)
+        return i_eval
+    while i_eval < len(t_eval) and t_eval[i_eval] <= t:
+        te = t_eval[i_eval]
+        if te < t_prev:
+            x_e = np.full_like(x, np.nan)
+        elif t == t_prev:
+            x_e = x
+        else:
+            x_e = x_prev + (te - t_prev) / (t - t_prev) * (x - x_prev)
+        sink.append(t=te, x=x_e)
+        i_eval += 1
+    return i_eval
+
+
+def integrate(xvar, unit_dict, t_span, t_eval=None, inputs=None, h0=1e-3, h_min=1e-8, h_max=np.inf,
+              rtol=1e-4, atol=1e-6, tol=1e-8, max_steps=100000, sink=None):
+    """
+    Integrate a model with trays in dynamic mode.
+    Parameters
+    ----------
+    xvar : array
+        consistent initial values of the variables, e.g. the steady state of
+        the model (found with the trays' default accumulation of zero).
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    t_span : tuple
+        (t0, t1) start and end times.
+    t_eval : array, optional
+        times at which the variables are returned (interpolated between
+        steps). The default is the times of all the steps.
+    inputs : callable, optional
+        function of time returning a dict {name: value} of inputs, as used
+        by sim_utils.set_input, e.g. a step change of a specified flow.
+        Called at the end time of every step.
+    h0 : float, optional
+        initial step size.
+    h_min, h_max : float, optional
+        limits of the step size.
+    rtol, atol : float, optional
+        relative and absolute tolerances of the local error of the holdups.
+    tol : float, optional
+        convergence tolerance of the Newton solver at every step.
+    max_steps : int, optional
+        maximum number of steps.
+    sink : ResultWriter, optional
+        if given, the rows (t, x) are appended to sink (e.g. a
+        result_store.ResultWriter) as the steps are taken, instead of
+        being kept in memory, and the result only holds the last step.
+
+    Returns
+    -------
+    OptimizeResult
+        t (times), x (variables at each time, shape (n_times, n_vars)),
+        success, message, n_steps, n_rejected, nit (total Newton
+        iterations).
+
+    """
+    trays = get_dynamic_trays(unit_dict)
+    assert trays, 'the model has no trays in dynamic mode'
+    layout = FlowsheetLayout(unit_dict)
+    jac = SparseJacobian(unit_dict)
+    t0, t1 = t_span
+
+    def holdups(x):
+        layout.set_x(x)
+        return np.concatenate([tray.holdups() for tray in trays])
+
+    def apply_inputs(t):
+        if inputs is not None:
+            for name, value in inputs(t).items():
+                set_input(unit_dict, name, value)
+        return
+
+    x = np.array(xvar, dtype=np.float64)
+    apply_inputs(t0)
+    if t_eval is not None:
+        t_eval = np.asarray(t_eval, dtype=np.float64)
+    # accepted steps: times, variables and holdups of the last three
+    history = [(t0, x, holdups(x))]
+    times = [t0]
+    X = [x]
+    if sink is not None:
+        i_eval = write_rows(sink, t_eval, 0, t0, x, t0, x)
+    h = min(h0, h_max)
+    n_steps = 0
+    n_rejected = 0
+    nit = 0
+    success = True
+    message = 'Reached the end of the time span.'
+    t = t0
+    while t < t1:
+        if n_steps == max_steps:
+            success = False
+            message = 'Maximum number of steps reached.'
+            break
+        h = min(h, h_max)
+        if t + h > t1 - 1e-12 * max(1, abs(t1)):
+            h = t1 - t
+        t_new = t + h
+        apply_inputs(t_new)
+
+        # integration formula: BDF1 for the first step, variable step BDF2 after that
+        t_n, x_n, H_n = history[-1]
+        if len(history) == 1:
+            acc_coef = 1 / h
+            acc_hist = -H_n / h
+            x_pred = x_n
+        else:
+            t_nm1, x_nm1, H_nm1 = history[-2]
+            w = h / (t_n - t_nm1)
+            acc_coef = (1 + 2*w) / (1 + w) / h
+            acc_hist = (-(1 + w) * H_n + w**2 / (1 + w) * H_nm1) / h
+            x_pred = x_n + w * (x_n - x_nm1)
+        set_accumulation(trays, acc_coef, acc_hist)
+        res = newton_sparse(x_pred, unit_dict, layout.eqns, fun=layout.residual, jac=jac, tol=tol, max_iter=10)
+        nit += res.nit
+
+        if res.success:
+            H_new = holdups(res.x)
+            if len(history) == 1:
+                err = 0.0
+            else:
+                # difference from the holdups extrapolated from the previous steps
+                # (quadratic through the last three steps, once there are three)
+                ts = np.array([s[0] for s in history])
+                Hs = np.array([s[2] for s in history])
+                H_pred = np.zeros_like(H_new)
+                for i in range(len(ts)):
+                    others = np.delete(ts, i)
+                    H_pred += Hs[i] * np.prod((t_new - others) / (ts[i] - others))
+                scale = atol + rtol * np.abs(H_new)
+                err = 2 / 9 * np.sqrt(np.mean(((H_new - H_pred) / scale)**2))
+        if not res.success or err > 1:
+            n_rejected += 1
+            h = h / 4 if not res.success else h * max(0.2, 0.9 * err**(-1/3))
+            if h < h_min:
+                success = False
+                message = 'Step size below h_min at t = {}.'.format(t)
+                break
+            continue
+
+        n_steps += 1
+        t = t_new
+        history = (history + [(t, res.x, H_new)])[-3:]
+        if sink is not None:
+            i_eval = write_rows(sink, t_eval, i_eval, history[-2][0], history[-2][1], t, res.x)
+            times[-1] = t
+            X[-1] = res.x
+        else:
+            times.append(t)
+            X.append(res.x)
+        h = h * min(5, max(0.2, 0.9 * err**(-1/3))) if err > 0 else 2 * h
+
+    # back to the steady state equations, model mapped to the last values
+    set_accumulation(trays, 0.0, np.zeros(sum(tray.liq_stream_out.n_comps for tray in trays)))
+    layout.residual(X[-1])
+
+    times = np.array(times)
+    X = np.array(X)
+    if sink is not None:
+        if t_eval is not None:
+            # points after the last step
+            for te in t_eval[i_eval:]:
+                sink.append(t=te, x=np.full_like(X[-1], np.nan))
+    elif t_eval is not None:
+        X = np.array([np.interp(t_eval, times, X[:, j], left=np.nan, right=np.nan)
+                      for j in range(X.shape[1])]).T
+        times = t_eval
+    return OptimizeResult(t=times, x=X, success=success, message=message, n_steps=n_steps,
+                          n_rejected=n_rejected, nit=nit)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Simulation contexts.
+A Flowsheet owns the numbering of the units created in it (used for their
+default names), the default component set of its trays and columns, and the
+units of its model. Units are created in the current flowsheet: the one
+entered last with a with statement in the current thread or asyncio task
+(the flowsheets entered are held in a context variable), or the process-wide
+default flowsheet if none is entered. Models built in their own flowsheets
+are independent: they can be built, solved and discarded concurrently in
+threads or asyncio tasks, and discarding a flowsheet discards its counters.
+"""
+
+import itertools
+from contextvars import ContextVar
+from phy_props import default_components
+
+# flowsheets entered in the current context, innermost last
+active_flowsheets = ContextVar('active_flowsheets', default=())
+
+
+class Flowsheet():
+    '''
+    Context of a model: counters of the units created in it (by type), the default component set
+    (phy_props.default_components if not given) and unit_dict, the dict of the units of the model.
+    Entered with a with statement, it is the current flowsheet until exit. It can be entered again (nested)
+    and in several threads or tasks at once.
+    '''
+
+    def __init__(self, components=None, name=None):
+        if components is None:
+            components = default_components
+        self.components = components
+        self.name = name
+        self.counters = dict()
+        self.unit_dict = dict()
+
+    def __enter__(self):
+        active_flowsheets.set(active_flowsheets.get() + (self,))
+        return self
+
+    def __exit__(self, *args):
+        stack = active_flowsheets.get()
+        assert stack and stack[-1] is self, 'flowsheets must be exited in the reverse order of entry'
+        active_flowsheets.set(stack[:-1])
+        return False
+
+    def number(self, unit_type):
+        '''
+        return the next number of the units of type unit_type (a class) created in the flowsheet
+        '''
+        # next() of an itertools.count is atomic, so concurrent threads get different numbers
+        return next(self.counters.setdefault(unit_type.__name__, itertools.count()))
+
+    def add(self, key, unit):
+        '''
+        add unit to unit_dict with key and return it
+        '''
+        assert key not in self.unit_dict, '{}: key {} is already used'.format(self.name, key)
+        self.unit_dict[key] = unit
+        return unit
+
+    def run(self, fun, *args, **kwargs):
+        '''
+        call fun(*args, **kwargs) in the flowsheet and return its result,
+        e.g. executor.submit(Flowsheet().run, build_and_solve) to build and solve a model in a thread
+        '''
+        with self:
+            return fun(*args, **kwargs)
+
+
+# flowsheet of the units created outside of any flowsheet
+default_flowsheet = Flowsheet(name='default')
+
+
+def current_flowsheet():
+    '''
+    return the flowsheet entered last in the current context, or default_flowsheet
+    '''
+    stack = active_flowsheets.get()
+    return stack[-1] if stack else default_flowsheet
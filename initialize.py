@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Initial guess for models containing SimpleColumn objects, to replace the
+flat default values of the streams (flow 100, temperature 100, equal
+fractions).
+The specified values are copied into their streams. For every column the
+product split is estimated with the Fenske equation at the feed bubble
+point (with half the trays as the minimum number of stages), the flows
+follow constant molal overflow from the reflux and vapor reboil flows, the
+liquid fractions are interpolated linearly from the bottoms to the feed
+and from the feed to the distillate, and each tray is at the bubble point
+of its liquid. When the reflux or vapor reboil flow is not specified, the
+reflux is 1.3 times the Underwood minimum reflux.
+"""
+
+import numpy as np
+from scipy.optimize import brentq
+from scipy.special import expit
+from scipy.linalg import solve_banded
+from sim_utils import get_unit_vars
+from simplecolumn import SimpleColumn
+from specify import Specify
+from mixer import Mixer
+
+# reflux as a multiple of the minimum reflux, when the reflux is not specified
+REFLUX_FACTOR = 1.3
+
+
+def get_units(unit_dict, unit_type):
+    '''
+    return all the units of type unit_type in unit_dict, nested units included
+    '''
+    units = []
+    for k in sorted(unit_dict.keys()):
+        u = unit_dict[k]
+        if isinstance(u, unit_type):
+            units.append(u)
+        units += get_units(u.unit_dict, unit_type)
+    return units
+
+
+def apply_specs(unit_dict):
+    '''
+    set the variables of the streams specified by the Specify objects in unit_dict to the specified values
+    '''
+    for spec in get_units(unit_dict, Specify):
+        if spec.flow:
+            spec.stream.xvar[0] = spec.value
+        elif spec.temperature:
+            spec.stream.xvar[1] = spec.value
+        elif spec.fraction:
+            spec.stream.xvar[2 + spec.comp_num] = spec.value
+    return
+
+
+def shortcut_split(components, z, feed_flow, top_product_flow, pressure, n_stages):
+    """
+    Component flows in the products of a column, from the Fenske equation
+    with the relative volatilities at the bubble point of the feed:
+    d_i / b_i = theta * alpha_i ** n_stages, theta such that the distillate
+    flow is top_product_flow.
+    Parameters
+    ----------
+    components : ComponentSet
+        components of the column.
+    z : array
+        feed fractions.
+    feed_flow, top_product_flow : float
+        flows of the feed and of the distillate.
+    pressure : float
+        column pressure (psia).
+    n_stages : float
+        number of (minimum) stages.
+
+    Returns
+    -------
+    d, b : arrays
+        component flows in the distillate and in the bottoms.
+    alpha : array
+        relative volatilities (K values at the feed bubble point).
+
+    """
+    t_feed = components.bubble_point(z, pressure)
+    alpha = components.k_values(t_feed, pressure)[0]
+    ln_alpha = np.log(alpha)
+
+    def distillate(ln_theta):
+        return np.sum(feed_flow * z * expit(ln_theta + n_stages * ln_alpha))
+
+    bound = n_stages * np.max(np.abs(ln_alpha)) + 50
+    ln_theta = brentq(lambda s: distillate(s) - top_product_flow, -bound, bound)
+    d = feed_flow * z * expit(ln_theta + n_stages * ln_alpha)
+    return d, feed_flow * z - d, alpha
+
+
+def underwood_min_reflux(alpha, z, x_top, light_key, heavy_key):
+    '''
+    return the Underwood minimum reflux ratio for a saturated liquid feed (q = 1)
+    alpha are the relative volatilities, light_key and heavy_key the indices of the key components
+    '''
+    a_lk = alpha[light_key]
+    a_hk = alpha[heavy_key]
+    theta = brentq(lambda t: np.sum(alpha * z / (alpha - t)), a_hk * (1 + 1e-9), a_lk * (1 - 1e-9))
+    return max(np.sum(alpha * x_top / (alpha - theta)) - 1, 0.0)
+
+
+def bubble_point_sweeps(column, x, T, L, V, z, reflux, vapor_reboil, n_sweeps=30, tol=1e-3):
+    """
+    Bubble point method (Wang and Henke) with fixed flows: the component
+    balances of the trays, with the K values at the tray temperatures, are
+    solved for the liquid fractions (one tridiagonal system per component),
+    the fractions normalized and the temperatures moved to the bubble
+    points, until the temperatures settle.
+    Parameters
+    ----------
+    column : SimpleColumn
+        the column (total condenser and total reboiler).
+    x : array
+        liquid fractions of the trays, shape (n_trays, n_comps).
+    T : array
+        tray temperatures (F).
+    L, V : arrays
+        liquid and vapor flows leaving the trays.
+    z : array
+        feed fractions.
+    reflux, vapor_reboil : float
+        reflux and vapor reboil flows.
+    n_sweeps : int, optional
+        maximum number of sweeps.
+    tol : float, optional
+        largest temperature change (F) of the last sweep.
+
+    Returns
+    -------
+    x, T : arrays
+        liquid fractions and tray temperatures.
+
+    """
+    components = column.components
+    n_trays = column.n_trays
+    f = column.feed_tray
+    feed_flow = column.feed_stream_liq.xvar[0]
+    pressure = np.array([tray.pressure for tray in column.trays])[:, None]
+    efficiency = np.array([tray.tray_efficiency for tray in column.trays])[:, None]
+    for _ in range(n_sweeps):
+        K = components.k_values(T[:, None], pressure, efficiency)[0]
+        x_new = np.zeros_like(x)
+        for i in range(len(z)):
+            # banded storage: upper diagonal (liquid from the tray above), diagonal, lower diagonal
+            # (vapor from the tray below); the reflux has the composition of the top vapor and the
+            # vapor reboil the composition of the bottom liquid
+            ab = np.zeros((3, n_trays))
+            ab[0, 1:] = L[1:]
+            ab[1] = -(L + V * K[:, i])
+            ab[1, -1] += reflux * K[-1, i]
+            ab[1, 0] += vapor_reboil
+            ab[2, :-1] = V[:-1] * K[:-1, i]
+            rhs = np.zeros(n_trays)
+            rhs[f] = -feed_flow * z[i]
+            x_new[:, i] = solve_banded((1, 1), ab, rhs)
+        x = np.maximum(x_new, 0)
+        x = x / x.sum(axis=1, keepdims=True)
+        T_new = components.bubble_point(x, pressure, T)
+        change = np.max(np.abs(T_new - T))
+        T = T_new
+        if change < tol:
+            break
+    return x, T
+
+
+def initialize_column(column, reflux=None, vapor_reboil=None, top_product=None, n_sweeps=30):
+    """
+    Set the variables of a SimpleColumn (trays, mixed feed, condensate,
+    reflux, bottoms and vapor reboil streams) to a shortcut estimate. The
+    feed stream must hold the feed values (see apply_specs).
+    Parameters
+    ----------
+    column : SimpleColumn
+        the column.
+    reflux, vapor_reboil, top_product : float, optional
+        flows of the reflux, vapor reboil and distillate, if known. The
+        distillate flow defaults to vapor_reboil - reflux, or else to the
+        feed flow of the components with a K value above one at the feed
+        bubble point. A missing reflux is REFLUX_FACTOR times the
+        Underwood minimum reflux, a missing vapor reboil the reflux plus
+        the distillate.
+    n_sweeps : int, optional
+        maximum number of bubble point sweeps (see bubble_point_sweeps)
+        from the shortcut profile, 0 for the shortcut profile only.
+
+    Returns
+    -------
+    dict
+        the estimated flows of the reflux, vapor_reboil, top_product and
+        bottom_product, and the distillate and bottoms fractions x_top and
+        x_bottom.
+
+    """
+    components = column.components
+    feed = column.feed_stream_liq.xvar
+    feed_flow = feed[0]
+    z = np.maximum(feed[2:], 0)
+    z = z / z.sum()
+    pressure = column.pressure
+    n_trays = column.n_trays
+    efficiency = np.mean(column.tray_efficiency)
+
+    if top_product is None:
+        if reflux is not None and vapor_reboil is not None and 0 < vapor_reboil - reflux < feed_flow:
+            top_product = vapor_reboil - reflux
+        else:
+            K = components.k_values(components.bubble_point(z, pressure), pressure)[0]
+            top_product = feed_flow * np.sum(z[K > 1])
+            if not 0 < top_product < feed_flow:
+                top_product = feed_flow / 2
+    bottom_product = feed_flow - top_product
+
+    # Fenske split, with about half the trays as the minimum number of stages
+    d, b, alpha = shortcut_split(components, z, feed_flow, top_product, pressure,
+                                 max(1.0, 0.5 * n_trays * efficiency))
+    x_top = d / d.sum()
+    x_bottom = b / b.sum()
+
+    if reflux is None:
+        if vapor_reboil is not None and vapor_reboil > top_product:
+            reflux = vapor_reboil - top_product
+        else:
+            # keys: the heaviest component mostly in the distillate and the lightest mostly in the bottoms
+            light = np.flatnonzero(d >= b)
+            heavy = np.flatnonzero(d < b)
+            if len(light) and len(heavy):
+                light_key = light[np.argmin(alpha[light])]
+                heavy_key = heavy[np.argmax(alpha[heavy])]
+                r_min = underwood_min_reflux(alpha, z, x_top, light_key, heavy_key)
+            else:
+                r_min = 1.0
+            reflux = max(REFLUX_FACTOR * r_min, 0.5) * top_product
+    if vapor_reboil is None:
+        vapor_reboil = reflux + top_product
+
+    # liquid fractions: linear from the bottoms to the feed tray and from the feed tray to the top tray
+    f = column.feed_tray
+    x = np.zeros((n_trays, len(z)))
+    for i in range(n_trays):
+        if i <= f:
+            w = i / f
+            x[i] = (1 - w) * x_bottom + w * z
+        else:
+            w = (i - f) / (n_trays - 1 - f)
+            x[i] = (1 - w) * z + w * x_top
+    T = components.bubble_point(x, pressure)
+    # constant molal overflow, saturated liquid feed
+    L = reflux + np.where(np.arange(n_trays) <= f, feed_flow, 0.0)
+    V = np.full(n_trays, vapor_reboil, dtype=np.float64)
+    if n_sweeps > 0:
+        x, T = bubble_point_sweeps(column, x, T, L, V, z, reflux, vapor_reboil, n_sweeps)
+
+    for i, tray in enumerate(column.trays):
+        K_eq = components.k_values(T[i], tray.pressure, tray.tray_efficiency)[0]
+        y = K_eq * x[i]
+        liq = tray.liq_stream_out.xvar
+        vap = tray.vap_stream_out.xvar
+        liq[0] = L[i]
+        liq[1] = T[i]
+        liq[2:] = x[i]
+        vap[0] = V[i]
+        vap[1] = T[i]
+        vap[2:] = y / y.sum()
+
+    # mixed feed: the feed and the liquid from the tray above the feed tray
+    above = column.trays[f + 1].liq_stream_out.xvar
+    mixed = column.mixed_liq_feed.xvar
+    mixed[0] = feed_flow + above[0]
+    mixed[1] = (feed_flow * feed[1] + above[0] * above[1]) / mixed[0]
+    mixed[2:] = (feed_flow * z + above[0] * above[2:]) / mixed[0]
+
+    top = column.trays[-1].vap_stream_out.xvar
+    bottom = column.trays[0].liq_stream_out.xvar
+    column.condensate.xvar[:] = top
+    column.reflux.xvar[0] = reflux
+    column.reflux.xvar[1:] = top[1:]
+    column.bottoms.xvar[:] = bottom
+    column.vapor_reboil.xvar[0] = vapor_reboil
+    column.vapor_reboil.xvar[1:] = bottom[1:]
+    return dict(reflux=reflux, vapor_reboil=vapor_reboil, top_product=top_product,
+                bottom_product=bottom_product, x_top=x_top, x_bottom=x_bottom)
+
+
+def initialize(unit_dict):
+    """
+    Initialize the variables of a model: apply the specified values and
+    initialize every SimpleColumn with initialize_column. The reflux,
+    vapor reboil and product flows of a column are taken from the flow
+    specifications of its streams and of the other outputs of the mixers
+    fed by its condensate and bottoms (condenser and reboiler).
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+
+    Returns
+    -------
+    xvar : array
+        initial guess for the variable array.
+
+    """
+    apply_specs(unit_dict)
+    flows = {spec.stream: spec.value for spec in get_units(unit_dict, Specify) if spec.flow}
+    mixers = get_units(unit_dict, Mixer)
+    for column in get_units(unit_dict, SimpleColumn):
+        # product streams: the other outputs of the condenser and reboiler
+        top_products = [s for m in mixers if column.condensate in m.streams_in
+                        for s in m.streams_out if s is not column.reflux]
+        bottom_products = [s for m in mixers if column.bottoms in m.streams_in
+                           for s in m.streams_out if s is not column.vapor_reboil]
+        top_product = None
+        for s in top_products:
+            if s in flows:
+                top_product = flows[s]
+        for s in bottom_products:
+            if s in flows and top_product is None:
+                top_product = column.feed_stream_liq.xvar[0] - flows[s]
+        est = initialize_column(column, reflux=flows.get(column.reflux),
+                                vapor_reboil=flows.get(column.vapor_reboil), top_product=top_product)
+        for streams, flow, source in ((top_products, est['top_product'], column.condensate),
+                                      (bottom_products, est['bottom_product'], column.bottoms)):
+            for s in streams:
+                s.xvar[0] = flow / len(streams)
+                s.xvar[1:] = source.xvar[1:]
+    # the specified values take precedence (e.g. specified tray temperatures)
+    apply_specs(unit_dict)
+    return get_unit_vars(unit_dict)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Inside-out (Boston-Sullivan) solver for a model containing a SimpleColumn.
+The inner loop solves the model with a simplified K model on every tray:
+K_i = alpha_i * K_b, with ln K_b and ln alpha_i linear in the reciprocal of
+the absolute temperature. The outer loop fits the parameters of the
+simplified models to the rigorous (Antoine) K values at the tray
+temperatures of the last inner solution, until the simplified K values match
+the rigorous ones. Only the outer loop evaluates the rigorous K values, once
+per tray per iteration.
+The trays use equimolal overflow, so there is no enthalpy model to simplify.
+"""
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+from layout import FlowsheetLayout
+from sparse_solver import SparseJacobian, newton_sparse
+
+# F to R
+RANKINE = 459.67
+
+
+class SimplifiedKModel():
+    '''
+    Simplified K model of a tray: K_i = alpha_i * K_b, ln K_b = a + b * (1/T - 1/T_ref) and
+    ln alpha_i = ln alpha_ref_i + c_i * (1/T - 1/T_ref) (T in R).
+    K_b is the average of the component K values weighted by the vapor fractions. The fit matches the
+    values and the temperature derivatives of the rigorous K values at T_ref, so the outer loop converges
+    quickly. Called with the tray temperature (F), returns K_eq (corrected for tray efficiency) and dK_eq
+    like Tray.k_eq.
+    '''
+
+    def __init__(self, tray):
+        self.tray = tray
+        self.alpha = None
+        self.c = None
+        self.a = None
+        self.b = None
+        self.T_ref = None
+
+    def fit(self, temperature):
+        '''
+        fit the parameters to the rigorous K values at temperature (F)
+        return the rigorous K values (not corrected for tray efficiency)
+        '''
+        tray = self.tray
+        K, dK = tray.components.k_values(temperature, tray.pressure, 1)
+        y = np.maximum(tray.vap_stream_out.xvar[2:], 0)
+        w = y / y.sum() if y.sum() > 0 else np.full(len(y), 1 / len(y))
+        T_abs = temperature + RANKINE
+        ln_Kb = np.sum(w * np.log(K))
+        # d ln K / d(1/T) = -T**2 d ln K / dT
+        slope = -T_abs**2 * dK / K
+        self.b = np.sum(w * slope)
+        self.a = ln_Kb
+        self.alpha = K / np.exp(ln_Kb)
+        self.c = slope - self.b
+        self.T_ref = T_abs
+        return K
+
+    def k_values(self, temperature):
+        '''
+        return the simplified K values (not corrected for tray efficiency) and their derivatives
+        '''
+        T_abs = temperature + RANKINE
+        d_inv_T = 1 / T_abs - 1 / self.T_ref
+        K_b = np.exp(self.a + self.b * d_inv_T)
+        alpha = self.alpha * np.exp(self.c * d_inv_T)
+        K = alpha * K_b
+        dK = -K * (self.b + self.c) / T_abs**2
+        return K, dK
+
+    def __call__(self, temperature):
+        K, dK = self.k_values(temperature)
+        eff = self.tray.tray_efficiency
+        return eff * K + (1 - eff), eff * dK
+
+
+def solve_inside_out(xvar, unit_dict, column, eqns, tol=1e-10, k_tol=1e-12, max_outer=30):
+    """
+    Solve a model containing a SimpleColumn with the inside-out method.
+    Parameters
+    ----------
+    xvar : array
+        initial guess for the variable array.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    column : SimpleColumn
+        the column in unit_dict whose trays use the simplified K models.
+    eqns : array
+        equations for all the Unit objects in the model.
+    tol : float, optional
+        convergence tolerance on the 2-norm of the residuals of the inner
+        and of the rigorous equations.
+    k_tol : float, optional
+        convergence tolerance of the outer loop on the largest difference
+        between the logarithms of the simplified and rigorous K values.
+    max_outer : int, optional
+        maximum number of outer iterations.
+
+    Returns
+    -------
+    OptimizeResult
+        x, success, message, fun (rigorous residuals), nit (outer
+        iterations), n_inner (total inner Newton iterations), n_rigorous
+        (number of rigorous K evaluations of a tray). x has the same layout
+        as xvar, so it can be passed to map_var_to_unit1.
+
+    """
+    layout = FlowsheetLayout(unit_dict)
+    jac = SparseJacobian(unit_dict)
+    models = [SimplifiedKModel(tray) for tray in column.trays]
+    x = np.array(xvar, dtype=np.float64)
+    n_inner = 0
+    n_rigorous = 0
+    success = False
+    message = 'Maximum number of outer iterations reached.'
+    try:
+        for nit in range(1, max_outer + 1):
+            # outer loop: rigorous K values at the tray temperatures, compared with the
+            # simplified models of the last inner loop, then refitted
+            layout.set_x(x)
+            k_err = 0.0
+            for model, tray in zip(models, column.trays):
+                temperature = tray.liq_stream_out.xvar[1]
+                K_model = model.k_values(temperature)[0] if model.alpha is not None else None
+                K = model.fit(temperature)
+                n_rigorous += 1
+                if K_model is None:
+                    k_err = np.inf
+                else:
+                    k_err = max(k_err, np.max(np.abs(np.log(K_model) - np.log(K))))
+                tray.k_model = model
+            if k_err < k_tol:
+                success = True
+                message = 'The simplified K values match the rigorous K values.'
+                break
+
+            # inner loop: the model with the simplified K values
+            res = newton_sparse(x, unit_dict, layout.eqns, fun=layout.residual, jac=jac, tol=tol)
+            n_inner += res.nit
+            x = res.x
+            if not res.success:
+                message = 'Inner loop: ' + res.message
+                break
+    finally:
+        for tray in column.trays:
+            tray.k_model = None
+
+    # rigorous residuals
+    f = layout.residual(x).copy()
+    n_rigorous += len(column.trays)
+    success = success and np.linalg.norm(f) < max(tol, 1e3 * k_tol)
+    eqns[:] = f
+    return OptimizeResult(x=x, success=success, message=message, fun=f, nit=nit, n_inner=n_inner,
+                          n_rigorous=n_rigorous)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of a model: call counts and times of the calculate
+method of every unit, residual evaluations and times of every solve, and a
+per-iteration convergence trace (2-norm of the residuals and the units with
+the largest residuals) in a ring buffer of bounded size.
+Nothing is changed while no instrumentation is enabled. enable() wraps the
+calculate methods of the classes of the units of the model (streams and
+trays have no __dict__ for wrappers of their own), and the wrappers only time
+the units of enabled instrumentations. They are removed when the last
+instrumentation is disabled, so the models then run at full speed.
+The times of units with sub-units (e.g. SimpleColumn) include the times of
+the sub-units. CompiledModel evaluates the trays, mixers, connectors and
+specifications with array operations and only calls calculate for the other
+units, so only those are counted.
+"""
+
+import json
+import time
+from collections import deque
+import numpy as np
+from sim_utils import get_eqn_offsets, process_eqns
+from stream import Stream
+
+# original calculate methods of the wrapped classes
+wrapped_methods = dict()
+# counters of the units of the enabled instrumentations: unit -> [number of calls, total time]
+unit_counters = dict()
+
+
+def timed_method(calculate):
+    '''
+    return calculate (a method of a unit class) counting and timing the calls of the units in unit_counters
+    '''
+
+    def timed_calculate(unit):
+        counter = unit_counters.get(unit)
+        if counter is None:
+            return calculate(unit)
+        start = time.perf_counter()
+        calculate(unit)
+        counter[1] += time.perf_counter() - start
+        counter[0] += 1
+    return timed_calculate
+
+
+class Instrumentation():
+    '''
+    Instrumentation of the model in unit_dict.
+    trace_size is the number of iterations kept in the convergence trace, n_worst the number of units
+    with the largest residuals recorded at every iteration.
+    Used as a context manager, the instrumentation is enabled within the with block.
+    '''
+
+    def __init__(self, unit_dict, trace_size=1000, n_worst=3):
+        self.unit_dict = unit_dict
+        self.n_worst = n_worst
+        self.enabled = False
+        # units with equations in the order of map_eqn_to_unit1, for the residuals of each unit
+        eqn_offsets = [(u, idx) for u, idx in get_eqn_offsets(unit_dict) if u.n_eqns > 0]
+        self.eqn_units = [u.name for u, _ in eqn_offsets]
+        self.eqn_starts = np.array([idx for _, idx in eqn_offsets], dtype=np.int64)
+        self.trace = deque(maxlen=trace_size)
+        self.reset()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.disable()
+        return False
+
+    def units(self):
+        '''
+        return all the units of the model, nested units included
+        '''
+        units = []
+
+        def units_inner(unit_dict):
+            for k in sorted(unit_dict.keys()):
+                units.append(unit_dict[k])
+                units_inner(unit_dict[k].unit_dict)
+            return
+
+        units_inner(self.unit_dict)
+        return units
+
+    def reset(self):
+        '''
+        clear the counters, the solve records and the trace
+        '''
+        # (unit type, unit name) -> [number of calls, total time]
+        self.unit_calls = dict()
+        self.solves = []
+        self.current = None
+        self.trace.clear()
+        if self.enabled:
+            # the wrappers hold the old counters
+            self.disable()
+            self.enable()
+        return
+
+    def enable(self):
+        '''
+        count and time the calls of the calculate method of every unit (streams have nothing to calculate)
+        '''
+        if self.enabled:
+            return
+        for unit in self.units():
+            if isinstance(unit, Stream):
+                continue
+            # the class that defines the calculate method of the unit
+            cls = next(c for c in type(unit).__mro__ if 'calculate' in c.__dict__)
+            if cls not in wrapped_methods:
+                wrapped_methods[cls] = cls.__dict__['calculate']
+                cls.calculate = timed_method(wrapped_methods[cls])
+            unit_counters[unit] = self.unit_calls.setdefault((type(unit).__name__, unit.name), [0, 0.0])
+        self.enabled = True
+        return
+
+    def disable(self):
+        '''
+        stop counting the calls of the units, and remove the wrappers if no instrumentation is enabled
+        '''
+        if not self.enabled:
+            return
+        for unit in self.units():
+            unit_counters.pop(unit, None)
+        if not unit_counters:
+            for cls, calculate in wrapped_methods.items():
+                cls.calculate = calculate
+            wrapped_methods.clear()
+        self.enabled = False
+        return
+
+    def wrap(self, fun):
+        '''
+        return fun (with the arguments of process_eqns) counting and timing the residual evaluations
+        of the current solve
+        '''
+        def counted_fun(xvar, unit_dict, eqns):
+            start = time.perf_counter()
+            f = fun(xvar, unit_dict, eqns)
+            if self.current is not None:
+                self.current['n_residuals'] += 1
+                self.current['residual_time'] += time.perf_counter() - start
+            return f
+        return counted_fun
+
+    def callback(self, nit, x, f):
+        '''
+        record an iteration of the current solve in the trace (callback of sparse_solver.newton_sparse)
+        '''
+        f = np.abs(np.asarray(f, dtype=np.float64))
+        f = np.where(np.isfinite(f), f, np.inf)
+        norm = float(np.linalg.norm(f))
+        unit_max = np.maximum.reduceat(f, self.eqn_starts) if len(f) else np.zeros(0)
+        worst = np.argsort(unit_max)[::-1][:self.n_worst]
+        label = None
+        if self.current is not None:
+            label = self.current['label']
+            self.current['nit'] = nit
+            self.current['norm'] = norm
+        self.trace.append(dict(solve=label, nit=nit, norm=norm,
+                               worst=[(self.eqn_units[i], float(unit_max[i])) for i in worst]))
+        return
+
+    def begin_solve(self, label=None):
+        '''
+        start recording a solve
+        '''
+        if label is None:
+            label = 'solve{}'.format(len(self.solves))
+        self.current = dict(label=label, n_residuals=0, residual_time=0.0, nit=0, norm=None, success=None,
+                            time=0.0, start=time.perf_counter())
+        return
+
+    def end_solve(self, result=None):
+        '''
+        finish recording the current solve, with the OptimizeResult of the solver if given
+        '''
+        current = self.current
+        current['time'] = time.perf_counter() - current.pop('start')
+        if result is not None:
+            current['success'] = bool(result.success)
+            current['nit'] = int(result.get('nit', current['nit']))
+        self.solves.append(current)
+        self.current = None
+        return
+
+    def solve(self, solver, xvar, eqns, fun=None, label=None, **kwargs):
+        """
+        Solve the model with a solver taking the fun and callback arguments
+        of sparse_solver.newton_sparse, recording the solve.
+        Parameters
+        ----------
+        solver : callable
+            called as solver(xvar, unit_dict, eqns, fun=..., callback=...,
+            **kwargs), e.g. sparse_solver.newton_sparse.
+        xvar : array
+            initial guess for the variable array.
+        eqns : array
+            equations for all the Unit objects in the model.
+        fun : callable, optional
+            residual function passed to the solver. The default is
+            process_eqns.
+        label : str, optional
+            name of the solve in the records.
+        **kwargs
+            other arguments of the solver.
+
+        Returns
+        -------
+        OptimizeResult
+            the result of the solver.
+
+        """
+        self.begin_solve(label)
+        result = None
+        try:
+            result = solver(xvar, self.unit_dict, eqns, fun=self.wrap(process_eqns if fun is None else fun),
+                            callback=self.callback, **kwargs)
+        finally:
+            self.end_solve(result)
+        return result
+
+    def to_dict(self):
+        '''
+        return the counters, solve records and trace as a dict of JSON types
+        '''
+        units = [dict(type=t, name=n, calls=c, time=s) for (t, n), (c, s) in self.unit_calls.items() if c > 0]
+        units.sort(key=lambda u: u['time'], reverse=True)
+        return dict(units=units, solves=list(self.solves), trace=list(self.trace))
+
+    def to_json(self, path=None):
+        '''
+        return the records as a JSON string, also written to path if given
+        '''
+        s = json.dumps(self.to_dict(), indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(s)
+        return s
+
+    def summary(self, n_units=10):
+        """
+        Text summary of the records.
+        Parameters
+        ----------
+        n_units : int, optional
+            number of units listed, by decreasing total time.
+
+        Returns
+        -------
+        s : str
+            calculate times by unit type, the slowest units, the solves, and
+            the units most often among those with the largest residuals in
+            the trace.
+
+        """
+        d = self.to_dict()
+        s = 'calculate calls by unit type:\n'
+        by_type = dict()
+        for u in d['units']:
+            calls, total = by_type.get(u['type'], (0, 0.0))
+            by_type[u['type']] = (calls + u['calls'], total + u['time'])
+        for t, (calls, total) in sorted(by_type.items(), key=lambda a: -a[1][1]):
+            s += '  {:<20} {:>9} calls {:>10.4f} s\n'.format(t, calls, total)
+        s += 'slowest units:\n'
+        for u in d['units'][:n_units]:
+            s += '  {:<40} {:>9} calls {:>10.4f} s\n'.format(u['name'], u['calls'], u['time'])
+        s += 'solves:\n'
+        for r in d['solves']:
+            s += '  {}: success={} nit={} residual evaluations={} ({:.4f} s) time={:.4f} s norm={}\n'.format(
+                r['label'], r['success'], r['nit'], r['n_residuals'], r['residual_time'], r['time'], r['norm'])
+        worst = dict()
+        for it in d['trace']:
+            for name, _ in it['worst']:
+                worst[name] = worst.get(name, 0) + 1
+        s += 'units with the largest residuals (iterations):\n'
+        for name, n in sorted(worst.items(), key=lambda a: -a[1])[:n_units]:
+            s += '  {:<40} {:>6}\n'.format(name, n)
+        return s
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Layout of the variables and equations of a flowsheet, worked out once.
+map_var_to_unit1 and process_eqns walk the nested unit_dicts (sorting the
+keys at every level) on every residual evaluation. FlowsheetLayout does the
+walk once, fixes the variable and equation offsets and binds the xvar and
+eqns of every unit to views of two persistent arrays. The residual
+callback then only copies the solver variables into the bound array and
+calls calculate on each unit.
+"""
+
+import numpy as np
+from sim_utils import get_var_offsets, get_eqn_offsets
+
+
+class FlowsheetLayout():
+    '''
+    Frozen traversal order and variable/equation offsets of the Unit objects in unit_dict.
+    The layout is the same as used by map_var_to_unit1 and map_eqn_to_unit1, so x arrays can be
+    exchanged with the functions in sim_utils.
+    '''
+
+    def __init__(self, unit_dict):
+        self.unit_dict = unit_dict
+        self.var_offsets = get_var_offsets(unit_dict)
+        self.eqn_offsets = get_eqn_offsets(unit_dict)
+        self.n_vars = sum(u.n_vars for u in self.var_offsets)
+        self.n_eqns = sum(u.n_eqns for u, _ in self.eqn_offsets)
+        # calculate is called on the top level units only, as in process_eqns
+        self.top_units = [unit_dict[u] for u in sorted(unit_dict.keys())]
+        # persistent buffers, initialised with the current variables of the units
+        self.x = np.zeros(self.n_vars, dtype=np.float64)
+        for u, idx in self.var_offsets.items():
+            self.x[idx:idx+u.n_vars] = u.xvar
+        self.eqns = np.zeros(self.n_eqns, dtype=np.float64)
+        self.first_var_unit = next(iter(self.var_offsets), None)
+        self.first_eqn_unit = self.eqn_offsets[0][0] if self.eqn_offsets else None
+        self.bind()
+
+    def bind(self):
+        '''
+        point the xvar and eqns of every unit to views of the layout buffers
+        done again by set_x if the units have been mapped to other arrays in the meantime
+        (e.g. by map_var_to_unit1)
+        '''
+        for u, idx in self.var_offsets.items():
+            u.xvar = self.x[idx:idx+u.n_vars]
+        for u, idx in self.eqn_offsets:
+            u.eqns = self.eqns[idx:idx+u.n_eqns]
+        return
+
+    def set_x(self, xvar):
+        '''
+        copy the solver variables into the bound variable array
+        the units are bound again if they have been mapped to other arrays (checked on the first unit only)
+        '''
+        if (self.var_offsets and self.first_var_unit.xvar.base is not self.x) or \
+                (self.eqn_offsets and self.first_eqn_unit.eqns.base is not self.eqns):
+            self.bind()
+        if xvar is not self.x:
+            self.x[:] = xvar
+        return
+
+    def residual(self, xvar, *args):
+        '''
+        evaluate the equations of all the units at xvar
+        the extra arguments are ignored, so the call is interchangeable with process_eqns
+        the returned array is the persistent equation buffer; copy it to keep the values
+        '''
+        self.set_x(xvar)
+        for u in self.top_units:
+            u.calculate()
+        return self.eqns
+
+    def jacobian(self, xvar, *args):
+        '''
+        evaluate the dense Jacobian of the equations of all the units at xvar from Unit.jacobian
+        the extra arguments are ignored, so the call is interchangeable with process_jac
+        '''
+        self.set_x(xvar)
+        jac = np.zeros((self.n_eqns, self.n_vars), dtype=np.float64)
+        for unit, e_idx in self.eqn_offsets:
+            partials = unit.jacobian()
+            if partials is None:
+                raise NotImplementedError('{} has no analytic Jacobian'.format(unit.name))
+            for u, d in partials:
+                if u in self.var_offsets:
+                    v_idx = self.var_offsets[u]
+                    jac[e_idx:e_idx+unit.n_eqns, v_idx:v_idx+u.n_vars] += d
+        return jac
+
+    def get_x(self):
+        '''
+        return a copy of the current variable array
+        '''
+        return self.x.copy()
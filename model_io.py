@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Binary save and restore of models and their solutions.
+A model is saved to an .npz file holding a small JSON header with the
+structure of the model (the type, name and constructor arguments of every
+top-level unit, streams referred to by their keys in unit_dict, the
+pressure and efficiency of every tray) and the variable and residual
+arrays as binary arrays. Loading rebuilds the units and maps the saved
+variables to them, so a solved model resumes warm without being solved
+again. Streams, Mixer, Connector, Specify and SimpleColumn objects are
+supported.
+"""
+
+import os
+import json
+import numpy as np
+from sim_utils import map_var_to_unit1, map_eqn_to_unit1, get_unit_vars
+from stream import Stream
+from mixer import Mixer
+from connector import Connector
+from specify import Specify
+from simplecolumn import SimpleColumn
+from phy_props import ComponentSet
+from solution_cache import structure_hash
+
+FORMAT_VERSION = 1
+# order in which the units are built: streams, then columns (other units may refer to their streams)
+BUILD_ORDER = {Stream: 0, SimpleColumn: 1, Mixer: 2, Connector: 2, Specify: 3}
+
+
+def unit_paths(unit_dict):
+    '''
+    return a dict of every unit (nested units included) to its path: its key, preceded by the keys of the
+    units it is nested in, separated by '/'
+    '''
+    paths = dict()
+
+    def unit_paths_inner(unit_dict, prefix):
+        for k in sorted(unit_dict.keys()):
+            u = unit_dict[k]
+            paths[u] = prefix + k
+            unit_paths_inner(u.unit_dict, prefix + k + '/')
+        return
+
+    unit_paths_inner(unit_dict, '')
+    return paths
+
+
+def describe(unit, paths):
+    '''
+    return the type and constructor arguments of a unit as a dict of JSON types (streams as paths)
+    '''
+    if isinstance(unit, Stream):
+        return dict(type='Stream', name=unit.name, n_comps=unit.n_comps)
+    if isinstance(unit, Mixer):
+        return dict(type='Mixer', name=unit.name, streams_in=[paths[s] for s in unit.streams_in],
+                    streams_out=[paths[s] for s in unit.streams_out])
+    if isinstance(unit, Connector):
+        return dict(type='Connector', name=unit.name, stream_in=paths[unit.stream_in],
+                    stream_out=paths[unit.stream_out], flow_diff=unit.flow_diff, temp_diff=unit.temp_diff)
+    if isinstance(unit, Specify):
+        return dict(type='Specify', name=unit.name, flow=unit.flow, temperature=unit.temperature,
+                    fraction=unit.fraction, stream=paths[unit.stream], comp_num=unit.comp_num,
+                    value=np.asarray(unit.value, dtype=np.float64).tolist())
+    if isinstance(unit, SimpleColumn):
+        tray = unit.trays[0]
+        return dict(type='SimpleColumn', name=unit.name, n_trays=unit.n_trays, feed_tray=unit.feed_tray,
+                    feed_stream_liq=paths[unit.feed_stream_liq], reflux=paths[unit.reflux],
+                    vapor_reboil=paths[unit.vapor_reboil], condensate=paths[unit.condensate],
+                    bottoms=paths[unit.bottoms], components=unit.components.names, dynamic=unit.dynamic,
+                    weir_holdup=tray.weir_holdup, weir_coef=tray.weir_coef,
+                    pressure=[float(t.pressure) for t in unit.trays],
+                    tray_efficiency=[float(t.tray_efficiency) for t in unit.trays])
+    raise TypeError('{}: units of type {} cannot be saved'.format(unit.name, type(unit).__name__))
+
+
+def save_model(path, unit_dict, xvar=None, eqns=None, metadata=None):
+    """
+    Save a model and its solution to an .npz file.
+    Parameters
+    ----------
+    path : str
+        name of the file.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    xvar : array, optional
+        variable array. The default is the current values of the
+        variables of the units.
+    eqns : array, optional
+        residuals at xvar, saved with the variables if given.
+    metadata : dict, optional
+        extra information of JSON types, returned by load_model.
+
+    Returns
+    -------
+    None.
+
+    """
+    paths = unit_paths(unit_dict)
+    keys = sorted(unit_dict.keys(), key=lambda k: (BUILD_ORDER.get(type(unit_dict[k]), 4), k))
+    header = dict(version=FORMAT_VERSION, structure=structure_hash(unit_dict),
+                  units=[dict(key=k, **describe(unit_dict[k], paths)) for k in keys],
+                  metadata=metadata if metadata is not None else dict())
+    arrays = dict(header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8))
+    arrays['x'] = np.asarray(get_unit_vars(unit_dict) if xvar is None else xvar, dtype=np.float64)
+    if eqns is not None:
+        arrays['eqns'] = np.asarray(eqns, dtype=np.float64)
+    # written to a temporary file first, so an interrupted save leaves the old file
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return
+
+
+def build(units):
+    '''
+    return the unit_dict built from the unit descriptions of a header, in the order of save_model
+    '''
+    unit_dict = dict()
+
+    def lookup(path):
+        keys = path.split('/')
+        u = unit_dict[keys[0]]
+        for k in keys[1:]:
+            u = u.unit_dict[k]
+        return u
+
+    for d in units:
+        t = d['type']
+        if t == 'Stream':
+            u = Stream(n_comps=d['n_comps'], name=d['name'])
+        elif t == 'Mixer':
+            u = Mixer(streams_in=[lookup(p) for p in d['streams_in']],
+                      streams_out=[lookup(p) for p in d['streams_out']], name=d['name'])
+        elif t == 'Connector':
+            u = Connector(lookup(d['stream_in']), lookup(d['stream_out']), flow_diff=d['flow_diff'],
+                          temp_diff=d['temp_diff'], name=d['name'])
+        elif t == 'SimpleColumn':
+            u = SimpleColumn(n_trays=d['n_trays'], feed_tray=d['feed_tray'],
+                             feed_stream_liq=lookup(d['feed_stream_liq']), reflux=lookup(d['reflux']),
+                             vapor_reboil=lookup(d['vapor_reboil']), condensate=lookup(d['condensate']),
+                             bottoms=lookup(d['bottoms']), pressure=d['pressure'][0],
+                             tray_efficiency=dict(enumerate(d['tray_efficiency'])),
+                             components=ComponentSet(d['components']), dynamic=d['dynamic'],
+                             weir_holdup=d['weir_holdup'], weir_coef=d['weir_coef'], name=d['name'])
+            for tray, pressure in zip(u.trays, d['pressure']):
+                tray.update_pressure(pressure)
+        elif t == 'Specify':
+            value = np.asarray(d['value'], dtype=np.float64)
+            u = Specify(name=d['name'], flow=d['flow'], temperature=d['temperature'], fraction=d['fraction'],
+                        stream=lookup(d['stream']), comp_num=d['comp_num'],
+                        value=value.item() if value.ndim == 0 else value)
+        else:
+            raise TypeError('Unknown unit type {}'.format(t))
+        unit_dict[d['key']] = u
+    return unit_dict
+
+
+def load_model(path):
+    """
+    Load a model saved with save_model, with the units mapped to the saved
+    variables (and residuals, if saved).
+    Parameters
+    ----------
+    path : str
+        name of the file.
+
+    Returns
+    -------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    xvar : array
+        saved variable array, mapped to the units.
+    eqns : array
+        saved residuals (zeros if they were not saved), mapped to the
+        units.
+    metadata : dict
+        the metadata passed to save_model.
+
+    """
+    with np.load(path) as data:
+        header = json.loads(data['header'].tobytes().decode())
+        assert header['version'] <= FORMAT_VERSION, '{}: unknown format version {}'.format(path, header['version'])
+        xvar = data['x']
+        eqns = data['eqns'] if 'eqns' in data.files else np.zeros(len(xvar), dtype=np.float64)
+    unit_dict = build(header['units'])
+    assert structure_hash(unit_dict) == header['structure'], '{}: the rebuilt model has a different structure'.format(path)
+    map_var_to_unit1(xvar, unit_dict)
+    map_eqn_to_unit1(eqns, unit_dict)
+    return unit_dict, xvar, eqns, header['metadata']
+
+
+class SavedModel():
+    '''
+    Model factory loading the model saved to path with save_model, with the units at the saved solution.
+    Can be pickled, so it can be passed as the model factory to sweep.sweep.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self):
+        return load_model(self.path)[0]
@@ -1,16 +1,151 @@
-# -*- coding: utf-8 -*-
-"""
-Antoine constants for saturated vapor pressure.
-"""
-
-import numpy as np
-
-# Antoine constants for saturate vapor pressure for 
-# i-butane, n-butane, i-pentane, n-pentane, n-hexane
-# form of the equation is
-# p_sat (psia) = A - B / (C + T(F))
-# above data from E.g. 8-11 in the textbook by Foust, et. al.
-
-phy_props = {'Antoine_A': np.array((5.03458, 5.11679, 5.07617, 5.13871, 5.16426)),
-             'Antoine_B': np.array((1589.04, 1702.62, 1836.0216, 1916.334, 2108.754)),
-             'Antoine_C': np.array((400, 400, 387.575, 385.6, 371.859))}
+# -*- coding: utf-8 -*-
+"""
+Antoine constants for saturated vapor pressure.
+Component database, sets of components selected from it and the
+vectorized K value kernel used by the trays.
+"""
+
+import numpy as np
+
+# Antoine constants for saturate vapor pressure for
+# i-butane, n-butane, i-pentane, n-pentane, n-hexane
+# form of the equation is
+# p_sat (psia) = A - B / (C + T(F))
+# above data from E.g. 8-11 in the textbook by Foust, et. al.
+
+# log10 of 1 psia in mmHg
+LOG10_MMHG_PER_PSIA = np.log10(51.71493)
+
+
+def antoine_psia_F(a, b, c):
+    '''
+    convert Antoine constants for log10(p_sat (mmHg)) = a - b / (c + T(C))
+    to constants for log10(p_sat (psia)) = A - B / (C + T(F))
+    '''
+    return (a - LOG10_MMHG_PER_PSIA, 1.8 * b, 1.8 * c - 32)
+
+
+# component database: name -> (A, B, C), p_sat in psia, T in F
+# the butanes, pentanes and n-hexane are from Foust, et. al.
+# the others are converted from the usual mmHg, C constants (Lange's Handbook of Chemistry)
+component_db = {'i-butane': (5.03458, 1589.04, 400),
+                'n-butane': (5.11679, 1702.62, 400),
+                'i-pentane': (5.07617, 1836.0216, 387.575),
+                'n-pentane': (5.13871, 1916.334, 385.6),
+                'n-hexane': (5.16426, 2108.754, 371.859),
+                'propane': antoine_psia_F(6.80398, 803.810, 246.99),
+                'n-heptane': antoine_psia_F(6.89677, 1264.90, 216.544),
+                'n-octane': antoine_psia_F(6.91868, 1351.99, 209.155),
+                'benzene': antoine_psia_F(6.90565, 1211.033, 220.790),
+                'toluene': antoine_psia_F(6.95464, 1344.8, 219.482)}
+
+
+def k_values(temperature, pressure, tray_efficiency, A, B, C):
+    """
+    K values of the components (corrected for tray efficiency) and their
+    derivatives with respect to temperature, for any number of trays at once.
+    Parameters
+    ----------
+    temperature : array
+        tray temperatures (F), shape (..., 1) to broadcast against the
+        components.
+    pressure : float or array
+        tray pressures (psia), broadcastable against temperature.
+    tray_efficiency : float or array
+        tray efficiencies, broadcastable against temperature.
+    A, B, C : arrays
+        Antoine constants of the components, shape (n_comps,) or
+        (..., n_comps).
+
+    Returns
+    -------
+    K_eq : array
+        K values, shape (..., n_comps).
+    dK_eq : array
+        derivatives of K_eq with respect to temperature.
+
+    """
+    denom = C + temperature
+    K_eq = np.power(10, A - B / denom) / pressure
+    # d(10**f)/dT = ln(10) * 10**f * df/dT, with df/dT = B / (C + T)**2
+    dK_eq = tray_efficiency * K_eq * np.log(10) * B / denom**2
+    K_eq = tray_efficiency * K_eq + (1 - tray_efficiency)
+    return K_eq, dK_eq
+
+
+class ComponentSet():
+    '''
+    Components of a model, selected from component_db by name, in the order of the stream fractions.
+    The Antoine constants are held in contiguous arrays.
+    '''
+
+    def __init__(self, names):
+        for name in names:
+            assert name in component_db, 'Unknown component {}'.format(name)
+        self.names = list(names)
+        self.n_comps = len(self.names)
+        constants = np.ascontiguousarray(np.array([component_db[name] for name in self.names],
+                                                  dtype=np.float64).T)
+        # read-only, since a component set is shared by all the models using it
+        constants.setflags(write=False)
+        self.A, self.B, self.C = constants
+
+    def __str__(self):
+        return 'Components: {}\n'.format(', '.join(self.names))
+
+    def vapor_pressure(self, temperature):
+        '''
+        return the saturated vapor pressure (psia) of each component at temperature (F, shape (..., 1))
+        '''
+        return np.power(10, self.A - self.B / (self.C + temperature))
+
+    def k_values(self, temperature, pressure, tray_efficiency=1):
+        '''
+        return the K values of the components and their derivatives with respect to temperature
+        (see k_values)
+        '''
+        return k_values(temperature, pressure, tray_efficiency, self.A, self.B, self.C)
+
+    def bubble_point(self, fractions, pressure, temperature=None, tol=1e-10, max_iter=50):
+        """
+        Bubble point temperatures of liquids, found with Newton's method on
+        the logarithm of sum(K * x), for any number of liquids at once.
+        Parameters
+        ----------
+        fractions : array
+            liquid fractions, shape (..., n_comps).
+        pressure : float or array
+            pressures (psia), broadcastable against fractions[..., :1].
+        temperature : array, optional
+            initial guess (F), shape (...). The default is 100 F.
+        tol : float, optional
+            convergence tolerance on the temperature steps.
+        max_iter : int, optional
+            maximum number of iterations.
+
+        Returns
+        -------
+        temperature : array
+            bubble point temperatures (F), shape (...).
+
+        """
+        fractions = np.asarray(fractions, dtype=np.float64)
+        if temperature is None:
+            T = np.full(fractions.shape[:-1] + (1,), 100.0)
+        else:
+            T = np.array(temperature, dtype=np.float64).reshape(fractions.shape[:-1] + (1,))
+        for _ in range(max_iter):
+            K, dK = self.k_values(T, pressure)
+            s = np.sum(K * fractions, axis=-1, keepdims=True)
+            ds = np.sum(dK * fractions, axis=-1, keepdims=True)
+            # limit the steps, ln(sum(K * x)) is far from linear in T over wide ranges
+            step = np.clip(np.log(s) * s / ds, -50, 50)
+            T = T - step
+            if np.max(np.abs(step)) < tol:
+                break
+        return T[..., 0]
+
+
+# components of Example 8.11 in Foust, et. al., used when a model does not select its own
+# (the components of flowsheet.default_flowsheet)
+default_components = ComponentSet(['i-butane', 'n-butane', 'i-pentane', 'n-pentane', 'n-hexane'])
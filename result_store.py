@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only columnar storage of results on disk, for sweeps of many cases
+and long dynamic trajectories.
+A store is a directory with one raw binary file per field (e.g. profile,
+values, success) and an index (index.json) with the dtype and row shape of
+every field, the number of rows written and the sizes of the chunks. Rows
+are buffered in memory in chunks of fixed size, appended to the field
+files and then recorded in the index, which is replaced atomically, so the
+memory used by the writer does not grow with the number of rows and a
+reader only sees complete chunks. A reader maps the field files with
+numpy.memmap, so nothing is loaded until it is used.
+"""
+
+import os
+import json
+import numpy as np
+
+
+def read_index(path):
+    '''
+    return the index of the store in directory path
+    '''
+    with open(os.path.join(path, 'index.json')) as f:
+        return json.load(f)
+
+
+class ResultWriter():
+    '''
+    Writer of a store in directory path, appending rows in chunks of chunk_size rows.
+    The fields are set by the first row (names, dtypes and shapes of the values). If the store exists, rows
+    are appended to it, and the field files are cut back to the rows recorded in the index (the remains of
+    an interrupted write).
+    Used as a context manager, the last rows are flushed on exit.
+    '''
+
+    def __init__(self, path, chunk_size=1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffers = None
+        self.n_buffered = 0
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, 'index.json')):
+            self.index = read_index(path)
+            for name, field in self.index['fields'].items():
+                row_bytes = np.dtype(field['dtype']).itemsize * int(np.prod(field['shape']))
+                with open(self.field_path(name), 'ab') as f:
+                    f.truncate(self.index['n_rows'] * row_bytes)
+        else:
+            self.index = dict(n_rows=0, chunks=[], fields=dict())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.index['n_rows'] + self.n_buffered
+
+    def field_path(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def allocate(self):
+        '''
+        allocate the chunk buffers of the fields of the index
+        '''
+        self.buffers = {name: np.zeros((self.chunk_size,) + tuple(field['shape']), dtype=field['dtype'])
+                        for name, field in self.index['fields'].items()}
+        return
+
+    def append(self, **values):
+        """
+        Append a row.
+        Parameters
+        ----------
+        **values
+            value of every field (scalars or arrays of the same shape in
+            every row).
+
+        Returns
+        -------
+        None.
+
+        """
+        if not self.index['fields']:
+            for name, value in values.items():
+                value = np.asarray(value)
+                self.index['fields'][name] = dict(dtype=value.dtype.str, shape=list(value.shape))
+        assert set(values) == set(self.index['fields']), \
+            'fields {} instead of {}'.format(sorted(values), sorted(self.index['fields']))
+        if self.buffers is None:
+            self.allocate()
+        for name, value in values.items():
+            self.buffers[name][self.n_buffered] = value
+        self.n_buffered += 1
+        if self.n_buffered == self.chunk_size:
+            self.flush()
+        return
+
+    def extend(self, records):
+        '''
+        append the rows of a structured array (e.g. the result of sweep.sweep)
+        '''
+        for record in records:
+            self.append(**{name: record[name] for name in records.dtype.names})
+        return
+
+    def flush(self):
+        '''
+        write the buffered rows to the field files and record them in the index
+        '''
+        if self.n_buffered > 0:
+            for name, buffer in self.buffers.items():
+                with open(self.field_path(name), 'ab') as f:
+                    f.write(buffer[:self.n_buffered].tobytes())
+            self.index['n_rows'] += self.n_buffered
+            self.index['chunks'].append(self.n_buffered)
+            self.n_buffered = 0
+        tmp_path = os.path.join(self.path, 'index.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, os.path.join(self.path, 'index.json'))
+        return
+
+    def close(self):
+        self.flush()
+        self.buffers = None
+        return
+
+
+class ResultReader():
+    '''
+    Reader of a store in directory path. reader[name] returns the read-only memory map of a field, shape
+    (n_rows,) + shape of the field; rows and chunks return the fields of a range of rows.
+    The rows written after the reader was opened are seen after refresh().
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.refresh()
+
+    def refresh(self):
+        '''
+        read the index again, for the rows written since
+        '''
+        self.index = read_index(self.path)
+        self.maps = dict()
+        return
+
+    def __len__(self):
+        return self.index['n_rows']
+
+    def fields(self):
+        '''
+        return the names of the fields
+        '''
+        return list(self.index['fields'])
+
+    def __getitem__(self, name):
+        if name not in self.maps:
+            field = self.index['fields'][name]
+            shape = (self.index['n_rows'],) + tuple(field['shape'])
+            if self.index['n_rows'] == 0:
+                self.maps[name] = np.zeros(shape, dtype=field['dtype'])
+            else:
+                self.maps[name] = np.memmap(os.path.join(self.path, name + '.bin'), dtype=field['dtype'],
+                                            mode='r', shape=shape)
+        return self.maps[name]
+
+    def rows(self, start, stop, fields=None):
+        '''
+        return a dict of the fields (all of them by default) of rows start to stop
+        '''
+        if fields is None:
+            fields = self.fields()
+        return {name: self[name][start:stop] for name in fields}
+
+    def chunks(self, fields=None):
+        '''
+        iterate over the chunks as written, as dicts of the fields of their rows
+        '''
+        start = 0
+        for n in self.index['chunks']:
+            yield self.rows(start, start + n, fields)
+            start += n
+        return
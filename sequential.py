@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+"""
+Sequential-modular solution of flowsheets of several units with recycles.
+The top-level units of the model are grouped in modules: every
+SimpleColumn with its condenser and reboiler (the Mixer objects fed by its
+condensate and bottoms that return its reflux and vapor reboil), every
+other Mixer and Connector on its own, and one source module for every
+stream computed by no unit (e.g. a feed fixed by Specify objects). A module
+computes the streams leaving its units (the streams out of mixers and
+connectors, the condensate and bottoms of a column) and the Specify
+objects on those streams belong to it, so every module is a square
+sub-problem given the streams entering it.
+Recycle loops are the strongly connected components of the graph of the
+modules. Their tear streams are the streams on the back edges of a depth
+first search, from the start module with the fewest torn variables, and
+the modules are solved in topological order of the graph without the tear
+streams. The tear streams are converged by direct substitution, Wegstein
+or Anderson acceleration, and every module restarts from its own last
+solution at every iteration.
+The equation-oriented solution of the whole model remains available, for
+comparison or to polish the sequential-modular solution.
+"""
+
+import numpy as np
+from scipy.sparse.csgraph import connected_components
+import scipy.sparse as sp
+from scipy.optimize import OptimizeResult
+from sim_utils import map_var_to_unit1, map_eqn_to_unit1, process_eqns, get_unit_vars, get_var_offsets
+from sparse_solver import SparseJacobian, newton_sparse
+from initialize import initialize
+from stream import Stream
+from mixer import Mixer
+from connector import Connector
+from specify import Specify
+from simplecolumn import SimpleColumn
+
+
+class DirectSubstitution():
+    '''
+    direct substitution of the tear streams: the next guess is the result of the pass
+    '''
+
+    def reset(self):
+        return
+
+    def __call__(self, t, g):
+        return g.copy()
+
+
+class Wegstein():
+    '''
+    Wegstein acceleration of the tear streams, with the acceleration factor q of every variable bounded to
+    [q_min, q_max] (q = 0 is direct substitution, q < 0 accelerates)
+    '''
+
+    def __init__(self, q_min=-5.0, q_max=0.0):
+        self.q_min = q_min
+        self.q_max = q_max
+        self.reset()
+
+    def reset(self):
+        self.t_last = None
+        self.g_last = None
+
+    def __call__(self, t, g):
+        if self.t_last is None:
+            t_next = g.copy()
+        else:
+            dt = t - self.t_last
+            dg = g - self.g_last
+            moved = np.abs(dt) > 1e-14 * np.maximum(1, np.abs(t))
+            s = np.where(moved, dg / np.where(moved, dt, 1), 0)
+            q = np.where(s != 1, s / np.where(s != 1, s - 1, 1), self.q_min)
+            q = np.clip(q, self.q_min, self.q_max)
+            t_next = q * t + (1 - q) * g
+        self.t_last = t.copy()
+        self.g_last = g.copy()
+        return t_next
+
+
+class Anderson():
+    '''
+    Anderson acceleration of the tear streams with the last m differences, mixing parameter beta
+    '''
+
+    def __init__(self, m=5, beta=1.0):
+        self.m = m
+        self.beta = beta
+        self.reset()
+
+    def reset(self):
+        self.f_last = None
+        self.g_last = None
+        self.dF = []
+        self.dG = []
+
+    def __call__(self, t, g):
+        f = g - t
+        if self.f_last is not None:
+            self.dF.append(f - self.f_last)
+            self.dG.append(g - self.g_last)
+            self.dF = self.dF[-self.m:]
+            self.dG = self.dG[-self.m:]
+        self.f_last = f.copy()
+        self.g_last = g.copy()
+        if not self.dF:
+            return t + self.beta * f
+        dF = np.array(self.dF).T
+        dG = np.array(self.dG).T
+        gamma = np.linalg.lstsq(dF, f, rcond=1e-10)[0]
+        return g - dG @ gamma - (1 - self.beta) * (f - dF @ gamma)
+
+
+ACCELERATORS = {'direct': DirectSubstitution, 'wegstein': Wegstein, 'anderson': Anderson}
+
+
+class Module():
+    '''
+    Sub-problem of a sequential-modular solve: the units (keys of the model unit_dict) of the module and the
+    streams they compute, solved for given values of the streams entering the module.
+    '''
+
+    def __init__(self, name, unit_dict):
+        self.name = name
+        self.unit_dict = unit_dict
+        self.n_vars = sum(u.n_vars for u in get_var_offsets(unit_dict))
+        self.n_eqns = sum(unit_dict[k].num_eqns() for k in unit_dict)
+        self.eqns = np.zeros(self.n_eqns, dtype=np.float64)
+        self.inputs = []
+        self.x = None
+        self.jac = None
+        self.n_solves = 0
+        self.n_failures = 0
+        self.nit = 0
+
+    def solve(self, solver, solver_args):
+        '''
+        solve the module from its last solution (from the initial guess of initialize.initialize the first
+        time) and leave its streams at the solution
+        '''
+        if self.x is None:
+            self.x = initialize(self.unit_dict)
+            self.jac = SparseJacobian(self.unit_dict)
+        map_eqn_to_unit1(self.eqns, self.unit_dict)
+        result = solver(self.x, self.unit_dict, self.eqns, jac=self.jac, **solver_args)
+        x = np.array(result.x, dtype=np.float64)
+        if np.all(np.isfinite(x)):
+            self.x = x
+        map_var_to_unit1(self.x.copy(), self.unit_dict)
+        self.n_solves += 1
+        self.nit += result.get('nit', 0)
+        if not result.success:
+            self.n_failures += 1
+        return bool(result.success)
+
+
+class SequentialModular():
+    '''
+    Sequential-modular solver of the model in unit_dict.
+    modules optionally groups top-level units (lists of keys of unit_dict) into modules, in addition to the
+    automatic grouping of every SimpleColumn with its condenser and reboiler.
+    solver is the solver of the modules, called as solver(xvar, unit_dict, eqns, jac=..., **solver_args)
+    like sparse_solver.newton_sparse.
+    '''
+
+    def __init__(self, unit_dict, modules=None, solver=newton_sparse, **solver_args):
+        self.unit_dict = unit_dict
+        self.solver = solver
+        self.solver_args = solver_args
+
+        keys = sorted(unit_dict.keys())
+        streams = {unit_dict[k]: k for k in keys if isinstance(unit_dict[k], Stream)}
+        equipment = [k for k in keys if not isinstance(unit_dict[k], (Stream, Specify))]
+
+        # the unit computing every top-level stream
+        producer = dict()
+        for k in equipment:
+            u = unit_dict[k]
+            if isinstance(u, Connector):
+                outs = [u.stream_out]
+            elif isinstance(u, Mixer):
+                outs = u.streams_out
+            elif isinstance(u, SimpleColumn):
+                outs = [u.condensate, u.bottoms]
+            else:
+                outs = []
+            for s in outs:
+                assert s not in producer, '{} is computed by both {} and {}'.format(s.name, producer[s], k)
+                producer[s] = k
+
+        # group the units: every unit on its own, columns with their condensers and reboilers, user groups
+        group = {k: k for k in equipment}
+
+        def find(k):
+            while group[k] != k:
+                k = group[k]
+            return k
+
+        def merge(a, b):
+            a, b = find(a), find(b)
+            if a != b:
+                # a column gives its name to its module
+                if isinstance(unit_dict[b], SimpleColumn):
+                    a, b = b, a
+                group[b] = a
+
+        for k in equipment:
+            column = unit_dict[k]
+            if not isinstance(column, SimpleColumn):
+                continue
+            for m in equipment:
+                mixer = unit_dict[m]
+                if isinstance(mixer, Mixer) and \
+                        any(s is column.condensate or s is column.bottoms for s in mixer.streams_in) and \
+                        any(s is column.reflux or s is column.vapor_reboil for s in mixer.streams_out):
+                    merge(k, m)
+        for keys_in_module in (modules if modules is not None else []):
+            for k in keys_in_module[1:]:
+                merge(keys_in_module[0], k)
+
+        # the module of every stream: the module of its producer, or a source module of its own
+        owner = dict()
+        for s, k in streams.items():
+            owner[s] = find(producer[s]) if s in producer else k
+
+        def nested_streams(u):
+            for v in u.unit_dict.values():
+                if v.n_vars > 0:
+                    yield v
+                yield from nested_streams(v)
+
+        for k in equipment:
+            for s in nested_streams(unit_dict[k]):
+                owner[s] = find(k)
+
+        members = dict()
+        for k in equipment:
+            members.setdefault(find(k), []).append(k)
+        for s, k in streams.items():
+            members.setdefault(owner[s], []).append(k)
+        for k in keys:
+            u = unit_dict[k]
+            if isinstance(u, Specify):
+                assert u.stream in owner, '{} specifies a stream that is not part of the model'.format(k)
+                members[owner[u.stream]].append(k)
+
+        self.modules = dict()
+        for name in sorted(members):
+            module = Module(name, {k: unit_dict[k] for k in members[name]})
+            assert module.n_eqns == module.n_vars, \
+                'module {} has {} equations and {} variables (see structural.degrees_of_freedom)'.format(
+                    name, module.n_eqns, module.n_vars)
+            self.modules[name] = module
+
+        # the streams entering every module, and the graph of the modules
+        names = list(self.modules)
+        index = {name: i for i, name in enumerate(names)}
+        self.edges = dict()
+        for name, module in self.modules.items():
+            own = set(get_var_offsets(module.unit_dict))
+            entering = []
+
+            def collect(u):
+                for v in u.var_units():
+                    if v not in own and v not in entering:
+                        entering.append(v)
+                for v in u.unit_dict.values():
+                    collect(v)
+
+            for u in module.unit_dict.values():
+                collect(u)
+            for s in entering:
+                assert s in owner and s in streams, '{} uses {}, which is not part of the model'.format(name, s.name)
+                module.inputs.append(streams[s])
+                self.edges.setdefault((index[owner[s]], index[name]), []).append(streams[s])
+        self.tears = self.select_tears(names)
+        self.order = self.solve_order(names)
+        return
+
+    def select_tears(self, names):
+        '''
+        return the keys of the tear streams: the streams on the back edges of a depth first search of every
+        recycle loop, from the start module that gives the fewest torn variables
+        '''
+        n = len(names)
+        adjacency = [[] for _ in range(n)]
+        for (i, j) in sorted(self.edges):
+            adjacency[i].append(j)
+        rows = [i for i, _ in self.edges]
+        cols = [j for _, j in self.edges]
+        graph = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+        _, labels = connected_components(graph, directed=True, connection='strong')
+        tears = []
+        for label in np.unique(labels):
+            loop = set(np.flatnonzero(labels == label).tolist())
+            if len(loop) < 2:
+                continue
+            best = None
+            for start in sorted(loop):
+                back = []
+                state = dict()
+                stack = [(start, iter(adjacency[start]))]
+                state[start] = 1
+                while stack:
+                    i, neighbours = stack[-1]
+                    for j in neighbours:
+                        if j not in loop:
+                            continue
+                        if state.get(j) == 1:
+                            back.append((i, j))
+                        elif j not in state:
+                            state[j] = 1
+                            stack.append((j, iter(adjacency[j])))
+                            break
+                    else:
+                        state[i] = 2
+                        stack.pop()
+                torn = [s for edge in back for s in self.edges[edge]]
+                cost = sum(self.unit_dict[s].n_vars for s in torn)
+                if best is None or cost < best[0]:
+                    best = (cost, torn)
+            tears += best[1]
+        return tears
+
+    def solve_order(self, names):
+        '''
+        return the names of the modules in topological order of the graph without the tear streams
+        '''
+        n = len(names)
+        successors = [set() for _ in range(n)]
+        in_degree = np.zeros(n, dtype=np.int64)
+        for (i, j), keys in self.edges.items():
+            if all(k in self.tears for k in keys) or j in successors[i]:
+                continue
+            successors[i].add(j)
+            in_degree[j] += 1
+        ready = sorted(np.flatnonzero(in_degree == 0).tolist())
+        order = []
+        while ready:
+            i = ready.pop(0)
+            order.append(names[i])
+            for j in sorted(successors[i]):
+                in_degree[j] -= 1
+                if in_degree[j] == 0:
+                    ready.append(j)
+            ready.sort()
+        assert len(order) == n, 'the tear streams do not break all the recycle loops'
+        return order
+
+    def get_tears(self):
+        '''
+        return the values of the tear streams, concatenated
+        '''
+        if not self.tears:
+            return np.zeros(0, dtype=np.float64)
+        return np.concatenate([self.unit_dict[k].xvar for k in self.tears]).astype(np.float64)
+
+    def set_tears(self, t):
+        '''
+        set the tear streams to the values t (an array of their own, as for units outside a module)
+        '''
+        idx = 0
+        for k in self.tears:
+            s = self.unit_dict[k]
+            s.xvar = t[idx:idx+s.n_vars].copy()
+            idx += s.n_vars
+        return
+
+    def run_pass(self, t):
+        '''
+        solve all the modules in order with the tear streams at t, return the new values of the tear
+        streams and whether all the modules converged
+        '''
+        self.set_tears(t)
+        success = True
+        for name in self.order:
+            success = self.modules[name].solve(self.solver, self.solver_args) and success
+        return self.get_tears(), success
+
+    def solve(self, method='wegstein', tol=1e-8, max_iter=100, callback=None, **method_args):
+        """
+        Sequential-modular solve: converge the tear streams, solving the
+        modules in order at every iteration.
+        Parameters
+        ----------
+        method : str, optional
+            'direct' (direct substitution), 'wegstein' or 'anderson'.
+        tol : float, optional
+            convergence tolerance on the largest change of the tear stream
+            variables in a pass, relative to max(1, |value|).
+        max_iter : int, optional
+            maximum number of passes.
+        callback : callable, optional
+            called as callback(nit, t, error) after every pass.
+        **method_args
+            arguments of the accelerator (Wegstein: q_min, q_max; Anderson:
+            m, beta).
+
+        Returns
+        -------
+        OptimizeResult
+            x (variable array of the whole model), success, message, nit
+            (passes), error (last tear error), tears, fun (residuals of the
+            whole model) and module_iterations (Newton iterations of every
+            module).
+
+        """
+        assert method in ACCELERATORS, 'Unknown method {}'.format(method)
+        accelerate = ACCELERATORS[method](**method_args)
+        t = self.get_tears()
+        # flows and fractions of the tear streams stay non-negative
+        lower = np.concatenate([np.r_[0, -np.inf, np.zeros(self.unit_dict[k].n_comps)] for k in self.tears]) \
+            if self.tears else np.zeros(0)
+        success = False
+        error = np.inf
+        message = 'The maximum number of iterations was reached.'
+        for nit in range(1, max_iter + 1):
+            g, modules_ok = self.run_pass(t)
+            error = float(np.max(np.abs(g - t) / np.maximum(1, np.abs(t)))) if len(t) else 0.0
+            if callback is not None:
+                callback(nit, t, error)
+            if error < tol and modules_ok:
+                success = True
+                message = 'The tear streams converged.'
+                break
+            t = np.maximum(accelerate(t, g), lower)
+        x = get_unit_vars(self.unit_dict)
+        eqns = np.zeros(len(x), dtype=np.float64)
+        map_eqn_to_unit1(eqns, self.unit_dict)
+        f = np.array(process_eqns(x, self.unit_dict, eqns))
+        return OptimizeResult(x=x, success=success, message=message, nit=nit, error=error,
+                              tears=list(self.tears), fun=f,
+                              module_iterations={name: m.nit for name, m in self.modules.items()})
+
+    def solve_equation_oriented(self, xvar=None, eqns=None, solver=newton_sparse, **kwargs):
+        """
+        Equation-oriented solve of the whole model.
+        Parameters
+        ----------
+        xvar : array, optional
+            initial guess for the variable array. The default is the
+            current values of the variables (e.g. the sequential-modular
+            solution).
+        eqns : array, optional
+            equations for all the Unit objects in the model.
+        solver : callable, optional
+            called as solver(xvar, unit_dict, eqns, **kwargs). The default
+            is sparse_solver.newton_sparse.
+
+        Returns
+        -------
+        OptimizeResult
+            the result of the solver.
+
+        """
+        if xvar is None:
+            xvar = get_unit_vars(self.unit_dict)
+        if eqns is None:
+            eqns = np.zeros(len(xvar), dtype=np.float64)
+        map_eqn_to_unit1(eqns, self.unit_dict)
+        result = solver(xvar, self.unit_dict, eqns, **kwargs)
+        map_var_to_unit1(np.array(result.x, dtype=np.float64), self.unit_dict)
+        return result
+
+    def summary(self):
+        '''
+        return the modules, the tear streams and the order of the solve as text
+        '''
+        s = 'modules (in the order of the solve):\n'
+        for name in self.order:
+            m = self.modules[name]
+            s += '  {}: {} units, {} equations, streams in: {}\n'.format(
+                name, len(m.unit_dict), m.n_eqns, ', '.join(m.inputs) if m.inputs else 'none')
+        s += 'tear streams: {}\n'.format(', '.join(self.tears) if self.tears else 'none')
+        return s
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Solver session for repeated solves of one model after small changes of its
+inputs (specified values, column pressure, connector differences, ...).
+The session keeps the last solution and the sparse LU factorization of the
+last Jacobian. A re-solve starts from the last solution and takes
+quasi-Newton steps with the kept factorization, improved with Broyden
+updates. The Jacobian is evaluated and factorized again only when the
+convergence stalls, so a re-solve after a small change costs a few residual
+evaluations.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from scipy.optimize import OptimizeResult
+from sim_utils import map_var_to_unit1, map_eqn_to_unit1, get_unit_vars, set_input
+from compiled import CompiledModel
+from sparse_solver import SparseJacobian, newton_sparse
+
+
+class SolverSession():
+    '''
+    Persistent solver of the model in unit_dict.
+    fun and jac default to CompiledModel(unit_dict) and SparseJacobian(unit_dict). xvar defaults to
+    the current variables of the units.
+    '''
+
+    def __init__(self, unit_dict, xvar=None, fun=None, jac=None, tol=1e-10, max_iter=50, max_updates=20):
+        self.unit_dict = unit_dict
+        self.fun = CompiledModel(unit_dict) if fun is None else fun
+        self.jac = SparseJacobian(unit_dict) if jac is None else jac
+        self.x = get_unit_vars(unit_dict) if xvar is None else np.array(xvar, dtype=np.float64)
+        self.eqns = np.zeros(len(self.x), dtype=np.float64)
+        map_var_to_unit1(self.x.copy(), unit_dict)
+        map_eqn_to_unit1(self.eqns, unit_dict)
+        self.tol = tol
+        self.max_iter = max_iter
+        self.max_updates = max_updates
+        # factorization of the last Jacobian and the Broyden updates (u, s) of its inverse
+        self.lu = None
+        self.updates = []
+        # totals over the session
+        self.nfev = 0
+        self.njev = 0
+
+    def set_input(self, name, value):
+        '''
+        change an input of the model (see sim_utils.set_input); the factorization is kept
+        '''
+        set_input(self.unit_dict, name, value)
+        return
+
+    def factorize(self, x):
+        '''
+        evaluate and factorize the Jacobian at x, dropping the Broyden updates
+        '''
+        J = sp.csc_matrix(self.jac(x, self.unit_dict, self.eqns))
+        self.njev += 1
+        self.lu = splu(J)
+        self.updates = []
+        return
+
+    def solve_linear(self, f):
+        '''
+        return H f, with H the inverse of the factorized Jacobian after the Broyden updates
+        '''
+        z = self.lu.solve(f)
+        for u, s in self.updates:
+            z += u * (s @ z)
+        return z
+
+    def residuals(self, x):
+        self.nfev += 1
+        return np.array(self.fun(x, self.unit_dict, self.eqns))
+
+    def solve(self, xvar=None):
+        """
+        Solve the model, starting from the last solution.
+        Parameters
+        ----------
+        xvar : array, optional
+            initial guess. The default is the last solution.
+
+        Returns
+        -------
+        OptimizeResult
+            x, success, message, fun, nfev, njev and nit of this solve.
+            If the quasi-Newton steps fail with a fresh Jacobian, the result
+            of sparse_solver.newton_sparse is returned.
+
+        """
+        nfev = self.nfev
+        njev = self.njev
+        x = self.x.copy() if xvar is None else np.array(xvar, dtype=np.float64)
+        f = self.residuals(x)
+        norm_f = np.linalg.norm(f)
+        fresh = False
+        success = False
+        message = 'Maximum number of iterations reached.'
+        for nit in range(self.max_iter):
+            if norm_f < self.tol:
+                success = True
+                message = 'The 2-norm of the residuals is less than tol.'
+                break
+            if self.lu is None or len(self.updates) >= self.max_updates:
+                try:
+                    self.factorize(x)
+                except RuntimeError:
+                    self.lu = None
+                    break
+                fresh = True
+            dx = -self.solve_linear(f)
+            x_new = x + dx
+            f_new = self.residuals(x_new)
+            norm_new = np.linalg.norm(f_new)
+            if not np.isfinite(norm_new) or norm_new >= norm_f:
+                if fresh:
+                    # not even a fresh Jacobian gives a decrease
+                    break
+                # stalled: refactorize at the current point
+                self.lu = None
+                continue
+
+            # Broyden update of the inverse: H += (s - H y) s' H / (s' H y)
+            Hy = self.solve_linear(f_new - f)
+            denom = dx @ Hy
+            if abs(denom) > 1e-12 * np.linalg.norm(dx) * np.linalg.norm(Hy):
+                self.updates.append(((dx - Hy) / denom, dx))
+            if norm_new > 0.5 * norm_f:
+                # slow convergence: refactorize at the next iteration
+                self.lu = None
+            x, f, norm_f = x_new, f_new, norm_new
+            fresh = False
+        else:
+            nit = self.max_iter
+            if norm_f < self.tol:
+                success = True
+                message = 'The 2-norm of the residuals is less than tol.'
+
+        if not success:
+            # fall back to the damped Newton solver
+            res = newton_sparse(x, self.unit_dict, self.eqns, fun=self.fun, jac=self.jac, tol=self.tol)
+            self.nfev += res.nfev
+            self.njev += res.njev
+            if res.success:
+                self.x = res.x
+                self.lu = None
+            res.nfev = self.nfev - nfev
+            res.njev = self.njev - njev
+            res.nit += nit
+            return res
+
+        self.x = x
+        # leave the model mapped to the solution
+        map_var_to_unit1(self.x.copy(), self.unit_dict)
+        return OptimizeResult(x=x.copy(), success=success, message=message, fun=f,
+                              nfev=self.nfev - nfev, njev=self.njev - njev, nit=nit)
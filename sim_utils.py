@@ -1,203 +1,374 @@
-# -*- coding: utf-8 -*-
-"""
-Utility functions used in the running of a simulation.
-"""
-
-import numpy as np
-
-def map_var_to_unit1(x, unit_dict):
-    """
-    Map simulation variable array to the variables in each Unit object
-    in unit_dict.
-    Parameters
-    ----------
-    x : array
-        variable array used by the nonlinear equation solver.
-    unit_dict : dict
-        dictionary containing all Unit objects in the simulation.
-
-    Returns
-    -------
-    None.
-
-    """
-
-    def map_var_to_unit2(x, unit_dict, idx):
-        
-        for u in sorted(unit_dict.keys()):
-            n_vars = unit_dict[u].n_vars
-            if n_vars > 0:
-                #print(type(x))
-                unit_dict[u].xvar = x[idx:idx+n_vars]
-                idx += n_vars
-            idx = map_var_to_unit2(x, unit_dict[u].unit_dict, idx)
-        return idx
-
-    idx = 0
-    map_var_to_unit2(x, unit_dict, idx)
-    
-    
-def map_eqn_to_unit1(e, unit_dict):
-    """
-    Map equation array to the equations in each Unit object
-    in unit_dict.
-    Parameters
-    ----------
-    e : array
-        equation array used by the nonlinear equation solver.
-    unit_dict : dict
-        dictionary containing all Unit objects in the simulation.
-
-    Returns
-    -------
-    None.
-
-    """
-
-    def map_eqn_to_unit2(e, unit_dict, idx):
-        for u in sorted(unit_dict.keys()):
-            n_eqns = unit_dict[u].n_eqns
-            if n_eqns > 0:
-                unit_dict[u].eqns = e[idx:idx+n_eqns]
-#                e[idx:idx+n_eqns] = unit_dict[u].eqns
-                #print(u, idx, idx+n_eqns-1)
-                idx += n_eqns
-            idx = map_eqn_to_unit2(e, unit_dict[u].unit_dict, idx)
-        return idx
-
-    idx = 0
-    map_eqn_to_unit2(e, unit_dict, idx)
-    
-    
-def process_eqns(xvar, unit_dict, eqns):
-    """
-    Evaluates the equations of each Unit object.
-    Parameters
-    ----------
-    xvar : array
-        variable array for which to evaluate the equations.
-    unit_dict : dict
-        dictionary containing all the Unit objects in the model.
-    eqns : array
-        equations for all the Unit objects in the model.
-
-    Returns
-    -------
-    array
-        evaluated equations for all the Unit objects in the model.
-
-    """
-    map_var_to_unit1(xvar, unit_dict)
-    for u in sorted(unit_dict.keys()):
-        unit_dict[u].calculate()
-    return eqns.tolist()
-
-
-def get_info(unit_dict):
-    """
-    Print model info.
-    Parameters
-    ----------
-    unit_dict : dict
-        dictionary containing all Unit objects in the simulation.
-
-    Returns
-    -------
-    info : str
-        information about the unit_dict
-
-    """
-
-    def get_info2(unit_dict, info):
-        info = info + 'unit_dict contains {}'.format(list(unit_dict.keys()))
-        for u in sorted(unit_dict.keys()):
-            info = info + '\n' + str(unit_dict[u])
-            if not unit_dict[u].unit_dict:
-                info = info + u + ' has NO unit_dict \n'
-            else:
-                info = info + u + ' has a unit_dict with ' + str(len(unit_dict[u].unit_dict.keys())) + ' items\n'
-                info = info + 'entering recursion\n'
-                info = get_info2(unit_dict[u].unit_dict, info)
-                info = info + 'exited recursion\n'
-        return info
-
-    info = get_info2(unit_dict, '')        
-    return info
-
-
-def get_num_vars(unit_dict):
-    """
-    calculate the total number of variables for all the units in unit_dict.
-
-    Parameters
-    ----------
-    unit_dict : dict
-        dictionary containing all the Unit objects in the simulation.
-
-    Returns
-    -------
-    nvars : integer
-        total number of variables.
-
-    """
-    nvars = 0
-    for u in sorted(unit_dict.keys()):
-        nvars += unit_dict[u].num_vars()
-    return nvars
-
-
-def get_num_eqns(unit_dict):
-    """
-    calculate the total number of equations for all the units in unit_dict.
-
-    Parameters
-    ----------
-    unit_dict : dict
-        dictionary containing all the Unit objects in the simulation.
-
-    Returns
-    -------
-    neqns : integer
-        total number of equations.
-
-    """
-    neqns = 0
-    for u in sorted(unit_dict.keys()):
-        neqns += unit_dict[u].num_eqns()
-    return neqns
-
-
-def get_unit_vars(unit_dict):
-    """
-    Get variable array of all the variables in each Unit object
-    in unit_dict.
-    Parameters
-    ----------
-    unit_dict : dict
-        dictionary containing all Unit objects in the simulation.
-
-    Returns
-    -------
-    x : array
-        variable array used by the nonlinear equation solver.
-
-    """
-
-    def get_unit_vars_inner(x, unit_dict, idx):
-        
-        for u in sorted(unit_dict.keys()):
-            n_vars = unit_dict[u].n_vars
-            if n_vars > 0:
-                #print(type(x))
-                for i in range(n_vars):
-                    x[idx+i] = unit_dict[u].xvar[i]
-                idx += n_vars
-            x, idx = get_unit_vars_inner(x, unit_dict[u].unit_dict, idx)
-        return x, idx
-
-    x = np.zeros(get_num_vars(unit_dict), dtype=np.float64)
-    idx = 0
-    x, idx = get_unit_vars_inner(x, unit_dict, idx)
-    return x
-    
-    
+# -*- coding: utf-8 -*-
+"""
+Utility functions used in the running of a simulation.
+"""
+
+import numpy as np
+
+def map_var_to_unit1(x, unit_dict):
+    """
+    Map simulation variable array to the variables in each Unit object
+    in unit_dict.
+    Parameters
+    ----------
+    x : array
+        variable array used by the nonlinear equation solver. may have
+        leading batch dimensions, shape (..., n_vars).
+    unit_dict : dict
+        dictionary containing all Unit objects in the simulation.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    def map_var_to_unit2(x, unit_dict, idx):
+        
+        for u in sorted(unit_dict.keys()):
+            n_vars = unit_dict[u].n_vars
+            if n_vars > 0:
+                #print(type(x))
+                unit_dict[u].xvar = x[..., idx:idx+n_vars]
+                idx += n_vars
+            idx = map_var_to_unit2(x, unit_dict[u].unit_dict, idx)
+        return idx
+
+    idx = 0
+    map_var_to_unit2(x, unit_dict, idx)
+    
+    
+def map_eqn_to_unit1(e, unit_dict):
+    """
+    Map equation array to the equations in each Unit object
+    in unit_dict.
+    Parameters
+    ----------
+    e : array
+        equation array used by the nonlinear equation solver. may have
+        leading batch dimensions, shape (..., n_eqns).
+    unit_dict : dict
+        dictionary containing all Unit objects in the simulation.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    def map_eqn_to_unit2(e, unit_dict, idx):
+        for u in sorted(unit_dict.keys()):
+            n_eqns = unit_dict[u].n_eqns
+            if n_eqns > 0:
+                unit_dict[u].eqns = e[..., idx:idx+n_eqns]
+#                e[idx:idx+n_eqns] = unit_dict[u].eqns
+                #print(u, idx, idx+n_eqns-1)
+                idx += n_eqns
+            idx = map_eqn_to_unit2(e, unit_dict[u].unit_dict, idx)
+        return idx
+
+    idx = 0
+    map_eqn_to_unit2(e, unit_dict, idx)
+    
+    
+def process_eqns(xvar, unit_dict, eqns):
+    """
+    Evaluates the equations of each Unit object.
+    Parameters
+    ----------
+    xvar : array
+        variable array for which to evaluate the equations.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    eqns : array
+        equations for all the Unit objects in the model.
+
+    Returns
+    -------
+    array
+        evaluated equations for all the Unit objects in the model.
+
+    """
+    map_var_to_unit1(xvar, unit_dict)
+    for u in sorted(unit_dict.keys()):
+        unit_dict[u].calculate()
+    return eqns.tolist()
+
+
+def process_eqns_batch(xvar, unit_dict, eqns):
+    """
+    Evaluates the equations of each Unit object for a batch of variable
+    arrays at once: the units are mapped to views with the batch dimension
+    first, and their calculate methods index the last dimension
+    (xvar[..., i]).
+    Parameters
+    ----------
+    xvar : array
+        variable arrays for which to evaluate the equations, shape
+        (n_batch, n_vars).
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model. Specify
+        values may be arrays of shape (n_batch,).
+    eqns : array
+        equations for all the Unit objects in the model, shape
+        (n_batch, n_eqns).
+
+    Returns
+    -------
+    array
+        evaluated equations, shape (n_batch, n_eqns).
+
+    """
+    map_var_to_unit1(xvar, unit_dict)
+    map_eqn_to_unit1(eqns, unit_dict)
+    for u in sorted(unit_dict.keys()):
+        unit_dict[u].calculate()
+    return eqns
+
+
+def get_var_offsets(unit_dict):
+    """
+    Get the position in the variable array of the variables of each Unit
+    object in unit_dict. The positions follow the same ordering as
+    map_var_to_unit1.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all Unit objects in the simulation.
+
+    Returns
+    -------
+    var_offsets : dict
+        Unit object: index of its first variable, for every Unit object
+        with variables.
+
+    """
+
+    def get_var_offsets2(unit_dict, var_offsets, idx):
+        for u in sorted(unit_dict.keys()):
+            n_vars = unit_dict[u].n_vars
+            if n_vars > 0:
+                var_offsets[unit_dict[u]] = idx
+                idx += n_vars
+            idx = get_var_offsets2(unit_dict[u].unit_dict, var_offsets, idx)
+        return idx
+
+    var_offsets = dict()
+    get_var_offsets2(unit_dict, var_offsets, 0)
+    return var_offsets
+
+
+def get_eqn_offsets(unit_dict):
+    """
+    Get the position in the equation array of the equations of each Unit
+    object in unit_dict. The positions follow the same ordering as
+    map_eqn_to_unit1.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all Unit objects in the simulation.
+
+    Returns
+    -------
+    eqn_offsets : list
+        (Unit object, index of its first equation) for every Unit object
+        with equations.
+
+    """
+
+    def get_eqn_offsets2(unit_dict, eqn_offsets, idx):
+        for u in sorted(unit_dict.keys()):
+            n_eqns = unit_dict[u].n_eqns
+            if n_eqns > 0:
+                eqn_offsets.append((unit_dict[u], idx))
+                idx += n_eqns
+            idx = get_eqn_offsets2(unit_dict[u].unit_dict, eqn_offsets, idx)
+        return idx
+
+    eqn_offsets = list()
+    get_eqn_offsets2(unit_dict, eqn_offsets, 0)
+    return eqn_offsets
+
+
+def process_jac(xvar, unit_dict, eqns):
+    """
+    Evaluates the Jacobian of the equations of each Unit object from the
+    analytic partial derivatives provided by Unit.jacobian. Takes the same
+    arguments as process_eqns, so it can be passed as jac to
+    scipy.optimize.root (or as fprime to fsolve).
+    Parameters
+    ----------
+    xvar : array
+        variable array for which to evaluate the Jacobian.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    eqns : array
+        equations for all the Unit objects in the model.
+
+    Returns
+    -------
+    jac : array
+        Jacobian matrix, jac[i, j] = d eqns[i] / d xvar[j].
+
+    """
+    map_var_to_unit1(xvar, unit_dict)
+    var_offsets = get_var_offsets(unit_dict)
+    jac = np.zeros((len(eqns), len(xvar)), dtype=np.float64)
+    for unit, e_idx in get_eqn_offsets(unit_dict):
+        partials = unit.jacobian()
+        if partials is None:
+            raise NotImplementedError('{} has no analytic Jacobian'.format(unit.name))
+        for u, d in partials:
+            # variables of units that are not part of the model are constants
+            if u in var_offsets:
+                v_idx = var_offsets[u]
+                jac[e_idx:e_idx+unit.n_eqns, v_idx:v_idx+u.n_vars] += d
+    return jac
+
+
+def get_info(unit_dict):
+    """
+    Print model info.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all Unit objects in the simulation.
+
+    Returns
+    -------
+    info : str
+        information about the unit_dict
+
+    """
+
+    def get_info2(unit_dict, info):
+        info = info + 'unit_dict contains {}'.format(list(unit_dict.keys()))
+        for u in sorted(unit_dict.keys()):
+            info = info + '\n' + str(unit_dict[u])
+            if not unit_dict[u].unit_dict:
+                info = info + u + ' has NO unit_dict \n'
+            else:
+                info = info + u + ' has a unit_dict with ' + str(len(unit_dict[u].unit_dict.keys())) + ' items\n'
+                info = info + 'entering recursion\n'
+                info = get_info2(unit_dict[u].unit_dict, info)
+                info = info + 'exited recursion\n'
+        return info
+
+    info = get_info2(unit_dict, '')        
+    return info
+
+
+def get_num_vars(unit_dict):
+    """
+    calculate the total number of variables for all the units in unit_dict.
+
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the simulation.
+
+    Returns
+    -------
+    nvars : integer
+        total number of variables.
+
+    """
+    nvars = 0
+    for u in sorted(unit_dict.keys()):
+        nvars += unit_dict[u].num_vars()
+    return nvars
+
+
+def get_num_eqns(unit_dict):
+    """
+    calculate the total number of equations for all the units in unit_dict.
+
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the simulation.
+
+    Returns
+    -------
+    neqns : integer
+        total number of equations.
+
+    """
+    neqns = 0
+    for u in sorted(unit_dict.keys()):
+        neqns += unit_dict[u].num_eqns()
+    return neqns
+
+
+def get_unit_vars(unit_dict):
+    """
+    Get variable array of all the variables in each Unit object
+    in unit_dict.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all Unit objects in the simulation.
+
+    Returns
+    -------
+    x : array
+        variable array used by the nonlinear equation solver.
+
+    """
+
+    def get_unit_vars_inner(x, unit_dict, idx):
+        
+        for u in sorted(unit_dict.keys()):
+            n_vars = unit_dict[u].n_vars
+            if n_vars > 0:
+                #print(type(x))
+                for i in range(n_vars):
+                    x[idx+i] = unit_dict[u].xvar[i]
+                idx += n_vars
+            x, idx = get_unit_vars_inner(x, unit_dict[u].unit_dict, idx)
+        return x, idx
+
+    x = np.zeros(get_num_vars(unit_dict), dtype=np.float64)
+    idx = 0
+    x, idx = get_unit_vars_inner(x, unit_dict, idx)
+    return x
+    
+    
+def set_input(unit_dict, name, value):
+    """
+    Set an input of the model.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all Unit objects in the simulation.
+    name : str
+        'key' sets the value of the Specify object unit_dict[key] (Specify.update).
+        'key.pressure' sets the pressure of the SimpleColumn (or Tray) object
+        unit_dict[key].
+        'key.tray_efficiency' sets the tray efficiency of the SimpleColumn
+        (or Tray) object unit_dict[key].
+        'key.attr' in general calls unit_dict[key].update_attr, e.g.
+        'key.flow_diff' and 'key.temp_diff' for a Connector object.
+    value : float
+        new value of the input.
+
+    Returns
+    -------
+    None.
+
+    """
+    key, _, attr = name.partition('.')
+    assert key in unit_dict, '{} is not in the model'.format(key)
+    unit = unit_dict[key]
+    if attr == '':
+        unit.update(value)
+    elif attr == 'pressure':
+        if hasattr(unit, 'update_press'):
+            unit.update_press(value)
+        else:
+            unit.update_pressure(value)
+    elif hasattr(unit, 'update_' + attr):
+        getattr(unit, 'update_' + attr)(value)
+    else:
+        raise ValueError('{}: unknown input {}'.format(name, attr))
+    return
@@ -1,205 +1,292 @@
-# -*- coding: utf-8 -*-
-"""
-Distillation column with a single saturated liquid feed stream.
-Feed cannot be to the top or bottom tray.
-Total condenser and total reboiler.
-Same specified pressure on each tray.
-"""
-
-import numpy as np
-import pandas as pd
-from unit import Unit
-from stream import Stream
-from tray import Tray
-from connector import Connector
-from mixer import Mixer
-
-class SimpleColumn(Unit):
-    
-    n_columns = 0
-    
-    def __init__(self, n_trays, feed_tray, feed_stream_liq, reflux, vapor_reboil, condensate,
-                 bottoms, pressure, tray_efficiency=1.0, name=None):
-        '''
-        feed_tray must be an integer between 1 and n_trays-2 (feed cannot be to the top or bottom trays for now)
-        the bottom tray is tray number zero
-        the top tray is tray number n_trays-1
-        
-        the default efficiency is 1 for all trays.
-        if tray_efficiency is a scalar, it is used for all trays.
-        if tray_efficiency is a dict (tray:efficiency), it is used for the specified trays. the remaining are
-        assigned an efficiency of 1.
-        '''
-        self.column_num = SimpleColumn.n_columns
-        super().__init__(name, self.column_num)
-        SimpleColumn.n_columns += 1
-        
-        assert n_trays > 0, '{}: Number of tray must be greater than zero (specified {})'.format(self.name, n_trays)
-        self.n_trays = n_trays
-        
-        assert (feed_tray >= 1) and (feed_tray <= self.n_trays-2), \
-            '{}: Feed tray number must be from 1 to {} inclusive (specified {}). No feed to the top or bottom trays for now' \
-            .format(self.name, self.n_trays-2, feed_tray)
-        self.feed_tray = feed_tray
-        
-        self.feed_stream_liq = feed_stream_liq
-        self.reflux = reflux
-        self.vapor_reboil = vapor_reboil
-        self.condensate = condensate
-        self.bottoms = bottoms
-        self.pressure = pressure
-        self.n_vars = 0
-        self.n_eqns = 0
-        self.xvar = None
-        self.eqns = None
-            
-        
-        # figure out number of streams to be created as part of this column
-        # for each tray, there are two streams leaving (one liquid, one vapor)
-        # one liquid feed stream (comes from outside the column)
-        # one stream that is a combination of the liquid feed stream and the liquid from the tray above the feed tray
-        
-        # create the streams associated with the column
-        # tray liquid and vapor streams
-        self.tray_liq_stream = []
-        for i_tray in range(self.n_trays):
-            name = self.name+'Tray'+str(i_tray)+'Liquid'
-#            self.tray_liq_stream.append(Stream(n_comps=N_COMPS, name=name))
-            self.tray_liq_stream.append(Stream(n_comps=self.feed_stream_liq.n_comps, name=name))
-
-        self.tray_vap_stream = []
-        for i_tray in range(self.n_trays):
-            name = self.name+'Tray'+str(i_tray)+'Vapor'
-#            self.tray_vap_stream.append(Stream(n_comps=N_COMPS, name=name))
-            self.tray_vap_stream.append(Stream(n_comps=self.feed_stream_liq.n_comps, name=name))
-
-        # create the mixed stream consisting of the feed stream and the liquid from the tray above the feed tray
-        name = self.name+'MixedLiquidFeed'
-#        self.mixed_liq_feed = Stream(n_comps=N_COMPS, name=name)
-        self.mixed_liq_feed = Stream(n_comps=self.feed_stream_liq.n_comps, name=name)
-        self.unit_dict[name] = self.mixed_liq_feed
-        
-        # create the mixer needed to mix the liquid feed and the liquid from the tray above the feed tray
-        name=self.name+'FeedMixer'
-        self.feed_mixer = Mixer(streams_in=[self.feed_stream_liq, self.tray_liq_stream[feed_tray+1]], 
-                                streams_out=[self.mixed_liq_feed],
-                                name=name)
-        self.unit_dict[name] = self.feed_mixer
-        
-        # create trays
-        self.trays = []
-        for i_tray in range(self.n_trays):
-            name=self.name+'Tray'+str(i_tray)
-            if i_tray == self.feed_tray:
-                self.trays.append(Tray(liq_stream_in=self.mixed_liq_feed, 
-                                       liq_stream_out=self.tray_liq_stream[i_tray],
-                                       vap_stream_in=self.tray_vap_stream[i_tray-1], 
-                                       vap_stream_out=self.tray_vap_stream[i_tray], 
-                                       tray_efficiency=1, # will be updated later
-                                       pressure=self.pressure, 
-                                       name=name))
-            elif i_tray == 0:
-                self.trays.append(Tray(liq_stream_in=self.tray_liq_stream[i_tray+1], 
-                                       liq_stream_out=self.tray_liq_stream[i_tray],
-                                       vap_stream_in=self.vapor_reboil, 
-                                       vap_stream_out=self.tray_vap_stream[i_tray], 
-                                       tray_efficiency=1, # will be updated later
-                                       pressure=self.pressure, 
-                                       name=name))
-            elif i_tray == self.n_trays-1:
-                self.trays.append(Tray(liq_stream_in=self.reflux, 
-                                       liq_stream_out=self.tray_liq_stream[i_tray],
-                                       vap_stream_in=self.tray_vap_stream[i_tray-1], 
-                                       vap_stream_out=self.tray_vap_stream[i_tray], 
-                                       tray_efficiency=1, # will be updated later
-                                       pressure=self.pressure, 
-                                       name=name))
-            else:
-                self.trays.append(Tray(liq_stream_in=self.tray_liq_stream[i_tray+1], 
-                                       liq_stream_out=self.tray_liq_stream[i_tray],
-                                       vap_stream_in=self.tray_vap_stream[i_tray-1], 
-                                       vap_stream_out=self.tray_vap_stream[i_tray], 
-                                       tray_efficiency=1, # will be updated later
-                                       pressure=self.pressure, 
-                                       name=name))
-                
-        self.update_tray_efficiency(tray_efficiency)
-                
-        for s in self.tray_liq_stream:
-            self.unit_dict[s.name] = s
-
-        for s in self.tray_vap_stream:
-            self.unit_dict[s.name] = s
-        
-        for s in self.trays:
-            self.unit_dict[s.name] = s
-        
-        name = self.name+'CondensateConnector'
-        self.condensate_connector = Connector(self.condensate, self.tray_vap_stream[n_trays-1], name=name)
-        self.unit_dict[name] = self.condensate_connector
-            
-        name = self.name+'BottomsConnector'
-        self.bottoms_connector = Connector(self.bottoms, self.tray_liq_stream[0], name=name)
-        self.unit_dict[name] = self.bottoms_connector
-            
-    def __str__(self):
-        s = 'SimpleColumn name: {}\n'.format(self.name)
-        s = s + 'SimpleColumn number: {}\n'.format(self.column_num)
-        s = s + 'Number of trays: {}\n'.format(self.n_trays)
-        s = s + 'Feed tray: {}\n'.format(self.feed_tray)
-        s = s + 'Pressure: {}\n'.format(self.pressure)
-        s = s + 'Liquid feed stream: {}\n'.format(self.feed_stream_liq.name)
-        s = s + 'Reflux stream: {}\n'.format(self.reflux.name)
-        s = s + 'Vapor reboil stream: {}\n'.format(self.vapor_reboil.name)
-        s = s + 'Tray efficiencies: {}\n'.format(self.tray_efficiency)
-        s = s + super().__str__()
-        return s
-        
-    def calculate(self):
-        for u in self.unit_dict:
-            self.unit_dict[u].calculate()
-            
-    def profile(self):
-        '''
-        return a pandas data frame containing the flow, temperature and composition profiles for each of the trays
-        the row for each tray contains the following columns:
-        0: tray number
-        1: liquid flow from tray
-        2: vapor flow from tray
-        3: tray temperature
-        4:4+n_comps: liquid fractions
-        4+n_comps:4+2*n_comps: vapor fractions
-        '''
-        p = np.ones((self.n_trays, 2 * self.trays[0].liq_stream_out.n_vars), dtype=np.float64) * (-1)
-        n_comps = self.trays[0].liq_stream_out.n_comps
-        cols = ['tray_num','L','V','T']
-        cols = cols + ['{}'.format(a+str(b)) for a,b in zip(n_comps*['x'], range(n_comps))]
-        cols = cols + ['{}'.format(a+str(b)) for a,b in zip(n_comps*['y'], range(n_comps))]
-        for i_tray in range(self.n_trays):
-            p[i_tray, 0] = i_tray
-            p[i_tray, 1] = self.trays[i_tray].liq_stream_out.xvar[0]
-            p[i_tray, 2] = self.trays[i_tray].vap_stream_out.xvar[0]
-            p[i_tray, 3] = self.trays[i_tray].liq_stream_out.xvar[1]
-            p[i_tray, 4:4+n_comps] = self.trays[i_tray].liq_stream_out.xvar[2:]
-            p[i_tray, 4+n_comps:4+2*n_comps] = self.trays[i_tray].vap_stream_out.xvar[2:]
-        return pd.DataFrame(data=p, columns=cols)
-    
-    def update_press(self, pressure):
-        self.pressure = pressure
-        for tray in self.trays:
-            tray.update_pressure(self.pressure)
-        return
-    
-    def update_tray_efficiency(self, tray_efficiency):
-        # make list of tray efficiencies
-        if isinstance(tray_efficiency, dict):
-            self.tray_efficiency = [1.0] * self.n_trays
-            for t, eff in tray_efficiency.items():
-                self.tray_efficiency[t] = eff
-        else: # assume it is a scalar
-            self.tray_efficiency = [tray_efficiency] * self.n_trays
-            
-        for i, tray in enumerate(self.trays):
-            tray.update_tray_efficiency(self.tray_efficiency[i])
-        return
+# -*- coding: utf-8 -*-
+"""
+Distillation column with a single saturated liquid feed stream.
+Feed cannot be to the top or bottom tray.
+Total condenser and total reboiler.
+Same specified pressure on each tray.
+"""
+
+import numpy as np
+from unit import Unit
+from flowsheet import current_flowsheet
+from stream import Stream, stream_table
+from tray import Tray
+from connector import Connector
+from mixer import Mixer
+from sim_utils import get_var_offsets
+
+class SimpleColumn(Unit):
+    
+    def __init__(self, n_trays, feed_tray, feed_stream_liq, reflux, vapor_reboil, condensate,
+                 bottoms, pressure, tray_efficiency=1.0, components=None, dynamic=False, weir_holdup=1.0,
+                 weir_coef=100.0, name=None):
+        '''
+        feed_tray must be an integer between 1 and n_trays-2 (feed cannot be to the top or bottom trays for now)
+        the bottom tray is tray number zero
+        the top tray is tray number n_trays-1
+        
+        the default efficiency is 1 for all trays.
+        if tray_efficiency is a scalar, it is used for all trays.
+        if tray_efficiency is a dict (tray:efficiency), it is used for the specified trays. the remaining are
+        assigned an efficiency of 1.
+        
+        components is the phy_props.ComponentSet of the streams, used by all trays
+        (the components of the current flowsheet, see flowsheet.Flowsheet, if not given).
+        
+        dynamic, weir_holdup and weir_coef are passed to the trays: in dynamic mode each tray has a
+        liquid holdup, see Tray.
+        '''
+        self.column_num = current_flowsheet().number(SimpleColumn)
+        super().__init__(name, self.column_num)
+        
+        assert n_trays > 0, '{}: Number of tray must be greater than zero (specified {})'.format(self.name, n_trays)
+        self.n_trays = n_trays
+        
+        assert (feed_tray >= 1) and (feed_tray <= self.n_trays-2), \
+            '{}: Feed tray number must be from 1 to {} inclusive (specified {}). No feed to the top or bottom trays for now' \
+            .format(self.name, self.n_trays-2, feed_tray)
+        self.feed_tray = feed_tray
+        
+        self.feed_stream_liq = feed_stream_liq
+        self.reflux = reflux
+        self.vapor_reboil = vapor_reboil
+        self.condensate = condensate
+        self.bottoms = bottoms
+        self.pressure = pressure
+        if components is None:
+            components = current_flowsheet().components
+        self.components = components
+        self.dynamic = dynamic
+        self.n_vars = 0
+        self.n_eqns = 0
+        self.xvar = None
+        self.eqns = None
+            
+        
+        # figure out number of streams to be created as part of this column
+        # for each tray, there are two streams leaving (one liquid, one vapor)
+        # one liquid feed stream (comes from outside the column)
+        # one stream that is a combination of the liquid feed stream and the liquid from the tray above the feed tray
+        
+        # create the streams associated with the column
+        # the initial variables of the tray streams are the rows of one table (liquid, then vapor streams)
+        n_comps = self.feed_stream_liq.n_comps
+        self.stream_table = stream_table(2 * self.n_trays, n_comps)
+        # the trays and their streams are named (and keyed) with zero padded tray numbers, so they sort in
+        # tray order and the variables of every tray are a block of the same size (see profile_views)
+        width = len(str(self.n_trays-1))
+        # tray liquid and vapor streams
+        self.tray_liq_stream = []
+        for i_tray in range(self.n_trays):
+            name = self.name+'Tray'+str(i_tray).zfill(width)+'Liquid'
+#            self.tray_liq_stream.append(Stream(n_comps=N_COMPS, name=name))
+            self.tray_liq_stream.append(Stream(n_comps=n_comps, name=name, xvar=self.stream_table[i_tray]))
+
+        self.tray_vap_stream = []
+        for i_tray in range(self.n_trays):
+            name = self.name+'Tray'+str(i_tray).zfill(width)+'Vapor'
+#            self.tray_vap_stream.append(Stream(n_comps=N_COMPS, name=name))
+            self.tray_vap_stream.append(Stream(n_comps=n_comps, name=name,
+                                              xvar=self.stream_table[self.n_trays+i_tray]))
+
+        # create the mixed stream consisting of the feed stream and the liquid from the tray above the feed tray
+        name = self.name+'MixedLiquidFeed'
+#        self.mixed_liq_feed = Stream(n_comps=N_COMPS, name=name)
+        self.mixed_liq_feed = Stream(n_comps=self.feed_stream_liq.n_comps, name=name)
+        self.unit_dict[name] = self.mixed_liq_feed
+        
+        # create the mixer needed to mix the liquid feed and the liquid from the tray above the feed tray
+        name=self.name+'FeedMixer'
+        self.feed_mixer = Mixer(streams_in=[self.feed_stream_liq, self.tray_liq_stream[feed_tray+1]], 
+                                streams_out=[self.mixed_liq_feed],
+                                name=name)
+        self.unit_dict[name] = self.feed_mixer
+        
+        # create trays
+        self.trays = []
+        for i_tray in range(self.n_trays):
+            name=self.name+'Tray'+str(i_tray).zfill(width)
+            if i_tray == self.feed_tray:
+                self.trays.append(Tray(liq_stream_in=self.mixed_liq_feed, 
+                                       liq_stream_out=self.tray_liq_stream[i_tray],
+                                       vap_stream_in=self.tray_vap_stream[i_tray-1], 
+                                       vap_stream_out=self.tray_vap_stream[i_tray], 
+                                       tray_efficiency=1, # will be updated later
+                                       pressure=self.pressure, 
+                                       components=self.components,
+                                       dynamic=dynamic,
+                                       weir_holdup=weir_holdup,
+                                       weir_coef=weir_coef,
+                                       name=name))
+            elif i_tray == 0:
+                self.trays.append(Tray(liq_stream_in=self.tray_liq_stream[i_tray+1], 
+                                       liq_stream_out=self.tray_liq_stream[i_tray],
+                                       vap_stream_in=self.vapor_reboil, 
+                                       vap_stream_out=self.tray_vap_stream[i_tray], 
+                                       tray_efficiency=1, # will be updated later
+                                       pressure=self.pressure, 
+                                       components=self.components,
+                                       dynamic=dynamic,
+                                       weir_holdup=weir_holdup,
+                                       weir_coef=weir_coef,
+                                       name=name))
+            elif i_tray == self.n_trays-1:
+                self.trays.append(Tray(liq_stream_in=self.reflux, 
+                                       liq_stream_out=self.tray_liq_stream[i_tray],
+                                       vap_stream_in=self.tray_vap_stream[i_tray-1], 
+                                       vap_stream_out=self.tray_vap_stream[i_tray], 
+                                       tray_efficiency=1, # will be updated later
+                                       pressure=self.pressure, 
+                                       components=self.components,
+                                       dynamic=dynamic,
+                                       weir_holdup=weir_holdup,
+                                       weir_coef=weir_coef,
+                                       name=name))
+            else:
+                self.trays.append(Tray(liq_stream_in=self.tray_liq_stream[i_tray+1], 
+                                       liq_stream_out=self.tray_liq_stream[i_tray],
+                                       vap_stream_in=self.tray_vap_stream[i_tray-1], 
+                                       vap_stream_out=self.tray_vap_stream[i_tray], 
+                                       tray_efficiency=1, # will be updated later
+                                       pressure=self.pressure, 
+                                       components=self.components,
+                                       dynamic=dynamic,
+                                       weir_holdup=weir_holdup,
+                                       weir_coef=weir_coef,
+                                       name=name))
+                
+        self.update_tray_efficiency(tray_efficiency)
+                
+        for i_tray in range(self.n_trays):
+            self.unit_dict[self.trays[i_tray].name] = self.trays[i_tray]
+            self.unit_dict[self.tray_liq_stream[i_tray].name] = self.tray_liq_stream[i_tray]
+            self.unit_dict[self.tray_vap_stream[i_tray].name] = self.tray_vap_stream[i_tray]
+        
+        name = self.name+'CondensateConnector'
+        self.condensate_connector = Connector(self.condensate, self.tray_vap_stream[n_trays-1], name=name)
+        self.unit_dict[name] = self.condensate_connector
+            
+        name = self.name+'BottomsConnector'
+        self.bottoms_connector = Connector(self.bottoms, self.tray_liq_stream[0], name=name)
+        self.unit_dict[name] = self.bottoms_connector
+        
+        # offsets of the tray streams in the variables of the column
+        var_offsets = get_var_offsets(self.unit_dict)
+        self.liq_index = np.array([var_offsets[s] for s in self.tray_liq_stream])
+        self.vap_index = np.array([var_offsets[s] for s in self.tray_vap_stream])
+        self.view_key = None
+        self.views = None
+            
+    def __str__(self):
+        s = 'SimpleColumn name: {}\n'.format(self.name)
+        s = s + 'SimpleColumn number: {}\n'.format(self.column_num)
+        s = s + 'Number of trays: {}\n'.format(self.n_trays)
+        s = s + 'Feed tray: {}\n'.format(self.feed_tray)
+        s = s + 'Pressure: {}\n'.format(self.pressure)
+        s = s + 'Liquid feed stream: {}\n'.format(self.feed_stream_liq.name)
+        s = s + 'Reflux stream: {}\n'.format(self.reflux.name)
+        s = s + 'Vapor reboil stream: {}\n'.format(self.vapor_reboil.name)
+        s = s + 'Tray efficiencies: {}\n'.format(self.tray_efficiency)
+        s = s + super().__str__()
+        return s
+        
+    def calculate(self):
+        for u in self.unit_dict:
+            self.unit_dict[u].calculate()
+            
+    def tray_view(self, streams, index):
+        '''
+        return a read-only view of the variables of streams (one per tray), shape (..., n_trays, n_vars of a
+        stream), if they are all views of one array with the offsets index, otherwise None
+        '''
+        first = streams[0].xvar
+        steps = np.diff(index)
+        if not isinstance(first, np.ndarray) or first.base is None or first.strides[-1] != first.itemsize or \
+                (len(steps) > 0 and np.any(steps != steps[0])):
+            return None
+        # every stream must be a view of the same array as the first, at its offset
+        data = first.__array_interface__['data'][0]
+        for s, offset in zip(streams, (index - index[0]) * first.itemsize):
+            x = s.xvar
+            if not isinstance(x, np.ndarray) or x.base is not first.base or x.strides != first.strides or \
+                    x.shape != first.shape or x.__array_interface__['data'][0] != data + offset:
+                return None
+        step = int(steps[0]) * first.itemsize if len(steps) > 0 else 0
+        return np.lib.stride_tricks.as_strided(first, shape=first.shape[:-1] + (self.n_trays, first.shape[-1]),
+                                               strides=first.strides[:-1] + (step, first.itemsize),
+                                               writeable=False)
+    
+    def profile_views(self):
+        '''
+        return a dict of the profiles L, V, T (shape (..., n_trays)), x and y (shape (..., n_trays, n_comps))
+        as read-only views of the variable array the model is mapped to (e.g. the solution of the solver),
+        without copying. the views follow the array: they are only recomputed after a tray stream is mapped
+        to another one. if the tray streams are not views of one array, the profiles are copies.
+        '''
+        # mapping the model binds new view objects to the streams
+        key = [s.xvar for s in self.tray_liq_stream] + [s.xvar for s in self.tray_vap_stream]
+        if self.view_key is None or any(a is not b for a, b in zip(key, self.view_key)):
+            p_liq = self.tray_view(self.tray_liq_stream, self.liq_index)
+            p_vap = self.tray_view(self.tray_vap_stream, self.vap_index)
+            if p_liq is None or p_vap is None:
+                # not a single array: copies of the stream variables
+                p_liq = np.stack([np.asarray(s.xvar) for s in self.tray_liq_stream], axis=-2)
+                p_vap = np.stack([np.asarray(s.xvar) for s in self.tray_vap_stream], axis=-2)
+                key = None
+            self.views = dict(L=p_liq[..., 0], V=p_vap[..., 0], T=p_liq[..., 1], x=p_liq[..., 2:],
+                              y=p_vap[..., 2:])
+            self.view_key = key
+        return self.views
+    
+    def profile_array(self):
+        '''
+        return the profiles as an array, one row per tray, with the columns of profile
+        '''
+        v = self.profile_views()
+        assert v['L'].ndim == 1, '{}: the model is mapped to a batch of variable arrays'.format(self.name)
+        return np.column_stack((np.arange(self.n_trays, dtype=np.float64), v['L'], v['V'], v['T'], v['x'], v['y']))
+    
+    def profile(self):
+        '''
+        return a pandas data frame containing the flow, temperature and composition profiles for each of the trays
+        the row for each tray contains the following columns:
+        0: tray number
+        1: liquid flow from tray
+        2: vapor flow from tray
+        3: tray temperature
+        4:4+n_comps: liquid fractions
+        4+n_comps:4+2*n_comps: vapor fractions
+        '''
+        import pandas as pd
+        n_comps = self.trays[0].liq_stream_out.n_comps
+        cols = ['tray_num','L','V','T']
+        cols = cols + ['{}'.format(a+str(b)) for a,b in zip(n_comps*['x'], range(n_comps))]
+        cols = cols + ['{}'.format(a+str(b)) for a,b in zip(n_comps*['y'], range(n_comps))]
+        return pd.DataFrame(data=self.profile_array(), columns=cols)
+    
+    def holdups(self):
+        '''
+        return the liquid holdup of each tray (dynamic mode only)
+        '''
+        assert self.dynamic, '{}: holdups are only defined in dynamic mode'.format(self.name)
+        return np.array([tray.xvar[0] for tray in self.trays])
+    
+    def update_press(self, pressure):
+        self.pressure = pressure
+        for tray in self.trays:
+            tray.update_pressure(self.pressure)
+        return
+    
+    def update_tray_efficiency(self, tray_efficiency):
+        # make list of tray efficiencies
+        if isinstance(tray_efficiency, dict):
+            self.tray_efficiency = [1.0] * self.n_trays
+            for t, eff in tray_efficiency.items():
+                self.tray_efficiency[t] = eff
+        else: # assume it is a scalar
+            self.tray_efficiency = [tray_efficiency] * self.n_trays
+            
+        for i, tray in enumerate(self.trays):
+            tray.update_tray_efficiency(self.tray_efficiency[i])
+        return
         
\ No newline at end of file
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Store of converged solutions, keyed on the specifications of the model.
+The key of a solution is the vector of all the Specify values, the
+pressure and efficiency of every Tray (so the pressure and tray efficiencies
+of a SimpleColumn) and the flow and temperature differences of every
+Connector. Solutions are grouped by a hash of the structure of the model
+(including how its units are connected), so different models can share one
+store. An exact key returns the stored solution; otherwise the solution with
+the closest key (KD-tree, keys scaled by their magnitude) is returned as the
+initial guess for the solver. The least recently used solutions (over all the
+structures) are evicted beyond max_size, and the store can be saved to and
+loaded from an .npz file.
+"""
+
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+from sim_utils import get_var_offsets, get_eqn_offsets
+from tray import Tray
+from specify import Specify
+from simplecolumn import SimpleColumn
+from connector import Connector
+
+
+def spec_vector(unit_dict):
+    """
+    Get the vector of specifications of the model: the values of the
+    Specify objects, the pressure and efficiency of the Tray objects and
+    the flow and temperature differences of the Connector objects (all the
+    inputs of sim_utils.set_input), in the order of the equations.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+
+    Returns
+    -------
+    key : array
+        specifications of the model.
+
+    """
+    key = []
+    for unit, _ in get_eqn_offsets(unit_dict):
+        if isinstance(unit, Specify):
+            key.append(unit.value)
+        elif isinstance(unit, Tray):
+            key.append(unit.pressure)
+            key.append(unit.tray_efficiency)
+        elif isinstance(unit, Connector):
+            key.append(unit.flow_diff)
+            key.append(unit.temp_diff)
+    return np.array(key, dtype=np.float64)
+
+
+def structure_hash(unit_dict):
+    """
+    Get a hash of the structure of the model: the keys, types and sizes of
+    all the units, nested as in unit_dict, the variables the equations of
+    every unit depend on (the offsets of its var_units), the variable each
+    Specify object specifies and the components of the trays and columns.
+    Unit names are not used, since default names depend on how many units
+    have been created. Models with the same hash have the same variable
+    layout and the same connections.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+
+    Returns
+    -------
+    str
+        hexadecimal digest.
+
+    """
+    var_offsets = get_var_offsets(unit_dict)
+    h = hashlib.sha1()
+
+    def structure_hash_inner(unit_dict, path):
+        for k in sorted(unit_dict.keys()):
+            u = unit_dict[k]
+            h.update('{}/{}:{}:{}:{};'.format(path, k, type(u).__name__, u.n_vars, u.n_eqns).encode())
+            h.update('{};'.format([var_offsets[v] for v in u.var_units()]).encode())
+            if isinstance(u, Specify):
+                h.update('{}:{}:{}:{}:{};'.format(var_offsets.get(u.stream), u.flow, u.temperature,
+                                                  u.fraction, u.comp_num).encode())
+            elif isinstance(u, (Tray, SimpleColumn)):
+                h.update('{};'.format(','.join(u.components.names)).encode())
+            structure_hash_inner(u.unit_dict, path + '/' + k)
+        return
+
+    structure_hash_inner(unit_dict, '')
+    return h.hexdigest()
+
+
+class SolutionStore():
+    '''
+    Solutions of one model structure, in least recently used order, with a KD-tree over the scaled keys.
+    stamps holds the value of the use counter of the cache at the last store or lookup of each solution.
+    '''
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.solutions = OrderedDict()
+        self.stamps = dict()
+        self.tree = None
+        self.tree_keys = None
+
+    def scaled(self, key):
+        return key / self.scale
+
+    def nearest(self, key):
+        '''
+        return the stored key closest to key and its distance (scaled)
+        the tree is rebuilt after solutions have been added or evicted
+        '''
+        if self.tree is None:
+            self.tree_keys = list(self.solutions.keys())
+            self.tree = cKDTree(np.array([self.scaled(self.solutions[k][0]) for k in self.tree_keys]))
+        distance, i = self.tree.query(self.scaled(key))
+        return self.tree_keys[i], distance
+
+
+class SolutionCache():
+    '''
+    Converged solutions keyed on spec_vector, grouped by structure_hash.
+    If path is given and the file exists, the cache is loaded from it.
+    '''
+
+    def __init__(self, path=None, max_size=10000):
+        self.path = path
+        self.max_size = max_size
+        self.stores = dict()
+        # use counter, stamped on every store and lookup of a solution
+        self.clock = 0
+        self.n_hits = 0
+        self.n_near = 0
+        self.n_misses = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return sum(len(s.solutions) for s in self.stores.values())
+
+    def lookup(self, unit_dict):
+        """
+        Look up the solution for the current specifications of the model.
+        Parameters
+        ----------
+        unit_dict : dict
+            dictionary containing all the Unit objects in the model.
+
+        Returns
+        -------
+        x : array or None
+            the stored solution with the closest key (a copy), None if
+            there are no solutions for the structure of the model.
+        exact : bool
+            True if the key of the solution is the same as the
+            specifications of the model.
+
+        """
+        store = self.stores.get(structure_hash(unit_dict))
+        if store is None or len(store.solutions) == 0:
+            self.n_misses += 1
+            return None, False
+        key = spec_vector(unit_dict)
+        k = key.tobytes()
+        exact = k in store.solutions
+        if exact:
+            self.n_hits += 1
+        else:
+            k, _ = store.nearest(key)
+            self.n_near += 1
+        self.touch(store, k)
+        return store.solutions[k][1].copy(), exact
+
+    def initial_guess(self, unit_dict, xvar):
+        '''
+        return the closest stored solution, or xvar if there is none
+        '''
+        x, _ = self.lookup(unit_dict)
+        return xvar if x is None else x
+
+    def store(self, unit_dict, xvar):
+        """
+        Store a converged solution for the current specifications of the
+        model. The least recently used solutions are evicted beyond
+        max_size.
+        Parameters
+        ----------
+        unit_dict : dict
+            dictionary containing all the Unit objects in the model.
+        xvar : array
+            solution of the model.
+
+        Returns
+        -------
+        None.
+
+        """
+        h = structure_hash(unit_dict)
+        key = spec_vector(unit_dict)
+        if h not in self.stores:
+            self.stores[h] = SolutionStore(np.maximum(1, np.abs(key)))
+        store = self.stores[h]
+        store.solutions[key.tobytes()] = (key, np.array(xvar, dtype=np.float64))
+        self.touch(store, key.tobytes())
+        store.tree = None
+        while len(self) > self.max_size:
+            self.evict()
+        return
+
+    def touch(self, store, k):
+        '''
+        mark the solution k of store as the most recently used one
+        '''
+        store.solutions.move_to_end(k)
+        store.stamps[k] = self.clock
+        self.clock += 1
+        return
+
+    def evict(self):
+        '''
+        remove the least recently used solution of all the stores
+        (each store is in least recently used order, so it is the oldest first solution of a store)
+        '''
+        store = min((s for s in self.stores.values() if s.solutions),
+                    key=lambda s: s.stamps[next(iter(s.solutions))])
+        k, _ = store.solutions.popitem(last=False)
+        del store.stamps[k]
+        store.tree = None
+        return
+
+    def save(self, path=None):
+        '''
+        save the cache to an .npz file (path defaults to the path the cache was created with)
+        the file is written to a temporary file first, so an interrupted save leaves the old file
+        '''
+        if path is None:
+            path = self.path
+        if path is None:
+            raise ValueError('no path to save the cache to: give path here or when creating the SolutionCache')
+        arrays = dict()
+        for h, store in self.stores.items():
+            if len(store.solutions) == 0:
+                continue
+            arrays[h + '_scale'] = store.scale
+            arrays[h + '_keys'] = np.array([key for key, _ in store.solutions.values()])
+            arrays[h + '_x'] = np.array([x for _, x in store.solutions.values()])
+            arrays[h + '_stamps'] = np.array([store.stamps[k] for k in store.solutions.keys()])
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        return
+
+    def load(self, path):
+        '''
+        load the solutions saved in an .npz file, in least recently used order
+        '''
+        with np.load(path) as data:
+            for name in data.files:
+                if not name.endswith('_scale'):
+                    continue
+                h = name[:-len('_scale')]
+                store = SolutionStore(data[name])
+                for key, x, stamp in zip(data[h + '_keys'], data[h + '_x'], data[h + '_stamps']):
+                    store.solutions[key.tobytes()] = (key, x)
+                    store.stamps[key.tobytes()] = int(stamp)
+                    self.clock = max(self.clock, int(stamp) + 1)
+                self.stores[h] = store
+        while len(self) > self.max_size:
+            self.evict()
+        return
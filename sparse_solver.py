@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse Jacobian and Newton solver.
+The sparsity pattern of the Jacobian is found from the streams referenced
+by each Unit object. Units that provide Unit.jacobian contribute analytic
+derivatives. The rows of units that do not are found by finite differences,
+perturbing groups of columns that do not share a row (graph coloring), so
+that only a few residual evaluations are needed.
+Stream variables mix flows of order 100, temperatures of order 100 and
+fractions of order 1e-3 to 1, and the equations mix mass balances with
+summations and equilibrium relations of order 1. Scaling holds scale
+factors of the variables and equations (found automatically by
+auto_scaling from the values of the variables and the Jacobian). Scaling
+only conditions the linear solves of the Newton steps of newton_sparse
+(and solve_column): the iterates, the line search and the tolerance stay
+unscaled, and the other solvers do not use it.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from scipy.optimize import OptimizeResult
+from sim_utils import map_var_to_unit1, map_eqn_to_unit1, process_eqns, get_var_offsets, get_eqn_offsets
+from stream import Stream
+
+
+def get_sparsity(unit_dict):
+    """
+    Get the sparsity pattern of the Jacobian of the equations of all the
+    Unit objects in unit_dict. All the equations of a unit are assumed to
+    depend on all the variables of the units returned by Unit.var_units.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+
+    Returns
+    -------
+    pattern : scipy.sparse.csr_matrix
+        boolean matrix, True where an equation depends on a variable.
+
+    """
+    var_offsets = get_var_offsets(unit_dict)
+    rows = []
+    cols = []
+    n_eqns = 0
+    for unit, e_idx in get_eqn_offsets(unit_dict):
+        n_eqns = max(n_eqns, e_idx + unit.n_eqns)
+        for u in unit.var_units():
+            if u in var_offsets:
+                r, c = np.meshgrid(np.arange(e_idx, e_idx+unit.n_eqns),
+                                   np.arange(var_offsets[u], var_offsets[u]+u.n_vars), indexing='ij')
+                rows.append(r.ravel())
+                cols.append(c.ravel())
+    n_vars = sum(u.n_vars for u in var_offsets)
+    if rows:
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+    data = np.ones(len(rows), dtype=bool)
+    pattern = sp.csr_matrix((data, (rows, cols)), shape=(n_eqns, n_vars), dtype=bool)
+    return pattern
+
+
+def color_columns(pattern):
+    """
+    Greedy coloring of the columns of a sparsity pattern. Columns with the
+    same color have no nonzero in a common row, so they can be perturbed
+    together when computing finite differences.
+    Parameters
+    ----------
+    pattern : scipy.sparse matrix
+        sparsity pattern.
+
+    Returns
+    -------
+    colors : array
+        color of each column.
+
+    """
+    pattern = sp.csr_matrix(pattern, dtype=bool)
+    pattern_csc = pattern.tocsc()
+    n_cols = pattern.shape[1]
+    colors = -np.ones(n_cols, dtype=np.int64)
+    for j in range(n_cols):
+        rows = pattern_csc.indices[pattern_csc.indptr[j]:pattern_csc.indptr[j+1]]
+        used = set()
+        for i in rows:
+            used.update(colors[pattern.indices[pattern.indptr[i]:pattern.indptr[i+1]]].tolist())
+        color = 0
+        while color in used:
+            color += 1
+        colors[j] = color
+    return colors
+
+
+class SparseJacobian():
+    '''
+    Sparse Jacobian of the equations of the Unit objects in unit_dict.
+    The structure (offsets, sparsity pattern, coloring) is worked out once, when the object is created.
+    Calling the object with (xvar, unit_dict, eqns) returns a scipy.sparse.csr_matrix, so it can be used
+    in the same way as sim_utils.process_jac.
+    '''
+
+    def __init__(self, unit_dict, fd_step=1e-7):
+        self.unit_dict = unit_dict
+        self.fd_step = fd_step
+        var_offsets = get_var_offsets(unit_dict)
+        self.eqn_offsets = get_eqn_offsets(unit_dict)
+        self.n_vars = sum(u.n_vars for u in var_offsets)
+        self.n_eqns = sum(u.n_eqns for u, _ in self.eqn_offsets)
+        self.pattern = get_sparsity(unit_dict)
+
+        # positions of the analytic blocks, in the order returned by the units
+        # (x values of units outside unit_dict are constants, position None)
+        self.analytic = []
+        fd_rows = []
+        rows = []
+        cols = []
+        for unit, e_idx in self.eqn_offsets:
+            partials = unit.jacobian()
+            if partials is None:
+                fd_rows.append(np.arange(e_idx, e_idx+unit.n_eqns))
+                continue
+            blocks = []
+            for u, d in partials:
+                if u in var_offsets:
+                    r, c = np.meshgrid(np.arange(e_idx, e_idx+unit.n_eqns),
+                                       np.arange(var_offsets[u], var_offsets[u]+u.n_vars), indexing='ij')
+                    rows.append(r.ravel())
+                    cols.append(c.ravel())
+                    blocks.append(True)
+                else:
+                    blocks.append(False)
+            self.analytic.append((unit, blocks))
+        self.rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        self.cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+
+        # finite difference rows and the coloring of the columns they depend on
+        self.fd_rows = np.concatenate(fd_rows) if fd_rows else np.zeros(0, dtype=np.int64)
+        if len(self.fd_rows) > 0:
+            fd_pattern = sp.csr_matrix(self.pattern[self.fd_rows, :])
+            self.colors = color_columns(fd_pattern)
+            fd_coo = fd_pattern.tocoo()
+            self.fd_entry_rows = self.fd_rows[fd_coo.row]
+            self.fd_entry_cols = fd_coo.col
+            self.fd_entry_local = fd_coo.row
+            self.n_colors = self.colors.max() + 1
+        else:
+            self.colors = np.zeros(self.n_vars, dtype=np.int64)
+            self.n_colors = 0
+
+    def __call__(self, xvar, unit_dict=None, eqns=None):
+        if unit_dict is None:
+            unit_dict = self.unit_dict
+        if eqns is None:
+            eqns = np.zeros(self.n_eqns, dtype=np.float64)
+            map_eqn_to_unit1(eqns, unit_dict)
+        xvar = np.asarray(xvar, dtype=np.float64)
+        map_var_to_unit1(xvar, unit_dict)
+        data = []
+        for unit, blocks in self.analytic:
+            for (u, d), in_model in zip(unit.jacobian(), blocks):
+                if in_model:
+                    data.append(np.asarray(d, dtype=np.float64).ravel())
+        rows = [self.rows]
+        cols = [self.cols]
+        if self.n_colors > 0:
+            fd_data = self.finite_differences(xvar, unit_dict, eqns)
+            data.append(fd_data)
+            rows.append(self.fd_entry_rows)
+            cols.append(self.fd_entry_cols)
+        data = np.concatenate(data) if data else np.zeros(0)
+        jac = sp.csr_matrix((data, (np.concatenate(rows), np.concatenate(cols))),
+                            shape=(self.n_eqns, self.n_vars))
+        return jac
+
+    def finite_differences(self, xvar, unit_dict, eqns):
+        '''
+        return the Jacobian entries of the rows without analytic derivatives,
+        in the order of fd_entry_rows, fd_entry_cols
+        '''
+        f0 = np.array(process_eqns(xvar, unit_dict, eqns))[self.fd_rows]
+        h = self.fd_step * np.maximum(1, np.abs(xvar))
+        data = np.zeros(len(self.fd_entry_cols), dtype=np.float64)
+        for color in range(self.n_colors):
+            in_color = self.colors == color
+            x_pert = xvar.copy()
+            x_pert[in_color] += h[in_color]
+            f = np.array(process_eqns(x_pert, unit_dict, eqns))[self.fd_rows]
+            entries = in_color[self.fd_entry_cols]
+            data[entries] = (f[self.fd_entry_local[entries]] - f0[self.fd_entry_local[entries]]) / \
+                h[self.fd_entry_cols[entries]]
+        # leave the model mapped to the unperturbed variables
+        process_eqns(xvar, unit_dict, eqns)
+        return data
+
+
+class Scaling():
+    '''
+    Scale factors of the variables (x = x_scale * y, y the scaled variables) and of the equations (the scaled
+    residuals are f_scale * f).
+    '''
+
+    def __init__(self, x_scale, f_scale):
+        self.x_scale = np.asarray(x_scale, dtype=np.float64)
+        self.f_scale = np.asarray(f_scale, dtype=np.float64)
+
+    def linear_solver(self, linear_solver):
+        '''
+        return linear_solver (J, f) solving the scaled system instead: (f_scale J x_scale) dy = f_scale f,
+        returning dx = x_scale dy, the solution of J dx = f with better conditioning
+        '''
+        def scaled_linear_solver(J, f):
+            if sp.issparse(J):
+                J_scaled = sp.csc_matrix(sp.diags(self.f_scale) @ J @ sp.diags(self.x_scale))
+            else:
+                J_scaled = self.f_scale[:, None] * np.asarray(J) * self.x_scale
+            return self.x_scale * linear_solver(J_scaled, self.f_scale * np.asarray(f))
+        return scaled_linear_solver
+
+
+def nominal_scales(unit_dict, xvar, floor=1e-2):
+    """
+    Scale factors of the variables from their values: flows and
+    temperatures are scaled by their magnitude (at least floor times the
+    largest flow or temperature of the model), fractions by one and the
+    variables of other units by their magnitude (at least one).
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    xvar : array
+        variable array of nominal values.
+    floor : float, optional
+        smallest flow or temperature scale, relative to the largest.
+
+    Returns
+    -------
+    x_scale : array
+        scale factor of each variable.
+
+    """
+    xvar = np.abs(np.asarray(xvar, dtype=np.float64))
+    x_scale = np.maximum(xvar, 1.0)
+    flows = []
+    temps = []
+    for u, v_idx in get_var_offsets(unit_dict).items():
+        if isinstance(u, Stream):
+            flows.append(v_idx)
+            temps.append(v_idx + 1)
+            x_scale[v_idx+2:v_idx+u.n_vars] = 1.0
+    for idx in (np.array(flows, dtype=np.int64), np.array(temps, dtype=np.int64)):
+        if len(idx):
+            x_scale[idx] = np.maximum(xvar[idx], max(floor * xvar[idx].max(), 1e-12))
+    return x_scale
+
+
+def auto_scaling(unit_dict, xvar, eqns, jac=None, floor=1e-2):
+    """
+    Scale factors of the variables (nominal_scales) and of the equations:
+    every row of the Jacobian, with the columns scaled by the variable
+    scales, is scaled to a largest magnitude of one.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    xvar : array
+        variable array of nominal values, e.g. the initial guess.
+    eqns : array
+        equations for all the Unit objects in the model.
+    jac : callable, optional
+        function with the same arguments as process_eqns returning the
+        Jacobian. The default is SparseJacobian(unit_dict).
+    floor : float, optional
+        see nominal_scales.
+
+    Returns
+    -------
+    Scaling
+
+    """
+    if jac is None:
+        jac = SparseJacobian(unit_dict)
+    x_scale = nominal_scales(unit_dict, xvar, floor)
+    J = sp.csr_matrix(jac(np.asarray(xvar, dtype=np.float64), unit_dict, eqns)) @ sp.diags(x_scale)
+    row_max = np.asarray(abs(J).max(axis=1).todense()).ravel()
+    f_scale = 1 / np.where(row_max > 0, row_max, 1.0)
+    return Scaling(x_scale, f_scale)
+
+
+def sparse_lu_solve(J, f):
+    """
+    Solve J dx = f with a sparse LU factorization.
+    """
+    return splu(sp.csc_matrix(J)).solve(f)
+
+
+def newton_sparse(xvar, unit_dict, eqns, fun=None, jac=None, linear_solver=None, tol=1e-10, max_iter=100,
+                  callback=None, scaling=None):
+    """
+    Solve the model equations with a damped Newton method using sparse LU
+    factorizations of the Jacobian. When the Newton step does not reduce
+    the residuals, Levenberg-Marquardt steps (also solved with a sparse LU)
+    are taken instead.
+    Parameters
+    ----------
+    xvar : array
+        initial guess for the variable array.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    eqns : array
+        equations for all the Unit objects in the model.
+    fun : callable, optional
+        function with the same arguments as process_eqns returning the
+        equations, e.g. FlowsheetLayout.residual or a CompiledModel. The
+        default is process_eqns.
+    jac : callable, optional
+        function with the same arguments as process_eqns returning the
+        sparse Jacobian. The default is SparseJacobian(unit_dict).
+    linear_solver : callable, optional
+        function (J, f) returning the solution of J dx = f, used for the
+        Newton steps. The default is sparse_lu_solve.
+    tol : float, optional
+        convergence tolerance on the 2-norm of the residuals.
+    max_iter : int, optional
+        maximum number of iterations.
+    callback : callable, optional
+        called as callback(nit, x, f) at the start of every iteration (and
+        with the final values), e.g. Instrumentation.callback.
+    scaling : Scaling or 'auto', optional
+        scaling of the variables and equations used in the linear solves
+        of the Newton steps ('auto': auto_scaling at xvar), to improve
+        their conditioning. The line search and tol apply to the unscaled
+        residuals.
+
+    Returns
+    -------
+    OptimizeResult
+        with the same fields as returned by scipy.optimize.root:
+        x, success, message, fun, nfev, njev, nit.
+
+    """
+    # the units write their equations into eqns, whatever array they were mapped to before
+    map_eqn_to_unit1(eqns, unit_dict)
+    if jac is None:
+        jac = SparseJacobian(unit_dict)
+    if linear_solver is None:
+        linear_solver = sparse_lu_solve
+    if fun is None:
+        fun = process_eqns
+    if scaling is not None:
+        if isinstance(scaling, str):
+            assert scaling == 'auto', 'Unknown scaling {}'.format(scaling)
+            scaling = auto_scaling(unit_dict, xvar, eqns, jac=jac)
+        linear_solver = scaling.linear_solver(linear_solver)
+    x = np.array(xvar, dtype=np.float64)
+    nfev = 1
+    njev = 0
+    f = np.array(fun(x, unit_dict, eqns))
+    norm_f = np.linalg.norm(f)
+    lam = 1e-3
+    success = False
+    message = 'Maximum number of iterations reached.'
+    for nit in range(max_iter):
+        if callback is not None:
+            callback(nit, x, f)
+        if norm_f < tol:
+            success = True
+            message = 'The 2-norm of the residuals is less than tol.'
+            break
+        J = sp.csc_matrix(jac(x, unit_dict, eqns))
+        njev += 1
+
+        # Newton step, with a backtracking line search
+        x_new = None
+        try:
+            dx = -linear_solver(J, f)
+        except (RuntimeError, np.linalg.LinAlgError):
+            # singular Jacobian
+            dx = None
+        if dx is not None and np.all(np.isfinite(dx)):
+            step = 1.0
+            while step > 1e-3:
+                x_try = x + step * dx
+                f_try = np.array(fun(x_try, unit_dict, eqns))
+                nfev += 1
+                if np.linalg.norm(f_try) < (1 - 1e-4 * step) * norm_f:
+                    x_new, f_new = x_try, f_try
+                    break
+                step /= 4
+
+        # fall back to Levenberg-Marquardt steps, scaled by the diagonal of J'J
+        if x_new is None:
+            JtJ = sp.csc_matrix(J.T @ J)
+            Jtf = J.T @ f
+            D = sp.diags(np.maximum(JtJ.diagonal(), 1e-12))
+            while lam < 1e12:
+                try:
+                    dx = -splu(sp.csc_matrix(JtJ + lam * D)).solve(Jtf)
+                except RuntimeError:
+                    lam *= 10
+                    continue
+                x_try = x + dx
+                f_try = np.array(fun(x_try, unit_dict, eqns))
+                nfev += 1
+                if np.all(np.isfinite(f_try)) and np.linalg.norm(f_try) < norm_f:
+                    x_new, f_new = x_try, f_try
+                    lam = max(lam / 10, 1e-12)
+                    break
+                lam *= 10
+            if x_new is None:
+                message = 'Unable to reduce the residuals.'
+                break
+
+        x, f = x_new, f_new
+        norm_f = np.linalg.norm(f)
+    else:
+        nit = max_iter
+        if callback is not None:
+            callback(nit, x, f)
+        if norm_f < tol:
+            success = True
+            message = 'The 2-norm of the residuals is less than tol.'
+
+    # leave the model mapped to the solution (fun, e.g. a CompiledModel, may not map the units)
+    f = np.array(fun(x, unit_dict, eqns))
+    map_var_to_unit1(x, unit_dict)
+    return OptimizeResult(x=x, success=success, message=message, fun=f,
+                          nfev=nfev, njev=njev, nit=nit)
@@ -1,38 +1,55 @@
-# -*- coding: utf-8 -*-
-"""
-Stream object contains flow rate, temperature and fraction of each component.
-"""
-
-from unit import Unit
-import numpy as np
-
-class Stream(Unit):
-    
-    n_streams = 0
-    
-    def __init__(self, n_comps=1, name=None):
-        self.stream_num = Stream.n_streams
-        super().__init__(name, self.stream_num)
-        Stream.n_streams += 1
-        # the stream member x_var will be as follows:
-        # [0] flow rate
-        # [1] temperature
-        # [2:] fraction of each component. if flow is in mass units, these are mass fractions
-        self.n_comps = n_comps
-        self.n_vars = 2 + n_comps
-        self.n_eqns = 0
-        self.xvar = np.zeros(self.n_vars, dtype=np.float64)
-        self.xvar[0] = 100
-        self.xvar[1] = 100
-        for i in range(self.n_comps):
-            self.xvar[2+i] = 1 / self.n_comps
-        self.eqns = None
-        
-    def __str__(self):
-        s = 'Stream name: {}\n'.format(self.name)
-        s = s + 'Stream number: {}\n'.format(self.stream_num)
-        s = s + super().__str__()
-        return s
-    
-    def calculate(self):
+# -*- coding: utf-8 -*-
+"""
+Stream object contains flow rate, temperature and fraction of each component.
+"""
+
+from unit import Unit
+from flowsheet import current_flowsheet
+import numpy as np
+
+def stream_table(n_streams, n_comps):
+    '''
+    return the default variables of n_streams streams as an array of shape (n_streams, 2+n_comps),
+    one row per stream: flow rate and temperature of 100 and equal fractions
+    '''
+    table = np.empty((n_streams, 2 + n_comps), dtype=np.float64)
+    table[:, :2] = 100
+    table[:, 2:] = 1 / n_comps
+    return table
+
+
+class Stream(Unit):
+    
+    # no __dict__: large flowsheets have many streams
+    __slots__ = ('stream_num', 'n_comps', 'n_vars', 'n_eqns')
+    
+    def __init__(self, n_comps=1, name=None, xvar=None):
+        '''
+        xvar is the array of the initial variables of the stream, e.g. a row of a stream_table shared by
+        many streams. the default is an array of its own with the defaults of stream_table.
+        '''
+        self.stream_num = current_flowsheet().number(Stream)
+        super().__init__(name, self.stream_num, leaf=True)
+        # the stream member x_var will be as follows:
+        # [0] flow rate
+        # [1] temperature
+        # [2:] fraction of each component. if flow is in mass units, these are mass fractions
+        self.n_comps = n_comps
+        self.n_vars = 2 + n_comps
+        self.n_eqns = 0
+        if xvar is None:
+            xvar = np.empty(self.n_vars, dtype=np.float64)
+            xvar[:2] = 100
+            xvar[2:] = 1 / n_comps
+        assert xvar.shape == (self.n_vars,), \
+            '{}: {} variables instead of {}'.format(self.name, xvar.shape, self.n_vars)
+        self.xvar = xvar
+        
+    def __str__(self):
+        s = 'Stream name: {}\n'.format(self.name)
+        s = s + 'Stream number: {}\n'.format(self.stream_num)
+        s = s + super().__str__()
+        return s
+    
+    def calculate(self):
         pass
\ No newline at end of file
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+Structural analysis of the equations of a model.
+The incidence matrix (which variables appear in which equations) is built
+from the analytic partial derivatives of the units, evaluated at a slightly
+perturbed point so that no derivative is zero by accident, and from the
+sparsity pattern of sparse_solver for units without analytic derivatives.
+A maximum matching of equations and variables gives the structural rank,
+and the Dulmage-Mendelsohn decomposition the over-determined part (more
+equations than variables: over-specified units) and the under-determined
+part (unspecified variables). A square, structurally nonsingular system is
+permuted to block triangular form (strongly connected components of the
+matched graph, Tarjan), so its irreducible blocks can be solved in
+sequence, e.g. the feed specifications before the column.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import maximum_bipartite_matching, connected_components
+from scipy.sparse.linalg import splu
+from scipy.optimize import OptimizeResult
+from sim_utils import map_var_to_unit1, map_eqn_to_unit1, process_eqns, get_unit_vars, get_var_offsets, get_eqn_offsets
+from sparse_solver import get_sparsity, newton_sparse
+
+
+def incidence(unit_dict, seed=0):
+    """
+    Incidence matrix of the equations of the model.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    seed : int, optional
+        seed of the random perturbation of the variables.
+
+    Returns
+    -------
+    pattern : scipy.sparse.csr_matrix
+        boolean matrix, True where an equation depends on a variable.
+
+    """
+    var_offsets = get_var_offsets(unit_dict)
+    # the variables of the units are restored afterwards, so that any binding of the units is kept
+    bound = [(u, u.xvar) for u in var_offsets]
+    x = get_unit_vars(unit_dict)
+    rng = np.random.default_rng(seed)
+    map_var_to_unit1(x * (1 + 0.01 * rng.random(len(x))) + 0.01 * rng.random(len(x)), unit_dict)
+    coarse = get_sparsity(unit_dict)
+    rows = []
+    cols = []
+    try:
+        for unit, e_idx in get_eqn_offsets(unit_dict):
+            partials = unit.jacobian()
+            if partials is None:
+                r, c = coarse[e_idx:e_idx+unit.n_eqns].nonzero()
+                rows.append(r + e_idx)
+                cols.append(c)
+                continue
+            for u, d in partials:
+                if u in var_offsets:
+                    r, c = np.nonzero(np.asarray(d))
+                    rows.append(r + e_idx)
+                    cols.append(c + var_offsets[u])
+    finally:
+        for u, xvar in bound:
+            u.xvar = xvar
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    return sp.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=coarse.shape, dtype=bool)
+
+
+def equation_units(unit_dict):
+    '''
+    return the names of the units of every equation and of every variable, in the order of the arrays
+    '''
+    eqn_names = []
+    for unit, _ in get_eqn_offsets(unit_dict):
+        eqn_names += [unit.name] * unit.n_eqns
+    var_names = []
+    for unit in get_var_offsets(unit_dict):
+        var_names += [unit.name] * unit.n_vars
+    return np.array(eqn_names, dtype=object), np.array(var_names, dtype=object)
+
+
+def match(pattern):
+    '''
+    return the maximum matching of a pattern: the column of every row and the row of every column (-1 if
+    unmatched)
+    '''
+    pattern = sp.csr_matrix(pattern, dtype=bool)
+    row_match = maximum_bipartite_matching(pattern, perm_type='column')
+    col_match = -np.ones(pattern.shape[1], dtype=np.int64)
+    col_match[row_match[row_match >= 0]] = np.flatnonzero(row_match >= 0)
+    return row_match, col_match
+
+
+def alternating_reach(start, pattern, match_of):
+    '''
+    return the nodes reachable from start along alternating paths: from a node to its neighbours in
+    pattern (a csr matrix, one row per node), then along the matching (match_of) back to nodes
+    '''
+    seen = np.zeros(pattern.shape[0], dtype=bool)
+    seen[start] = True
+    stack = list(start)
+    while stack:
+        i = stack.pop()
+        for j in pattern.indices[pattern.indptr[i]:pattern.indptr[i+1]]:
+            k = match_of[j]
+            if k >= 0 and not seen[k]:
+                seen[k] = True
+                stack.append(k)
+    return np.flatnonzero(seen)
+
+
+def degrees_of_freedom(unit_dict):
+    """
+    Degrees of freedom and structural rank of the model, with the units in
+    the over- and under-determined parts of the Dulmage-Mendelsohn
+    decomposition.
+    Parameters
+    ----------
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+
+    Returns
+    -------
+    report : dict
+        n_eqns, n_vars, dof (n_vars - n_eqns), structural_rank,
+        over_specified (unit name: number of equations in the
+        over-determined part), under_specified (unit name: number of
+        variables in the under-determined part), and unmatched_eqns and
+        unmatched_vars (unit name: number of equations or variables left
+        out of a maximum matching, i.e. the surplus equations and the
+        variables that need a specification, where the matching puts them).
+
+    """
+    pattern = incidence(unit_dict)
+    n_eqns, n_vars = pattern.shape
+    row_match, col_match = match(pattern)
+    eqn_names, var_names = equation_units(unit_dict)
+
+    # over-determined: equations reachable from the unmatched equations
+    over_rows = alternating_reach(np.flatnonzero(row_match < 0), pattern, col_match)
+    # under-determined: variables reachable from the unmatched variables
+    under_cols = alternating_reach(np.flatnonzero(col_match < 0), sp.csr_matrix(pattern.T), row_match)
+
+    def count(names):
+        counts = dict()
+        for name in names:
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    return dict(n_eqns=n_eqns, n_vars=n_vars, dof=n_vars - n_eqns,
+                structural_rank=int(np.sum(row_match >= 0)),
+                over_specified=count(eqn_names[over_rows]),
+                under_specified=count(var_names[under_cols]),
+                unmatched_eqns=count(eqn_names[row_match < 0]),
+                unmatched_vars=count(var_names[col_match < 0]))
+
+
+def format_dof(report):
+    '''
+    return the report of degrees_of_freedom as text
+    '''
+    s = '{} equations, {} variables, {} degrees of freedom, structural rank {}\n'.format(
+        report['n_eqns'], report['n_vars'], report['dof'], report['structural_rank'])
+    if report['over_specified']:
+        s += 'over-specified (equations in the over-determined part):\n'
+        for name, n in report['over_specified'].items():
+            s += '    {}: {}\n'.format(name, n)
+    if report['unmatched_eqns']:
+        s += 'surplus equations: ' + ', '.join('{} ({})'.format(name, n)
+                                               for name, n in report['unmatched_eqns'].items()) + '\n'
+    if report['under_specified']:
+        s += 'under-specified (variables in the under-determined part):\n'
+        for name, n in report['under_specified'].items():
+            s += '    {}: {}\n'.format(name, n)
+    if report['unmatched_vars']:
+        s += 'unspecified variables: ' + ', '.join('{} ({})'.format(name, n)
+                                                   for name, n in report['unmatched_vars'].items()) + '\n'
+    if not report['over_specified'] and not report['under_specified']:
+        s += 'the model is square and structurally nonsingular\n'
+    return s
+
+
+def block_triangular(pattern):
+    """
+    Block triangular decomposition of a square, structurally nonsingular
+    incidence matrix.
+    Parameters
+    ----------
+    pattern : scipy.sparse matrix
+        incidence matrix.
+
+    Returns
+    -------
+    blocks : list of (rows, cols)
+        equations and variables of the irreducible blocks, in the order in
+        which they can be solved: the equations of a block only depend on
+        its own variables and on the variables of earlier blocks.
+
+    """
+    pattern = sp.csr_matrix(pattern, dtype=bool)
+    n = pattern.shape[0]
+    assert pattern.shape[1] == n, 'the incidence matrix is not square'
+    row_match, col_match = match(pattern)
+    assert np.all(row_match >= 0), 'the incidence matrix is structurally singular'
+    # graph on the equations: i -> k if equation k uses the variable matched to equation i
+    coo = pattern.tocoo()
+    src = col_match[coo.col]
+    keep = src != coo.row
+    graph = sp.csr_matrix((np.ones(np.sum(keep), dtype=bool), (src[keep], coo.row[keep])), shape=(n, n))
+    n_blocks, labels = connected_components(graph, directed=True, connection='strong')
+
+    # topological order of the blocks (Kahn)
+    edges = sp.csr_matrix((np.ones(np.sum(keep), dtype=np.int64), (labels[src[keep]], labels[coo.row[keep]])),
+                          shape=(n_blocks, n_blocks))
+    edges.setdiag(0)
+    edges.eliminate_zeros()
+    edges = sp.csr_matrix(edges > 0)
+    in_degree = np.asarray(edges.sum(axis=0)).ravel()
+    order = []
+    ready = list(np.flatnonzero(in_degree == 0))
+    while ready:
+        b = ready.pop()
+        order.append(b)
+        for c in edges.indices[edges.indptr[b]:edges.indptr[b+1]]:
+            in_degree[c] -= 1
+            if in_degree[c] == 0:
+                ready.append(c)
+    members = [[] for _ in range(n_blocks)]
+    for i in range(n):
+        members[labels[i]].append(i)
+    blocks = []
+    for b in order:
+        rows = np.array(members[b], dtype=np.int64)
+        blocks.append((rows, row_match[rows]))
+    return blocks
+
+
+class BlockSolver():
+    '''
+    Block decomposed solver of the model in unit_dict: the irreducible blocks of block_triangular are
+    solved in sequence, each with a damped Newton method on its own equations and variables, evaluating
+    only the units that hold the equations of the block. Units without analytic derivatives are
+    differentiated by forward differences with step fd_step (relative).
+    '''
+
+    def __init__(self, unit_dict, fd_step=1e-7):
+        self.unit_dict = unit_dict
+        self.fd_step = fd_step
+        self.var_offsets = get_var_offsets(unit_dict)
+        self.eqn_offsets = [(u, idx) for u, idx in get_eqn_offsets(unit_dict) if u.n_eqns > 0]
+        self.n_vars = sum(u.n_vars for u in self.var_offsets)
+        self.n_eqns = sum(u.n_eqns for u, _ in self.eqn_offsets)
+        self.pattern = incidence(unit_dict)
+        self.blocks = block_triangular(self.pattern)
+        unit_of_row = np.repeat(np.arange(len(self.eqn_offsets)), [u.n_eqns for u, _ in self.eqn_offsets])
+        # units holding the equations of each block
+        self.block_units = [[self.eqn_offsets[i] for i in np.unique(unit_of_row[rows])] for rows, _ in self.blocks]
+
+    def block_sizes(self):
+        '''
+        return the number of equations of each block, in the order of the solve
+        '''
+        return [len(rows) for rows, _ in self.blocks]
+
+    def residual(self, units, eqns, rows):
+        for unit, _ in units:
+            unit.calculate()
+        return eqns[rows].copy()
+
+    def jacobian(self, units, x, eqns, rows, cols):
+        '''
+        return the Jacobian of the equations rows with respect to the variables cols, as a csc matrix
+        '''
+        row_pos = -np.ones(self.n_eqns, dtype=np.int64)
+        row_pos[rows] = np.arange(len(rows))
+        col_pos = -np.ones(self.n_vars, dtype=np.int64)
+        col_pos[cols] = np.arange(len(cols))
+        J_rows = []
+        J_cols = []
+        J_data = []
+        for unit, e_idx in units:
+            r_pos = row_pos[e_idx:e_idx+unit.n_eqns]
+            r_in = r_pos >= 0
+            partials = unit.jacobian()
+            if partials is None:
+                # forward differences on the variables of the block in the rows of the unit
+                f0 = eqns[e_idx:e_idx+unit.n_eqns].copy()
+                for j in np.unique(self.pattern[e_idx:e_idx+unit.n_eqns].indices):
+                    if col_pos[j] < 0:
+                        continue
+                    xj = x[j]
+                    h = self.fd_step * max(1.0, abs(xj))
+                    x[j] = xj + h
+                    unit.calculate()
+                    d = (eqns[e_idx:e_idx+unit.n_eqns] - f0) / h
+                    x[j] = xj
+                    J_rows.append(r_pos[r_in])
+                    J_cols.append(np.full(np.sum(r_in), col_pos[j]))
+                    J_data.append(d[r_in])
+                unit.calculate()
+                continue
+            for u, d in partials:
+                if u not in self.var_offsets:
+                    continue
+                c_pos = col_pos[self.var_offsets[u]:self.var_offsets[u]+u.n_vars]
+                c_in = c_pos >= 0
+                if not np.any(c_in):
+                    continue
+                r, c = np.meshgrid(r_pos[r_in], c_pos[c_in], indexing='ij')
+                J_rows.append(r.ravel())
+                J_cols.append(c.ravel())
+                J_data.append(np.asarray(d)[np.ix_(r_in, c_in)].ravel())
+        return sp.csc_matrix((np.concatenate(J_data), (np.concatenate(J_rows), np.concatenate(J_cols))),
+                             shape=(len(rows), len(cols)))
+
+    def solve(self, xvar, eqns, tol=1e-10, max_iter=50, **kwargs):
+        """
+        Solve the model block by block. If a block does not converge, the
+        whole system is solved with sparse_solver.newton_sparse from the
+        current point.
+        Parameters
+        ----------
+        xvar : array
+            initial guess for the variable array.
+        eqns : array
+            equations for all the Unit objects in the model.
+        tol : float, optional
+            convergence tolerance on the 2-norm of the residuals of each
+            block and of the whole system.
+        max_iter : int, optional
+            maximum number of iterations for each block.
+        **kwargs
+            other arguments of newton_sparse, for the whole system.
+
+        Returns
+        -------
+        OptimizeResult
+            x, success, message, fun, nfev, njev, nit (total iterations)
+            and block_sizes.
+
+        """
+        unit_dict = self.unit_dict
+        x = np.array(xvar, dtype=np.float64)
+        map_var_to_unit1(x, unit_dict)
+        map_eqn_to_unit1(eqns, unit_dict)
+        nfev = 0
+        njev = 0
+        nit = 0
+        converged = True
+        for (rows, cols), units in zip(self.blocks, self.block_units):
+            f = self.residual(units, eqns, rows)
+            nfev += 1
+            norm_f = np.linalg.norm(f)
+            for _ in range(max_iter):
+                if norm_f < tol:
+                    break
+                J = self.jacobian(units, x, eqns, rows, cols)
+                njev += 1
+                nit += 1
+                try:
+                    dx = -splu(J).solve(f) if len(rows) > 1 else -f / J[0, 0]
+                except (RuntimeError, ZeroDivisionError):
+                    break
+                if not np.all(np.isfinite(dx)):
+                    break
+                # backtracking line search on the residuals of the block
+                x_old = x[cols].copy()
+                step = 1.0
+                while step > 1e-3:
+                    x[cols] = x_old + step * dx
+                    f_try = self.residual(units, eqns, rows)
+                    nfev += 1
+                    if np.linalg.norm(f_try) < (1 - 1e-4 * step) * norm_f:
+                        break
+                    step /= 4
+                else:
+                    x[cols] = x_old
+                    self.residual(units, eqns, rows)
+                    break
+                f, norm_f = f_try, np.linalg.norm(f_try)
+            if norm_f >= tol:
+                converged = False
+                break
+
+        f = np.array(process_eqns(x, unit_dict, eqns))
+        nfev += 1
+        if converged and np.linalg.norm(f) < tol:
+            return OptimizeResult(x=x, success=True, message='All the blocks converged.', fun=f, nfev=nfev,
+                                  njev=njev, nit=nit, block_sizes=self.block_sizes())
+        # fall back to the whole system
+        res = newton_sparse(x, unit_dict, eqns, tol=tol, **kwargs)
+        res.nfev += nfev
+        res.njev += njev
+        res.nit += nit
+        res.block_sizes = self.block_sizes()
+        return res
+
+
+def solve_blocks(xvar, unit_dict, eqns, tol=1e-10, max_iter=50, **kwargs):
+    """
+    Solve the model block by block, in the order of block_triangular (see
+    BlockSolver). The arguments are those of sparse_solver.newton_sparse.
+    Parameters
+    ----------
+    xvar : array
+        initial guess for the variable array.
+    unit_dict : dict
+        dictionary containing all the Unit objects in the model.
+    eqns : array
+        equations for all the Unit objects in the model.
+    tol : float, optional
+        convergence tolerance on the 2-norm of the residuals.
+    max_iter : int, optional
+        maximum number of iterations for each block.
+    **kwargs
+        other arguments of newton_sparse, used if a block does not converge.
+
+    Returns
+    -------
+    OptimizeResult
+        x, success, message, fun, nfev, njev, nit and block_sizes.
+
+    """
+    return BlockSolver(unit_dict).solve(xvar, eqns, tol=tol, max_iter=max_iter, **kwargs)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Surrogate model of the column profiles of a model, as a function of some of
+its inputs (specified values, column pressure, tray efficiency). The
+training data are generated with sweep.sweep over a Latin hypercube sample
+of the inputs, within given bounds. The surrogate is a NumPy regression of
+the whole variable array on the inputs (cubic radial basis functions with a
+linear tail, or a polynomial), so a query costs a few small matrix products.
+Queries inside the trust region (close to the training points) are answered
+by the surrogate; queries outside it are solved rigorously, starting from
+the prediction of the surrogate.
+"""
+
+import itertools
+import numpy as np
+from scipy.spatial import cKDTree
+from sim_utils import get_var_offsets
+from sparse_solver import newton_sparse
+from sweep import SweepWorker, sweep
+
+
+def latin_hypercube(bounds, n, seed=None):
+    """
+    Latin hypercube sample within bounds.
+    Parameters
+    ----------
+    bounds : array
+        lower and upper bound of each input, shape (n_inputs, 2).
+    n : int
+        number of points.
+    seed : int, optional
+        seed of the random number generator.
+
+    Returns
+    -------
+    values : array
+        one row per point, one column per input.
+
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    n_inputs = len(bounds)
+    u = (np.argsort(rng.random((n, n_inputs)), axis=0) + rng.random((n, n_inputs))) / n
+    return bounds[:, 0] + u * (bounds[:, 1] - bounds[:, 0])
+
+
+class RBFModel():
+    '''
+    Cubic radial basis function model with a linear polynomial tail, for inputs scaled to [-1, 1].
+    smoothing > 0 gives a regression instead of an interpolation of the training data.
+    '''
+
+    def __init__(self, smoothing=0.0):
+        self.smoothing = smoothing
+        self.centers = None
+        self.weights = None
+
+    @staticmethod
+    def basis(X, centers):
+        r = np.sqrt(np.maximum(0, (X**2).sum(axis=1)[:, None] - 2 * X @ centers.T + (centers**2).sum(axis=1)))
+        return np.hstack((r**3, np.ones((len(X), 1)), X))
+
+    def fit(self, X, Y):
+        n, n_inputs = X.shape
+        P = np.hstack((np.ones((n, 1)), X))
+        A = np.zeros((n + n_inputs + 1, n + n_inputs + 1))
+        A[:n, :] = self.basis(X, X)
+        A[:n, :n] += self.smoothing * np.eye(n)
+        A[n:, :n] = P.T
+        rhs = np.vstack((Y, np.zeros((n_inputs + 1, Y.shape[1]))))
+        self.weights = np.linalg.lstsq(A, rhs, rcond=None)[0]
+        self.centers = X.copy()
+        return self
+
+    def predict(self, X):
+        return self.basis(X, self.centers) @ self.weights
+
+
+class PolynomialModel():
+    '''
+    Polynomial model of a given total degree, for inputs scaled to [-1, 1], fitted by (ridge) least squares.
+    '''
+
+    def __init__(self, degree=2, ridge=1e-10):
+        self.degree = degree
+        self.ridge = ridge
+        self.powers = None
+        self.weights = None
+
+    def basis(self, X):
+        return np.prod(X[:, None, :]**self.powers[None, :, :], axis=2)
+
+    def fit(self, X, Y):
+        n_inputs = X.shape[1]
+        self.powers = np.array([p for p in itertools.product(range(self.degree + 1), repeat=n_inputs)
+                                if sum(p) <= self.degree])
+        B = self.basis(X)
+        self.weights = np.linalg.solve(B.T @ B + self.ridge * np.eye(B.shape[1]), B.T @ Y)
+        return self
+
+    def predict(self, X):
+        return self.basis(X) @ self.weights
+
+
+class ColumnSurrogate():
+    '''
+    Surrogate of the profile of the SimpleColumn column of the model built by model_factory, as a
+    function of inputs (names as used by sim_utils.set_input) within bounds (shape (n_inputs, 2)).
+    kind is 'rbf' (RBFModel) or 'poly' (PolynomialModel); model_args are passed to the regression model.
+    The model built in this process is used for the rigorous solves of the queries outside the trust region.
+    '''
+
+    def __init__(self, model_factory, inputs, bounds, column='column', kind='rbf', solver=newton_sparse,
+                 **model_args):
+        assert kind in ('rbf', 'poly'), 'Unknown kind of surrogate {}'.format(kind)
+        self.model_factory = model_factory
+        self.inputs = list(inputs)
+        self.bounds = np.asarray(bounds, dtype=np.float64).reshape(len(self.inputs), 2)
+        self.column = column
+        self.solver = solver
+        self.kind = kind
+        self.model_args = model_args
+        self.model = None
+        self.tree = None
+        self.trust_radius = None
+        self.y_mean = None
+        self.y_scale = None
+        # rigorous model, also gives the positions of the tray variables in the variable array
+        self.worker = SweepWorker(model_factory, column, solver)
+        self.profile_index = self.get_profile_index()
+        self.n_surrogate = 0
+        self.n_rigorous = 0
+
+    def get_profile_index(self):
+        '''
+        return the index in the variable array of the entries of the profile (see SimpleColumn.profile),
+        except the tray numbers, shape (n_trays, n_cols - 1)
+        '''
+        var_offsets = get_var_offsets(self.worker.unit_dict)
+        index = []
+        for tray in self.worker.column.trays:
+            liq = var_offsets[tray.liq_stream_out]
+            vap = var_offsets[tray.vap_stream_out]
+            n_comps = tray.liq_stream_out.n_comps
+            index.append([liq, vap, liq + 1] + list(range(liq + 2, liq + 2 + n_comps))
+                         + list(range(vap + 2, vap + 2 + n_comps)))
+        return np.array(index)
+
+    def scaled(self, values):
+        '''
+        return the inputs scaled to [-1, 1] within the bounds
+        '''
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.inputs))
+        return 2 * (values - self.bounds[:, 0]) / (self.bounds[:, 1] - self.bounds[:, 0]) - 1
+
+    def profiles(self, X):
+        '''
+        return the profiles (shape (n, n_trays, n_cols)) of the variable arrays X (shape (n, n_vars))
+        '''
+        n_trays = len(self.profile_index)
+        tray_num = np.broadcast_to(np.arange(n_trays, dtype=np.float64)[:, None], (len(X), n_trays, 1))
+        return np.concatenate((tray_num, X[:, self.profile_index]), axis=2)
+
+    def generate(self, n_train, seed=None, max_workers=None):
+        """
+        Generate training data: solve the model for a Latin hypercube sample
+        of the inputs, with sweep.sweep.
+        Parameters
+        ----------
+        n_train : int
+            number of cases.
+        seed : int, optional
+            seed of the random number generator.
+        max_workers : int, optional
+            number of worker processes (see sweep.sweep).
+
+        Returns
+        -------
+        values : array
+            inputs of the converged cases, shape (n, n_inputs).
+        X : array
+            solutions of the converged cases, shape (n, n_vars).
+
+        """
+        values = latin_hypercube(self.bounds, n_train, seed)
+        # sorted along the first input, so that every solve starts from a neighbouring case
+        values = values[np.lexsort(values.T[::-1])]
+        result = sweep(self.model_factory, self.inputs, values, column=self.column, solver=self.solver,
+                       max_workers=max_workers, solutions=True)
+        ok = result['success']
+        return result['values'][ok], result['x'][ok]
+
+    def fit(self, values, X, trust_radius=None):
+        """
+        Fit the surrogate to solutions of the model.
+        Parameters
+        ----------
+        values : array
+            inputs, shape (n, n_inputs).
+        X : array
+            solutions, shape (n, n_vars).
+        trust_radius : float, optional
+            largest distance (of the scaled inputs) of a query from the
+            closest training point for the surrogate to answer it. The
+            default is the largest distance of a training point from its
+            closest neighbour.
+
+        Returns
+        -------
+        self
+
+        """
+        S = self.scaled(values)
+        X = np.asarray(X, dtype=np.float64)
+        self.y_mean = X.mean(axis=0)
+        self.y_scale = np.maximum(X.std(axis=0), 1e-12)
+        model = RBFModel if self.kind == 'rbf' else PolynomialModel
+        self.model = model(**self.model_args).fit(S, (X - self.y_mean) / self.y_scale)
+        self.tree = cKDTree(S)
+        if trust_radius is None:
+            trust_radius = self.tree.query(S, k=2)[0][:, 1].max() if len(S) > 1 else 0.0
+        self.trust_radius = trust_radius
+        return self
+
+    def predict_x(self, values):
+        '''
+        return the variable arrays predicted for the inputs values (shape (n, n_inputs))
+        '''
+        return self.model.predict(self.scaled(values)) * self.y_scale + self.y_mean
+
+    def predict(self, values):
+        '''
+        return the profiles predicted for the inputs values, shape (n, n_trays, n_cols)
+        '''
+        return self.profiles(self.predict_x(values))
+
+    def in_trust_region(self, values):
+        '''
+        return True for the inputs within the bounds and within trust_radius of a training point
+        '''
+        S = self.scaled(values)
+        distance = self.tree.query(S)[0]
+        return np.all(np.abs(S) <= 1, axis=1) & (distance <= self.trust_radius)
+
+    def validate(self, values, X):
+        """
+        Errors of the surrogate against solutions of the model that were not
+        used to fit it.
+        Parameters
+        ----------
+        values : array
+            inputs, shape (n, n_inputs).
+        X : array
+            solutions, shape (n, n_vars).
+
+        Returns
+        -------
+        errors : dict
+            maximum and root mean square absolute errors of the flows
+            ('flow_max', 'flow_rms'), tray temperatures ('T_max', 'T_rms')
+            and fractions ('fraction_max', 'fraction_rms').
+
+        """
+        err = self.predict(values) - self.profiles(np.asarray(X, dtype=np.float64))
+        errors = dict()
+        for name, cols in (('flow', slice(1, 3)), ('T', slice(3, 4)), ('fraction', slice(4, None))):
+            e = err[:, :, cols]
+            errors[name + '_max'] = np.abs(e).max()
+            errors[name + '_rms'] = np.sqrt(np.mean(e**2))
+        return errors
+
+    def query(self, values):
+        """
+        Profile of the column for one set of input values: predicted by the
+        surrogate inside the trust region, solved rigorously (starting from
+        the prediction) outside it.
+        Parameters
+        ----------
+        values : array
+            values of the inputs, shape (n_inputs,).
+
+        Returns
+        -------
+        profile : array
+            profile, columns as in SimpleColumn.profile.
+        rigorous : bool
+            True if the profile comes from a converged rigorous solve.
+
+        """
+        x = self.predict_x(values)
+        if self.in_trust_region(values)[0]:
+            self.n_surrogate += 1
+            return self.profiles(x)[0], False
+        self.n_rigorous += 1
+        self.worker.x_last = x[0]
+        profile, x, success, _, _, _ = self.worker.solve(self.inputs, np.ravel(values))
+        if not success:
+            # the prediction is the best available answer
+            return self.profiles(self.worker.x_last[None, :])[0], False
+        return profile, True
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps, solved in parallel on all the cores of the machine.
+Every worker process builds its own copy of the model once, with the model
+factory, and reuses it for all the cases it is given. The cases are handed
+out in contiguous chunks, so each solve starts from the solution of a
+neighbouring case.
+"""
+
+import os
+import time
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from sim_utils import map_var_to_unit1, map_eqn_to_unit1, get_unit_vars, set_input
+from compiled import CompiledModel
+from sparse_solver import SparseJacobian, newton_sparse
+from initialize import initialize
+
+
+# model of the worker process, built by init_worker
+worker = None
+# largest default chunksize with a sink, which bounds the results held in memory
+SINK_CHUNKSIZE = 16
+
+
+class SweepWorker():
+    '''
+    Model built by model_factory, solved for one set of input values at a time.
+    The last converged solution is the initial guess for the next case, with the shortcut estimate
+    of initialize.initialize for the current inputs as the fallback.
+    '''
+
+    def __init__(self, model_factory, column, solver):
+        self.unit_dict = model_factory()
+        self.column = self.unit_dict[column]
+        self.solver = solver
+        self.x_init = get_unit_vars(self.unit_dict)
+        self.eqns = np.zeros(len(self.x_init), dtype=np.float64)
+        map_var_to_unit1(self.x_init.copy(), self.unit_dict)
+        map_eqn_to_unit1(self.eqns, self.unit_dict)
+        self.fun = CompiledModel(self.unit_dict)
+        # sparsity pattern and coloring, built once for all the cases
+        self.jac = SparseJacobian(self.unit_dict)
+        self.x_last = None
+
+    def solve(self, inputs, values):
+        '''
+        set the inputs to values, solve the model and return
+        (profile, solution, success, nit, 2-norm of the residuals, solution time)
+        '''
+        start = time.perf_counter()
+        for name, value in zip(inputs, values):
+            set_input(self.unit_dict, name, value)
+        # from the last converged solution, then from the shortcut estimate
+        guesses = [] if self.x_last is None else [self.x_last]
+        guesses.append(None)
+        for x in guesses:
+            if x is None:
+                x = initialize(self.unit_dict)
+            res = self.solver(x.copy(), self.unit_dict, self.eqns, fun=self.fun, jac=self.jac)
+            if res.success:
+                self.x_last = res.x
+                break
+        # the units are mapped to a copy: initialize writes through them, and res.x is returned
+        map_var_to_unit1(res.x.copy(), self.unit_dict)
+        profile = self.column.profile_array()
+        return profile, res.x, res.success, res.nit, np.linalg.norm(res.fun), time.perf_counter() - start
+
+
+def init_worker(model_factory, column, solver):
+    '''
+    build the model of the worker process
+    '''
+    global worker
+    worker = SweepWorker(model_factory, column, solver)
+    return
+
+
+def solve_case(inputs, values):
+    '''
+    solve one case with the model of the worker process
+    '''
+    return worker.solve(inputs, values)
+
+
+def make_grid(*axes):
+    """
+    All the combinations of the values of each input.
+    Parameters
+    ----------
+    *axes : arrays
+        values of each input.
+
+    Returns
+    -------
+    values : array
+        one row per combination, one column per input.
+
+    """
+    return np.array(list(itertools.product(*axes)), dtype=np.float64).reshape(-1, len(axes))
+
+
+def write_records(sink, results, values, solutions):
+    '''
+    append the results of the cases (as returned by SweepWorker.solve) to sink, in the order of values
+    '''
+    for v, (profile, x, success, nit, residual, elapsed) in zip(values, results):
+        record = dict(values=v, profile=profile, success=success, nit=nit, residual=residual, time=elapsed)
+        if solutions:
+            record['x'] = x
+        sink.append(**record)
+    return
+
+
+def sweep(model_factory, inputs, values, column='column', solver=newton_sparse, max_workers=None,
+          chunksize=None, solutions=False, sink=None):
+    """
+    Solve the model for every row of values, in parallel.
+    Parameters
+    ----------
+    model_factory : callable
+        function with no arguments returning the unit_dict of the model.
+        It is called once in every worker process, so it has to be
+        picklable (a module level function or a functools.partial of one).
+    inputs : list of str
+        names of the inputs, as used by sim_utils.set_input: 'key' for a
+        Specify object, 'key.pressure' and 'key.tray_efficiency' for a
+        SimpleColumn object.
+    values : array
+        values of the inputs, one row per case (e.g. from make_grid or a
+        random sample), shape (n_cases, n_inputs). A 1-d array is read
+        row by row; n_cases may be zero.
+    column : str, optional
+        key of the SimpleColumn object in unit_dict whose profile is
+        returned. The default is 'column'.
+    solver : callable, optional
+        called as solver(xvar, unit_dict, eqns, fun=fun, jac=jac), with the
+        model's sparse_solver.SparseJacobian, returning an OptimizeResult
+        with x, success, fun and nit. The default is
+        sparse_solver.newton_sparse.
+    max_workers : int, optional
+        number of worker processes. The default is the number of cores.
+        With max_workers=1 the cases are solved in this process.
+    chunksize : int, optional
+        number of consecutive cases handed to a worker at a time. The
+        default gives every worker about four chunks, of at most
+        SINK_CHUNKSIZE cases with a sink.
+    solutions : bool, optional
+        if True, the result also holds the variable array of every case
+        (field x). The default is False.
+    sink : ResultWriter, optional
+        if given, the record of every case is appended to sink (e.g. a
+        result_store.ResultWriter) as soon as it is solved, instead of
+        being kept in memory, and None is returned.
+
+    Returns
+    -------
+    result : structured array
+        one record per case with the fields values (n_inputs,), profile
+        (n_trays x n_cols, columns as in SimpleColumn.profile), success,
+        nit, residual (2-norm of the residuals) and time (seconds), and x
+        (n_vars,) with solutions=True.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    assert values.size % len(inputs) == 0, '{} inputs and {} values'.format(len(inputs), values.size)
+    values = values.reshape(-1, len(inputs))
+    n_cases, n_inputs = values.shape
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, n_cases // (4 * max_workers))
+        if sink is not None:
+            chunksize = min(chunksize, SINK_CHUNKSIZE)
+
+    if n_cases == 0:
+        # nothing to solve, no worker is started
+        if sink is not None:
+            return None
+        results = []
+    elif max_workers == 1:
+        init_worker(model_factory, column, solver)
+        if sink is not None:
+            write_records(sink, (solve_case(inputs, v) for v in values), values, solutions)
+            return None
+        results = [solve_case(inputs, v) for v in values]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(model_factory, column, solver)) as executor:
+            if sink is not None:
+                # the cases are submitted in batches of four chunks per worker, so the pending results
+                # do not grow with n_cases
+                batch = 4 * max_workers * chunksize
+                for start in range(0, n_cases, batch):
+                    results = executor.map(solve_case, itertools.repeat(inputs), values[start:start+batch],
+                                           chunksize=chunksize)
+                    write_records(sink, results, values[start:start+batch], solutions)
+                return None
+            results = list(executor.map(solve_case, itertools.repeat(inputs), values, chunksize=chunksize))
+
+    profile_shape = results[0][0].shape if results else (0, 0)
+    fields = [('values', np.float64, (n_inputs,)),
+              ('profile', np.float64, profile_shape),
+              ('success', bool),
+              ('nit', np.int64),
+              ('residual', np.float64),
+              ('time', np.float64)]
+    if solutions:
+        fields.append(('x', np.float64, results[0][1].shape if results else (0,)))
+    result = np.zeros(n_cases, dtype=np.dtype(fields))
+    for i, (profile, x, success, nit, residual, elapsed) in enumerate(results):
+        result[i] = (values[i], profile, success, nit, residual, elapsed) + ((x,) if solutions else ())
+    return result
@@ -1,103 +1,253 @@
-# -*- coding: utf-8 -*-
-"""
-Tray of a distillation column.
-Tray can have efficiency different than 1.
-Equimolal overflow assumed.
-Tray operates at specified pressure.
-"""
-
-import numpy as np
-from unit import Unit
-from phy_props import phy_props
-
-
-class Tray(Unit):
-    
-    global Antoine_A
-    
-    n_trays = 0
-    
-    def __init__(self, liq_stream_in, liq_stream_out, vap_stream_in, vap_stream_out, pressure, tray_efficiency=1, name=None):
-        self.tray_num = Tray.n_trays
-        super().__init__(name, self.tray_num)
-        Tray.n_trays += 1
-        self.liq_stream_in = liq_stream_in
-        self.liq_stream_out = liq_stream_out
-        self.vap_stream_in = vap_stream_in
-        self.vap_stream_out = vap_stream_out
-        self.pressure = pressure
-        self.n_vars = 0
-        self.n_eqns = 2 * self.liq_stream_in.n_comps + 4
-        self.tray_efficiency = tray_efficiency
-        self.xvar = None
-        self.eqns = np.zeros(self.n_eqns, dtype=np.float64)
-        
-
-    def __str__(self):
-        s = 'Tray name: {}\n'.format(self.name)
-        s = s + 'Tray number: {}\n'.format(self.tray_num)
-        s = s + 'Liquid stream in: {}\n'.format(self.liq_stream_in.name)
-        s = s + 'Liquid stream out: {}\n'.format(self.liq_stream_out.name)
-        s = s + 'Vapor stream in: {}\n'.format(self.vap_stream_in.name)
-        s = s + 'Vapor stream out: {}\n'.format(self.vap_stream_out.name)
-        s = s + 'Pressure: {}\n'.format(self.pressure)
-        s = s + 'Tray efficiency: {}\n'.format(self.tray_efficiency)
-        s = s + super().__str__()
-        return s
-    
-    def calculate(self):
-        
-        global Antoine_A
-        global Antoine_B
-        global Antoine_C
-        
-        # total mass balance: 1 equation
-        self.eqns[0] = self.liq_stream_in.xvar[0] + self.vap_stream_in.xvar[0] - \
-            self.liq_stream_out.xvar[0] - self.vap_stream_out.xvar[0]
-        # heat balance (simple: equimolal overflow. 1 equation)
-        self.eqns[1] = self.liq_stream_in.xvar[0] - self.liq_stream_out.xvar[0]
-        # heat balance (simple: liquid and vapor leaving tray have the same temperatures. 1 equation)
-        self.eqns[2] = self.vap_stream_out.xvar[1] - self.liq_stream_out.xvar[1]
-        # fractions sum to one (2 equations)
-#        sum_x = -1
-#        sum_y = -1
-#        for i_comp in range(self.liq_stream_in.n_comps):
-#            sum_x += self.liq_stream_out.xvar[2+i_comp]
-#            sum_y += self.vap_stream_out.xvar[2+i_comp]
-#        self.eqns[3] = sum_x
-#        self.eqns[4] = sum_y
-        # vectorized version of above
-        self.eqns[3] = sum(self.liq_stream_out.xvar[2:]) - 1
-        self.eqns[4] = sum(self.vap_stream_out.xvar[2:]) - 1
-        # component balances (n_comps equations)
-        n_comps = self.liq_stream_in.n_comps
-#        for i_comp in range(self.liq_stream_in.n_comps-1):
-#            self.eqns[5+i_comp] = self.liq_stream_in.xvar[0] * self.liq_stream_in.xvar[2+i_comp] + \
-#                self.vap_stream_in.xvar[0] * self.vap_stream_in.xvar[2+i_comp] - \
-#                self.liq_stream_out.xvar[0] * self.liq_stream_out.xvar[2+i_comp] - \
-#                self.vap_stream_out.xvar[0] * self.vap_stream_out.xvar[2+i_comp]
-        # vectorized version of above
-        self.eqns[5:5+n_comps-1] = self.liq_stream_in.xvar[0] * self.liq_stream_in.xvar[2:2+n_comps-1] + \
-            self.vap_stream_in.xvar[0] * self.vap_stream_in.xvar[2:2+n_comps-1] - \
-            self.liq_stream_out.xvar[0] * self.liq_stream_out.xvar[2:2+n_comps-1] - \
-            self.vap_stream_out.xvar[0] * self.vap_stream_out.xvar[2:2+n_comps-1]
-        # vapor-liquid equilibrium (n_comps equations)
-#        for i_comp in range(self.liq_stream_in.n_comps):
-#            K_eq = np.power(10, phy_props['Antoine_A'][i_comp] - phy_props['Antoine_B'][i_comp] / (phy_props['Antoine_C'][i_comp] + self.liq_stream_out.xvar[1])) / self.pressure
-#            K_eq = self.tray_efficiency * K_eq + (1 - self.tray_efficiency)
-#            self.eqns[4+self.liq_stream_in.n_comps+i_comp] = self.vap_stream_out.xvar[2+i_comp] - \
-#                K_eq * self.liq_stream_out.xvar[2+i_comp]
-        # vectorized version of above
-            # vectorizing the equilibrium calculation resulted in a significant speed improvement
-        K_eq = np.power(10, phy_props['Antoine_A'] - phy_props['Antoine_B'] / (phy_props['Antoine_C'] + self.liq_stream_out.xvar[1])) / self.pressure
-        K_eq = self.tray_efficiency * K_eq + (1 - self.tray_efficiency)
-        self.eqns[4+n_comps:4+2*n_comps] = self.vap_stream_out.xvar[2:2+n_comps] - K_eq * self.liq_stream_out.xvar[2:2+n_comps]
-        return
-    
-    def update_pressure(self, pressure):
-        self.pressure = pressure
-        return
-    
-    def update_tray_efficiency(self, tray_efficiency):
-        self.tray_efficiency = tray_efficiency
+# -*- coding: utf-8 -*-
+"""
+Tray of a distillation column.
+Tray can have efficiency different than 1.
+Equimolal overflow assumed.
+Tray operates at specified pressure.
+In dynamic mode the tray has a liquid holdup (its own variable). The mass
+and component balances include the accumulation of the holdups, the vapor
+flow in equals the vapor flow out, and the liquid flow out is given by a
+weir equation.
+"""
+
+import functools
+import numpy as np
+from unit import Unit
+from flowsheet import current_flowsheet
+
+
+@functools.lru_cache(maxsize=None)
+def zero_accumulation(n_comps):
+    '''
+    return the read-only zero accumulation of the steady state, shared by the trays with n_comps components
+    '''
+    acc_hist = np.zeros(n_comps, dtype=np.float64)
+    acc_hist.setflags(write=False)
+    return acc_hist
+
+
+class Tray(Unit):
+    
+    # no __dict__: large flowsheets have many trays
+    __slots__ = ('tray_num', 'liq_stream_in', 'liq_stream_out', 'vap_stream_in', 'vap_stream_out', 'pressure',
+                 'n_vars', 'n_eqns', 'tray_efficiency', 'dynamic', 'weir_holdup', 'weir_coef', 'acc_coef',
+                 'acc_hist', 'components', 'k_model', 'k_eq_key', 'k_eq_value')
+    
+    def __init__(self, liq_stream_in, liq_stream_out, vap_stream_in, vap_stream_out, pressure, tray_efficiency=1,
+                 components=None, dynamic=False, weir_holdup=1.0, weir_coef=100.0, name=None):
+        '''
+        dynamic adds the liquid holdup of the tray as a variable. the liquid flow out is
+        weir_coef * (holdup - weir_holdup)**1.5 (zero below weir_holdup).
+        '''
+        self.tray_num = current_flowsheet().number(Tray)
+        super().__init__(name, self.tray_num, leaf=True)
+        self.liq_stream_in = liq_stream_in
+        self.liq_stream_out = liq_stream_out
+        self.vap_stream_in = vap_stream_in
+        self.vap_stream_out = vap_stream_out
+        self.pressure = pressure
+        self.n_vars = 0
+        self.n_eqns = 2 * self.liq_stream_in.n_comps + 4
+        self.tray_efficiency = tray_efficiency
+        self.dynamic = dynamic
+        self.weir_holdup = weir_holdup
+        self.weir_coef = weir_coef
+        # accumulation of the holdups (total and all components except the last one) is
+        # acc_coef * holdups + acc_hist, set by the integrator. zero for a steady state
+        self.acc_coef = 0.0
+        self.acc_hist = zero_accumulation(self.liq_stream_in.n_comps)
+        # ComponentSet of the streams (the components of the current flowsheet if not given)
+        if components is None:
+            components = current_flowsheet().components
+        assert components.n_comps == self.liq_stream_in.n_comps, \
+            '{}: {} components and {} fractions per stream'.format(self.name, components.n_comps,
+                                                                   self.liq_stream_in.n_comps)
+        self.components = components
+        # simplified K model used instead of the Antoine K values if not None: a callable of the
+        # temperature returning K_eq and dK_eq like k_eq (see inside_out.py)
+        self.k_model = None
+        # last (temperature, pressure, efficiency) and K values returned by k_eq
+        self.k_eq_key = None
+        self.k_eq_value = None
+        self.xvar = None
+        if self.dynamic:
+            # liquid holdup, initialised at the holdup for a liquid flow of 100
+            self.n_vars = 1
+            self.n_eqns += 1
+            self.xvar = np.array([self.weir_holdup + (100 / self.weir_coef)**(2/3)], dtype=np.float64)
+        self.eqns = np.zeros(self.n_eqns, dtype=np.float64)
+        
+
+    def __str__(self):
+        s = 'Tray name: {}\n'.format(self.name)
+        s = s + 'Tray number: {}\n'.format(self.tray_num)
+        s = s + 'Liquid stream in: {}\n'.format(self.liq_stream_in.name)
+        s = s + 'Liquid stream out: {}\n'.format(self.liq_stream_out.name)
+        s = s + 'Vapor stream in: {}\n'.format(self.vap_stream_in.name)
+        s = s + 'Vapor stream out: {}\n'.format(self.vap_stream_out.name)
+        s = s + 'Pressure: {}\n'.format(self.pressure)
+        s = s + 'Tray efficiency: {}\n'.format(self.tray_efficiency)
+        if self.dynamic:
+            s = s + 'Holdup: {}\n'.format(self.xvar[0])
+        s = s + super().__str__()
+        return s
+    
+    def calculate(self):
+        
+        # total mass balance: 1 equation
+        self.eqns[..., 0] = self.liq_stream_in.xvar[..., 0] + self.vap_stream_in.xvar[..., 0] - \
+            self.liq_stream_out.xvar[..., 0] - self.vap_stream_out.xvar[..., 0]
+        # heat balance (simple: equimolal overflow. 1 equation)
+        self.eqns[..., 1] = self.liq_stream_in.xvar[..., 0] - self.liq_stream_out.xvar[..., 0]
+        if self.dynamic:
+            # accumulation of the holdups; equimolal overflow applies to the vapor, the liquid flow
+            # out follows the holdup (weir equation below)
+            acc = self.accumulation()
+            self.eqns[..., 0] -= acc[..., 0]
+            self.eqns[..., 1] = self.vap_stream_in.xvar[..., 0] - self.vap_stream_out.xvar[..., 0]
+        # heat balance (simple: liquid and vapor leaving tray have the same temperatures. 1 equation)
+        self.eqns[..., 2] = self.vap_stream_out.xvar[..., 1] - self.liq_stream_out.xvar[..., 1]
+        # fractions sum to one (2 equations)
+#        sum_x = -1
+#        sum_y = -1
+#        for i_comp in range(self.liq_stream_in.n_comps):
+#            sum_x += self.liq_stream_out.xvar[2+i_comp]
+#            sum_y += self.vap_stream_out.xvar[2+i_comp]
+#        self.eqns[3] = sum_x
+#        self.eqns[4] = sum_y
+        # vectorized version of above
+        self.eqns[..., 3] = np.sum(self.liq_stream_out.xvar[..., 2:], axis=-1) - 1
+        self.eqns[..., 4] = np.sum(self.vap_stream_out.xvar[..., 2:], axis=-1) - 1
+        # component balances (n_comps equations)
+        n_comps = self.liq_stream_in.n_comps
+#        for i_comp in range(self.liq_stream_in.n_comps-1):
+#            self.eqns[5+i_comp] = self.liq_stream_in.xvar[0] * self.liq_stream_in.xvar[2+i_comp] + \
+#                self.vap_stream_in.xvar[0] * self.vap_stream_in.xvar[2+i_comp] - \
+#                self.liq_stream_out.xvar[0] * self.liq_stream_out.xvar[2+i_comp] - \
+#                self.vap_stream_out.xvar[0] * self.vap_stream_out.xvar[2+i_comp]
+        # vectorized version of above
+        self.eqns[..., 5:5+n_comps-1] = self.liq_stream_in.xvar[..., 0:1] * self.liq_stream_in.xvar[..., 2:2+n_comps-1] + \
+            self.vap_stream_in.xvar[..., 0:1] * self.vap_stream_in.xvar[..., 2:2+n_comps-1] - \
+            self.liq_stream_out.xvar[..., 0:1] * self.liq_stream_out.xvar[..., 2:2+n_comps-1] - \
+            self.vap_stream_out.xvar[..., 0:1] * self.vap_stream_out.xvar[..., 2:2+n_comps-1]
+        if self.dynamic:
+            self.eqns[..., 5:5+n_comps-1] -= acc[..., 1:]
+        # vapor-liquid equilibrium (n_comps equations)
+#        for i_comp in range(self.liq_stream_in.n_comps):
+#            K_eq = np.power(10, phy_props['Antoine_A'][i_comp] - phy_props['Antoine_B'][i_comp] / (phy_props['Antoine_C'][i_comp] + self.liq_stream_out.xvar[1])) / self.pressure
+#            K_eq = self.tray_efficiency * K_eq + (1 - self.tray_efficiency)
+#            self.eqns[4+self.liq_stream_in.n_comps+i_comp] = self.vap_stream_out.xvar[2+i_comp] - \
+#                K_eq * self.liq_stream_out.xvar[2+i_comp]
+        # vectorized version of above
+            # vectorizing the equilibrium calculation resulted in a significant speed improvement
+        K_eq, _ = self.k_eq(self.liq_stream_out.xvar[..., 1:2])
+        self.eqns[..., 4+n_comps:4+2*n_comps] = self.vap_stream_out.xvar[..., 2:2+n_comps] - \
+            K_eq * self.liq_stream_out.xvar[..., 2:2+n_comps]
+        if self.dynamic:
+            # weir equation
+            self.eqns[..., 4+2*n_comps] = self.liq_stream_out.xvar[..., 0] - \
+                self.weir_coef * np.maximum(self.xvar[..., 0] - self.weir_holdup, 0)**1.5
+        return
+    
+    def holdups(self):
+        '''
+        return the liquid holdups of the tray: total and of each component except the last one
+        '''
+        holdup = self.xvar[..., 0:1]
+        n_comps = self.liq_stream_out.n_comps
+        return np.concatenate((holdup, holdup * self.liq_stream_out.xvar[..., 2:1+n_comps]), axis=-1)
+    
+    def accumulation(self):
+        '''
+        return the rate of accumulation of the holdups, as given by the integration formula
+        '''
+        return self.acc_coef * self.holdups() + self.acc_hist
+    
+    def k_eq(self, temperature):
+        '''
+        return the equilibrium constant of each component (corrected for tray efficiency) and
+        its derivative with respect to the tray temperature
+        the values are reused while the temperature, pressure and efficiency of the tray are unchanged
+        (e.g. while the finite differences perturb variables of other units)
+        '''
+        if self.k_model is not None:
+            return self.k_model(temperature)
+        key = None
+        if np.size(temperature) == 1:
+            key = (float(np.ravel(temperature)[0]), self.pressure, self.tray_efficiency)
+            if key == self.k_eq_key:
+                return self.k_eq_value
+        K_eq, dK_eq = self.components.k_values(temperature, self.pressure, self.tray_efficiency)
+        if key is not None:
+            self.k_eq_key = key
+            self.k_eq_value = (K_eq, dK_eq)
+        return K_eq, dK_eq
+    
+    def jacobian(self):
+        n_comps = self.liq_stream_in.n_comps
+        d_liq_in = np.zeros((self.n_eqns, self.liq_stream_in.n_vars), dtype=np.float64)
+        d_vap_in = np.zeros((self.n_eqns, self.vap_stream_in.n_vars), dtype=np.float64)
+        d_liq_out = np.zeros((self.n_eqns, self.liq_stream_out.n_vars), dtype=np.float64)
+        d_vap_out = np.zeros((self.n_eqns, self.vap_stream_out.n_vars), dtype=np.float64)
+        # total mass balance
+        d_liq_in[0, 0] = 1
+        d_vap_in[0, 0] = 1
+        d_liq_out[0, 0] = -1
+        d_vap_out[0, 0] = -1
+        # equimolal overflow
+        d_liq_in[1, 0] = 1
+        d_liq_out[1, 0] = -1
+        # liquid and vapor leaving at the same temperature
+        d_vap_out[2, 1] = 1
+        d_liq_out[2, 1] = -1
+        # fractions sum to one
+        d_liq_out[3, 2:] = 1
+        d_vap_out[4, 2:] = 1
+        # component balances (all components except the last one)
+        rows = np.arange(5, 4+n_comps)
+        cols = np.arange(2, 1+n_comps)
+        d_liq_in[rows, 0] = self.liq_stream_in.xvar[2:1+n_comps]
+        d_liq_in[rows, cols] = self.liq_stream_in.xvar[0]
+        d_vap_in[rows, 0] = self.vap_stream_in.xvar[2:1+n_comps]
+        d_vap_in[rows, cols] = self.vap_stream_in.xvar[0]
+        d_liq_out[rows, 0] = -self.liq_stream_out.xvar[2:1+n_comps]
+        d_liq_out[rows, cols] = -self.liq_stream_out.xvar[0]
+        d_vap_out[rows, 0] = -self.vap_stream_out.xvar[2:1+n_comps]
+        d_vap_out[rows, cols] = -self.vap_stream_out.xvar[0]
+        # vapor-liquid equilibrium
+        K_eq, dK_eq = self.k_eq(self.liq_stream_out.xvar[1])
+        rows = np.arange(4+n_comps, 4+2*n_comps)
+        cols = np.arange(2, 2+n_comps)
+        d_vap_out[rows, cols] = 1
+        d_liq_out[rows, cols] = -K_eq
+        d_liq_out[rows, 1] = -dK_eq * self.liq_stream_out.xvar[2:2+n_comps]
+        partials = [(self.liq_stream_in, d_liq_in), (self.vap_stream_in, d_vap_in),
+                    (self.liq_stream_out, d_liq_out), (self.vap_stream_out, d_vap_out)]
+        if self.dynamic:
+            holdup = self.xvar[0]
+            d_holdup = np.zeros((self.n_eqns, self.n_vars), dtype=np.float64)
+            # accumulation in the total mass balance
+            d_holdup[0, 0] = -self.acc_coef
+            # equimolal overflow of the vapor instead of the liquid
+            d_liq_in[1, 0] = 0
+            d_liq_out[1, 0] = 0
+            d_vap_in[1, 0] = 1
+            d_vap_out[1, 0] = -1
+            # accumulation in the component balances
+            rows = np.arange(5, 4+n_comps)
+            cols = np.arange(2, 1+n_comps)
+            d_holdup[rows, 0] = -self.acc_coef * self.liq_stream_out.xvar[2:1+n_comps]
+            d_liq_out[rows, cols] -= self.acc_coef * holdup
+            # weir equation
+            d_liq_out[4+2*n_comps, 0] = 1
+            d_holdup[4+2*n_comps, 0] = -1.5 * self.weir_coef * np.maximum(holdup - self.weir_holdup, 0)**0.5
+            partials.append((self, d_holdup))
+        return partials
+    
+    def update_pressure(self, pressure):
+        self.pressure = pressure
+        return
+    
+    def update_tray_efficiency(self, tray_efficiency):
+        self.tray_efficiency = tray_efficiency
         return
\ No newline at end of file
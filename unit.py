@@ -1,42 +1,118 @@
-# -*- coding: utf-8 -*-
-"""
-Parent class for classes for processing equipment and material streams.
-"""
-
-class Unit():
-    def __init__(self, name, num):
-        self.xvar = None
-        self.eqns = None
-        self.unit_dict = dict()
-        if name is None:
-            self.name = type(self).__name__ + str(num)
-        else:
-            self.name = name
-            
-    def __str__(self):
-        s = 'Number of equations: {}\n'.format(self.n_eqns)
-        s = s + 'Equations: {}\n'.format(self.eqns)
-        s = s + 'Number of variables: {}\n'.format(self.n_vars)
-        if self.xvar is None:
-            s = s + 'Variables: {}\n'.format(self.xvar)
-        else:
-            s = s + 'Flow rate: {}\n'.format(self.xvar[0])
-            s = s + 'Temperature: {}\n'.format(self.xvar[1])
-            s = s + 'Fractions: {}\n'.format(self.xvar[2:])
-        return s
-    
-        
-    def num_eqns(self):
-        num = self.n_eqns
-        for u in self.unit_dict:
-            num += self.unit_dict[u].num_eqns()
-        return num        
-    
-
-    def num_vars(self):
-        num = self.n_vars
-        for u in self.unit_dict:
-            num += self.unit_dict[u].num_vars()
-        return num        
-    
+# -*- coding: utf-8 -*-
+"""
+Parent class for classes for processing equipment and material streams.
+The attributes common to all units are slots. Subclasses without __slots__
+(all but Stream and Tray) also have a __dict__ for their own attributes.
+The calculate methods index the variables and equations as xvar[..., i] and
+eqns[..., i], since they may have leading batch dimensions (see
+sim_utils.process_eqns_batch).
+"""
+
+
+class NoUnits(dict):
+    '''
+    empty unit_dict of the units that cannot contain other units, shared by all of them (NO_UNITS)
+    '''
+    
+    def read_only(self, *args, **kwargs):
+        raise TypeError('units of this type cannot contain other units')
+    
+    __setitem__ = __delitem__ = __ior__ = read_only
+    update = setdefault = pop = popitem = clear = read_only
+    
+    def __reduce__(self):
+        # pickled as the shared instance
+        return 'NO_UNITS'
+
+
+NO_UNITS = NoUnits()
+
+
+class Unit():
+    
+    __slots__ = ('name', 'xvar', 'eqns', 'unit_dict')
+    
+    def __init__(self, name, num, leaf=False):
+        '''
+        leaf units (e.g. streams) cannot contain other units and share NO_UNITS as unit_dict
+        '''
+        self.xvar = None
+        self.eqns = None
+        self.unit_dict = NO_UNITS if leaf else dict()
+        if name is None:
+            self.name = type(self).__name__ + str(num)
+        else:
+            self.name = name
+            
+    def __str__(self):
+        s = 'Number of equations: {}\n'.format(self.n_eqns)
+        s = s + 'Equations: {}\n'.format(self.eqns)
+        s = s + 'Number of variables: {}\n'.format(self.n_vars)
+        if self.xvar is None or self.n_vars < 2:
+            s = s + 'Variables: {}\n'.format(self.xvar)
+        else:
+            s = s + 'Flow rate: {}\n'.format(self.xvar[0])
+            s = s + 'Temperature: {}\n'.format(self.xvar[1])
+            s = s + 'Fractions: {}\n'.format(self.xvar[2:])
+        return s
+    
+        
+    def num_eqns(self):
+        num = self.n_eqns
+        for u in self.unit_dict:
+            num += self.unit_dict[u].num_eqns()
+        return num        
+    
+
+    def num_vars(self):
+        num = self.n_vars
+        for u in self.unit_dict:
+            num += self.unit_dict[u].num_vars()
+        return num        
+    
+
+    def jacobian(self):
+        '''
+        return the analytic partial derivatives of eqns with respect to the variables they depend on
+        the result is a list of (unit, partials) tuples, where partials is an array of shape
+        (n_eqns, unit.n_vars) holding the derivatives with respect to unit.xvar
+        a unit without equations returns an empty list
+        a unit without analytic derivatives returns None
+        '''
+        if self.n_eqns == 0:
+            return []
+        return None
+    
+
+    def attr_values(self):
+        '''
+        return the values of the attributes of the unit: those in its __dict__ and in the slots of its
+        class (not those common to all units)
+        '''
+        values = list(getattr(self, '__dict__', NO_UNITS).values())
+        for cls in type(self).__mro__:
+            if cls is Unit:
+                break
+            values.extend(getattr(self, a, None) for a in cls.__dict__.get('__slots__', ()))
+        return values
+    
+
+    def var_units(self):
+        '''
+        return the units whose variables the equations of this unit depend on
+        found from the Unit objects (and lists of Unit objects) held as attributes,
+        plus the unit itself if it has variables of its own
+        '''
+        units = []
+        if self.n_vars > 0:
+            units.append(self)
+        for attr in self.attr_values():
+            if isinstance(attr, Unit):
+                attr = [attr]
+            if isinstance(attr, (list, tuple)):
+                for u in attr:
+                    if isinstance(u, Unit) and u.n_vars > 0 and u not in units:
+                        units.append(u)
+        return units
+
     
\ No newline at end of file